@@ -0,0 +1,41 @@
+"""Add indexed month-day birthday key to contacts and their user links
+
+Revision ID: 53bcaf120035
+Revises: 61df919d2e3b
+Create Date: 2026-10-17 11:20:05.771930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '53bcaf120035'
+down_revision: Union[str, None] = '61df919d2e3b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('birthday_key', sa.SmallInteger(), nullable=True))
+    op.execute(
+        "UPDATE contacts "
+        "SET birthday_key = EXTRACT(MONTH FROM birthday) * 100 + EXTRACT(DAY FROM birthday) "
+        "WHERE birthday IS NOT NULL"
+    )
+    op.add_column('user_contact', sa.Column('birthday_key', sa.SmallInteger(), nullable=True))
+    op.execute(
+        "UPDATE user_contact SET birthday_key = "
+        "(SELECT contacts.birthday_key FROM contacts WHERE contacts.id = user_contact.contact_id)"
+    )
+    op.create_index(
+        'ix_user_contact_user_birthday_key', 'user_contact', ['user_id', 'birthday_key', 'contact_id'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_contact_user_birthday_key', table_name='user_contact')
+    op.drop_column('user_contact', 'birthday_key')
+    op.drop_column('contacts', 'birthday_key')
@@ -0,0 +1,37 @@
+"""Add trigram search column and index to contacts
+
+Revision ID: 61df919d2e3b
+Revises: 942c25f68e3d
+Create Date: 2026-10-17 10:41:37.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+SEARCH_EXPRESSION = (
+    "lower(coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' || "
+    "coalesce(email, '') || ' ' || coalesce(phone, ''))"
+)
+
+
+# revision identifiers, used by Alembic.
+revision: str = '61df919d2e3b'
+down_revision: Union[str, None] = '942c25f68e3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.add_column('contacts', sa.Column('search_text', sa.String(), sa.Computed(SEARCH_EXPRESSION, persisted=True)))
+    op.create_index(
+        'ix_contacts_search_text_trgm', 'contacts', ['search_text'], unique=False,
+        postgresql_using='gin', postgresql_ops={'search_text': 'gin_trgm_ops'}
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_search_text_trgm', table_name='contacts')
+    op.drop_column('contacts', 'search_text')
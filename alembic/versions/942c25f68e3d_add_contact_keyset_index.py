@@ -0,0 +1,55 @@
+"""Add per-user keyset index and prefix filter indexes for contact pages
+
+Revision ID: 942c25f68e3d
+Revises: 445e140f3f29
+Create Date: 2026-10-17 10:02:11.418502
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '942c25f68e3d'
+down_revision: Union[str, None] = '445e140f3f29'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('user_contact', sa.Column('last_name', sa.String(), nullable=True))
+    op.add_column('user_contact', sa.Column('first_name', sa.String(), nullable=True))
+    op.execute(
+        "UPDATE user_contact SET "
+        "last_name = (SELECT contacts.last_name FROM contacts WHERE contacts.id = user_contact.contact_id), "
+        "first_name = (SELECT contacts.first_name FROM contacts WHERE contacts.id = user_contact.contact_id)"
+    )
+    op.create_index(
+        'ix_user_contact_user_last_first', 'user_contact',
+        ['user_id', 'last_name', 'first_name', 'contact_id'], unique=False
+    )
+    op.create_index(
+        'ix_contacts_first_name_pattern', 'contacts', [sa.text('lower(first_name) text_pattern_ops')], unique=False
+    )
+    op.create_index(
+        'ix_contacts_last_name_pattern', 'contacts', [sa.text('lower(last_name) text_pattern_ops')], unique=False
+    )
+    op.create_index(
+        'ix_contacts_email_pattern', 'contacts', [sa.text('lower(email) text_pattern_ops')], unique=False
+    )
+    op.create_index(
+        'ix_contacts_phone_pattern', 'contacts', ['phone'], unique=False,
+        postgresql_ops={'phone': 'text_pattern_ops'}
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_phone_pattern', table_name='contacts')
+    op.drop_index('ix_contacts_email_pattern', table_name='contacts')
+    op.drop_index('ix_contacts_last_name_pattern', table_name='contacts')
+    op.drop_index('ix_contacts_first_name_pattern', table_name='contacts')
+    op.drop_index('ix_user_contact_user_last_first', table_name='user_contact')
+    op.drop_column('user_contact', 'first_name')
+    op.drop_column('user_contact', 'last_name')
@@ -0,0 +1,33 @@
+"""Add contact versions and per-user contact list versions
+
+Revision ID: b7c1e4a9d203
+Revises: 24eaf0d92052
+Create Date: 2026-10-17 15:02:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7c1e4a9d203'
+down_revision: Union[str, None] = '24eaf0d92052'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('contacts', sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=False))
+    op.execute("UPDATE contacts SET updated_at = timezone('utc', now())")
+    op.add_column('users', sa.Column('contacts_version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('contacts_updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'contacts_updated_at')
+    op.drop_column('users', 'contacts_version')
+    op.drop_column('contacts', 'updated_at')
+    op.drop_column('contacts', 'version')
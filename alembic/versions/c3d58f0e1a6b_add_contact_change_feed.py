@@ -0,0 +1,47 @@
+"""Add contact change sequence and tombstones
+
+Revision ID: c3d58f0e1a6b
+Revises: b7c1e4a9d203
+Create Date: 2026-10-17 16:24:09.502716
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3d58f0e1a6b'
+down_revision: Union[str, None] = 'b7c1e4a9d203'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Links left behind by contact deletes that did not remove them.
+    op.execute("DELETE FROM user_contact WHERE contact_id NOT IN (SELECT id FROM contacts)")
+    op.add_column('user_contact', sa.Column('change_seq', sa.Integer(), server_default='0', nullable=False))
+    op.create_index(
+        'ix_user_contact_user_change_seq', 'user_contact', ['user_id', 'change_seq', 'contact_id'], unique=False
+    )
+    op.create_table(
+        'contact_tombstones',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('contact_id', sa.Integer(), nullable=False),
+        sa.Column('change_seq', sa.Integer(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id', 'contact_id')
+    )
+    op.create_index(
+        'ix_contact_tombstones_user_change_seq', 'contact_tombstones', ['user_id', 'change_seq', 'contact_id'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contact_tombstones_user_change_seq', table_name='contact_tombstones')
+    op.drop_table('contact_tombstones')
+    op.drop_index('ix_user_contact_user_change_seq', table_name='user_contact')
+    op.drop_column('user_contact', 'change_seq')
@@ -1,90 +1,435 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from database import get_db
-from schemas.contacts import ContactCreate, ContactRead
+import hashlib
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date
+from typing import List, Optional
+from database import get_db, get_read_db, get_session_factory
+from schemas.contacts import (
+    ContactBatch, ContactBatchReport, ContactChangesPage, ContactCreate, ContactCreateResult, ContactRead, ContactPage,
+    ContactRecord, ContactRecordPage, ContactRecordSearchPage, ContactSearchPage, ContactImportReport
+)
 from repository.contacts import (
+    ContactVersionConflict,
+    apply_contact_batch,
     create_contact,
-    get_user_contacts,
+    decode_change_cursor,
+    encode_change_cursor,
+    get_contact_changes,
+    get_contact_version,
+    get_list_version,
+    get_list_versions,
+    get_user_contacts_page,
     get_contact_by_id,
     update_contact,
-    delete_contact,
-    get_upcoming_birthdays
+    delete_contact as remove_contact,
+    get_upcoming_birthdays,
+    search_contacts
+)
+from auth import Principal, get_current_user, is_admin
+from services.cache import ContactListCache, get_contact_cache
+from services.conditional import (
+    PreconditionFailedError, contact_etag, has_conditions, if_match_versions, is_not_modified, list_etag,
+    not_modified, validator_headers
 )
-from auth import get_current_user
+from services.events import ContactEventHub, get_contact_events
+from services.exporter import EXPORT_MEDIA_TYPES, export_contacts as run_export
+from services.importer import ImportFormatError, import_contacts as run_import, iter_csv_rows, iter_lines, iter_ndjson_rows
+from services.redis_client import redis_client
 
 router = APIRouter()
 
-@router.get("/", response_model=List[ContactRead])
+IMPORT_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+
+# Contact lists are serialized from repository rows in one call, skipping ORM objects and re-validation.
+CONTACT_RECORDS = TypeAdapter(List[ContactRecord])
+CONTACT_RECORD_PAGE = TypeAdapter(ContactRecordPage)
+CONTACT_RECORD_SEARCH_PAGE = TypeAdapter(ContactRecordSearchPage)
+CONTACT_RECORD = TypeAdapter(ContactRecord)
+CONTACT_BATCH_REPORT = TypeAdapter(ContactBatchReport)
+
+BATCH_STATUS = {
+    "found": 200, "created": 201, "linked": 200, "existing": 200, "updated": 200, "unchanged": 200,
+    "deleted": 204, "not_found": 404, "conflict": 412,
+}
+
+def json_response(payload: bytes, headers: Optional[dict] = None) -> Response:
+    return Response(content=payload, media_type="application/json", headers=headers)
+
+def contact_records(rows) -> List[dict]:
+    return [row._asdict() for row in rows]
+
+async def list_validators(db: AsyncSession, cache: ContactListCache, user_id: int):
+    """
+    Return the user's ``(list version, updated_at)`` and whether it was read from ``db``.
+
+    The cache answers when it has the version; otherwise it is read from ``db`` and cached.
+    """
+    validators = await cache.get_version(user_id)
+    if validators is not None:
+        return validators, False
+    validators = await get_list_version(db, user_id)
+    await cache.set_versions({user_id: validators})
+    return validators, True
+
+async def retire_cached_lists(db: AsyncSession, cache: ContactListCache, user_ids):
+    """Store the committed list versions of ``user_ids`` in the cache, retiring responses cached before the write."""
+    await cache.set_versions(await get_list_versions(db, set(user_ids)))
+
+@router.get("/", response_model=ContactPage)
 async def get_contacts(
-        db: Session = Depends(get_db),
-        current_user=Depends(get_current_user)
+        request: Request,
+        limit: int = Query(50, ge=1, le=200),
+        cursor: Optional[str] = None,
+        name: Optional[str] = None,
+        email: Optional[str] = None,
+        phone: Optional[str] = None,
+        db: AsyncSession = Depends(get_read_db),
+        cache: ContactListCache = Depends(get_contact_cache),
+        current_user: Principal = Depends(get_current_user)
 ):
     """
-    Retrieve a list of contacts for the authenticated user.
+    Retrieve one page of contacts for the authenticated user.
+
+    Contacts are ordered by last name, first name and id. Pass ``next_cursor`` or
+    ``prev_cursor`` from a previous page as ``cursor`` to move through the list;
+    ``name``, ``email`` and ``phone`` filter by prefix.
+
+    Pages carry an ``ETag`` and ``Last-Modified`` derived from the user's list
+    version, which the cache keeps alongside the pages: a cached page, or a 304
+    for a matching ``If-None-Match``, is answered from Redis alone. The database
+    is read for the version only when Redis does not have it.
     """
-    return get_user_contacts(db, current_user.id)
+    variant = f"list:{limit}:{cursor}:{name}:{email}:{phone}"
+    variant_digest = hashlib.sha1(variant.encode()).hexdigest()[:12]
+    (list_version, last_modified), from_db = await list_validators(db, cache, current_user.id)
+    etag = list_etag(list_version, variant_digest)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+
+    payload = await cache.get(current_user.id, list_version, variant)
+    if payload is not None:
+        return json_response(payload, validator_headers(etag, last_modified))
+
+    if not from_db:
+        # Render and file the page under the version this session sees, so a lagging
+        # replica cannot put an older page under a newer version.
+        list_version, last_modified = await get_list_version(db, current_user.id)
+        etag = list_etag(list_version, variant_digest)
+    try:
+        items, next_cursor, prev_cursor = await get_user_contacts_page(
+            db, current_user.id, limit=limit, cursor=cursor, name=name, email=email, phone=phone
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    payload = CONTACT_RECORD_PAGE.dump_json(
+        {"items": contact_records(items), "next_cursor": next_cursor, "prev_cursor": prev_cursor}
+    )
+    await cache.set(current_user.id, list_version, variant, payload)
+    return json_response(payload, validator_headers(etag, last_modified))
 
-@router.post("/", response_model=ContactRead, status_code=201)
+@router.get("/search", response_model=ContactSearchPage)
+async def search(
+        q: str = Query(..., min_length=1, max_length=100),
+        limit: int = Query(20, ge=1, le=100),
+        offset: int = Query(0, ge=0),
+        db: AsyncSession = Depends(get_read_db),
+        current_user: Principal = Depends(get_current_user)
+):
+    """
+    Search the authenticated user's contacts by name, email or phone.
+
+    Matches prefixes, substrings and near-misses (typos); results are ranked
+    best first and paged with ``limit``/``offset``.
+    """
+    items, next_offset = await search_contacts(db, current_user.id, q, limit=limit, offset=offset)
+    return json_response(CONTACT_RECORD_SEARCH_PAGE.dump_json({"items": contact_records(items), "next_offset": next_offset}))
+
+@router.post("/", response_model=ContactCreateResult, status_code=201)
 async def create_new_contact(
         contact: ContactCreate,
-        db: Session = Depends(get_db),
-        current_user=Depends(get_current_user)
+        response: Response,
+        db: AsyncSession = Depends(get_db),
+        cache: ContactListCache = Depends(get_contact_cache),
+        events: ContactEventHub = Depends(get_contact_events),
+        current_user: Principal = Depends(get_current_user)
+):
+    """
+    Create a new contact, or link the existing contact with the same email.
+
+    Responds 201 when the contact was created and 200 when an existing one was
+    linked (``result`` is ``"linked"``) or was already in the list (``"existing"``).
+    """
+    db_contact, result = await create_contact(db, contact, current_user.id)
+    created = ContactRead.model_validate(db_contact, from_attributes=True)
+    if result != "existing":
+        await retire_cached_lists(db, cache, [current_user.id])
+        await events.publish([current_user.id], "create", created.model_dump(mode="json"))
+    if result != "created":
+        response.status_code = 200
+    return {**created.model_dump(), "result": result}
+
+@router.post("/batch", response_model=ContactBatchReport)
+async def batch_contacts(
+        batch: ContactBatch,
+        db: AsyncSession = Depends(get_db),
+        cache: ContactListCache = Depends(get_contact_cache),
+        events: ContactEventHub = Depends(get_contact_events),
+        current_user: Principal = Depends(get_current_user)
+):
+    """
+    Apply a list of ``get``, ``create``, ``update`` and ``delete`` operations in one transaction.
+
+    Each contact id (and each new email) may appear once. ``update`` and ``delete``
+    take an optional ``version`` that works like ``If-Match``. Results come back in
+    operation order, each with the HTTP status the single-contact route would have
+    answered. A failed operation (404 or 412) does not stop the others. If a
+    concurrent writer gets in the way, nothing is applied and the batch is answered
+    with 412.
+    """
+    try:
+        outcomes, linked_user_ids = await apply_contact_batch(db, current_user.id, batch.operations)
+    except ContactVersionConflict:
+        raise PreconditionFailedError()
+
+    results, changed_users, published = [], set(), []
+    for operation, (outcome, record) in zip(batch.operations, outcomes):
+        contact_id = record["id"] if record is not None else operation.id
+        results.append({
+            "op": operation.op, "id": contact_id, "status": BATCH_STATUS[outcome], "result": outcome, "contact": record
+        })
+        if outcome in ("created", "linked"):
+            changed_users.add(current_user.id)
+            published.append(([current_user.id], "create", CONTACT_RECORD.dump_python(record, mode="json")))
+        elif outcome == "updated":
+            changed_users.update(linked_user_ids[contact_id])
+            published.append((linked_user_ids[contact_id], "update", CONTACT_RECORD.dump_python(record, mode="json")))
+        elif outcome == "deleted":
+            changed_users.update(linked_user_ids[contact_id])
+            published.append((linked_user_ids[contact_id], "delete", {"id": contact_id}))
+    await retire_cached_lists(db, cache, changed_users)
+    await events.publish_many(published)
+    return json_response(CONTACT_BATCH_REPORT.dump_json({"results": results}))
+
+@router.post("/import", response_model=ContactImportReport)
+async def import_contacts(
+        request: Request,
+        format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+        db: AsyncSession = Depends(get_db),
+        cache: ContactListCache = Depends(get_contact_cache),
+        current_user: Principal = Depends(get_current_user)
+):
+    """
+    Bulk import contacts from a CSV (with a header row) or NDJSON request body.
+
+    The body is streamed and written in batches; rows that fail validation are
+    skipped and listed in the returned report.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    format = format or IMPORT_CONTENT_TYPES.get(content_type)
+    if format is None:
+        raise HTTPException(status_code=415, detail="Send text/csv or application/x-ndjson, or pass ?format=")
+
+    lines = iter_lines(request.stream())
+    rows = iter_csv_rows(lines) if format == "csv" else iter_ndjson_rows(lines)
+    try:
+        report = await run_import(db, current_user.id, rows)
+    except ImportFormatError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    finally:
+        # Batches committed before a failure still changed the list; a failed one is rolled back first.
+        await db.rollback()
+        await retire_cached_lists(db, cache, [current_user.id])
+    return report.as_dict()
+
+@router.get("/export")
+async def export_contacts(
+        request: Request,
+        format: str = Query("csv", pattern="^(csv|ndjson)$"),
+        gzip: bool = True,
+        session_factory=Depends(get_session_factory),
+        current_user: Principal = Depends(get_current_user)
+):
+    """
+    Stream all contacts of the authenticated user as CSV or NDJSON.
+
+    The body is gzip-encoded when the client accepts it, unless ``gzip=false``.
+    """
+    compress = gzip and "gzip" in request.headers.get("accept-encoding", "")
+    headers = {"Content-Disposition": f'attachment; filename="contacts.{format}"', "Vary": "Accept-Encoding"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        run_export(session_factory, current_user.id, format, compress),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers=headers
+    )
+
+@router.get("/upcoming-birthdays/", response_model=List[ContactRead])
+async def upcoming_birthdays(
+        days: int = Query(7, ge=1, le=365),
+        db: AsyncSession = Depends(get_read_db),
+        cache: ContactListCache = Depends(get_contact_cache),
+        current_user: Principal = Depends(get_current_user)
 ):
     """
-    Create a new contact.
+    Retrieve contacts whose birthday falls within the next ``days`` days (7 by default).
     """
-    return create_contact(db, contact, current_user.id)
+    today = date.today()
+    variant = f"birthdays:{days}:{today.isoformat()}"
+    (list_version, _), from_db = await list_validators(db, cache, current_user.id)
+    payload = await cache.get(current_user.id, list_version, variant)
+    if payload is not None:
+        return json_response(payload)
+
+    if not from_db:
+        # As in get_contacts: file the response under the version this session sees.
+        list_version, _ = await get_list_version(db, current_user.id)
+
+    contacts = await get_upcoming_birthdays(db, current_user.id, days=days, today=today)
+    payload = CONTACT_RECORDS.dump_json(contact_records(contacts))
+    await cache.set(current_user.id, list_version, variant, payload)
+    return json_response(payload)
+
+@router.get("/changes", response_model=ContactChangesPage)
+async def get_changes(
+        since: Optional[str] = None,
+        limit: int = Query(500, ge=1, le=1000),
+        db: AsyncSession = Depends(get_read_db),
+        current_user: Principal = Depends(get_current_user)
+):
+    """
+    Return the changes to the authenticated user's contact list since ``since``.
+
+    Changes come oldest first: ``upsert`` with the contact's current data, or
+    ``delete`` for a contact that was deleted or unlinked. Pass the returned
+    ``cursor`` as ``since`` next time; without ``since`` the whole list is sent.
+    Fetch again right away while ``has_more`` is true.
+    """
+    try:
+        after = decode_change_cursor(since) if since else (-1, 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    changes, has_more = await get_contact_changes(db, current_user.id, after, limit)
+    page = ContactChangesPage.model_validate({
+        "changes": [
+            {"seq": seq, "op": "delete" if contact is None else "upsert", "id": contact_id, "contact": contact}
+            for seq, contact_id, contact in changes
+        ],
+        "cursor": encode_change_cursor(*(changes[-1][:2] if changes else after)),
+        "has_more": has_more
+    }, from_attributes=True)
+    return json_response(page.model_dump_json().encode())
+
+@router.get("/stream", response_class=StreamingResponse)
+async def stream_events(
+        events: ContactEventHub = Depends(get_contact_events),
+        current_user: Principal = Depends(get_current_user)
+):
+    """
+    Push ``create``, ``update`` and ``delete`` events for the authenticated user's
+    contacts as server-sent events, with a ``: ping`` comment as heartbeat.
+
+    A client that cannot keep up receives ``resync`` and is disconnected; it
+    should catch up with ``/contacts/changes`` and reconnect.
+    """
+    events.admit()
+    return StreamingResponse(
+        events.stream(current_user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @router.get("/{contact_id}/", response_model=ContactRead)
 async def get_contact(
         contact_id: int,
-        db: Session = Depends(get_db),
-        current_user=Depends(get_current_user)
+        request: Request,
+        response: Response,
+        db: AsyncSession = Depends(get_read_db),
+        current_user: Principal = Depends(get_current_user)
 ):
-    contact = get_contact_by_id(db, contact_id, current_user.id)
     """
     Return contact by id.
+
+    The ``ETag`` is the contact's version; conditional requests are answered
+    with 304 after reading the version alone.
     """
+    if has_conditions(request):
+        current = await get_contact_version(db, contact_id, current_user.id)
+        if current is None:
+            raise HTTPException(status_code=404, detail="Contact not found")
+        etag = contact_etag(current[0])
+        if is_not_modified(request, etag, current[1]):
+            return not_modified(etag, current[1])
+    contact = await get_contact_by_id(db, contact_id, current_user.id)
     if not contact:
         raise HTTPException(status_code=404, detail="Contact not found")
+    response.headers.update(validator_headers(contact_etag(contact.version), contact.updated_at))
     return contact
 
 @router.put("/{contact_id}/", response_model=ContactRead)
 async def update_contact_info(
         contact_id: int,
         contact_data: ContactCreate,
-        db: Session = Depends(get_db),
-        current_user=Depends(get_current_user)
+        request: Request,
+        response: Response,
+        db: AsyncSession = Depends(get_db),
+        cache: ContactListCache = Depends(get_contact_cache),
+        events: ContactEventHub = Depends(get_contact_events),
+        current_user: Principal = Depends(get_current_user)
 ):
-    contact = update_contact(db, contact_id, contact_data, current_user.id)
     """
     Update an existing contact's information.
+
+    Send the contact's ``ETag`` as ``If-Match`` to have the update rejected with
+    412 if someone changed the contact in the meantime.
     """
+    try:
+        contact, linked_user_ids = await update_contact(
+            db, contact_id, contact_data, current_user.id, if_match_versions(request)
+        )
+    except ContactVersionConflict:
+        raise PreconditionFailedError()
     if not contact:
         raise HTTPException(status_code=404, detail="Contact not found")
+    if linked_user_ids:
+        await retire_cached_lists(db, cache, linked_user_ids)
+        updated = ContactRead.model_validate(contact, from_attributes=True)
+        await events.publish(linked_user_ids, "update", updated.model_dump(mode="json"))
+    response.headers.update(validator_headers(contact_etag(contact.version), contact.updated_at))
     return contact
 
 @router.delete("/{contact_id}/", status_code=204)
 async def delete_contact(
         contact_id: int,
-        db: Session = Depends(get_db),
-        current_user=Depends(get_current_user)
+        request: Request,
+        db: AsyncSession = Depends(get_db),
+        cache: ContactListCache = Depends(get_contact_cache),
+        events: ContactEventHub = Depends(get_contact_events),
+        current_user: Principal = Depends(get_current_user)
 ):
-    success = delete_contact(db, contact_id, current_user.id)
     """
-    Delete a contact by its ID.
+    Delete a contact by its ID; ``If-Match`` works as for ``PUT``.
     """
+    try:
+        success, linked_user_ids = await remove_contact(db, contact_id, current_user.id, if_match_versions(request))
+    except ContactVersionConflict:
+        raise PreconditionFailedError()
     if not success:
         raise HTTPException(status_code=404, detail="Contact not found")
+    await retire_cached_lists(db, cache, linked_user_ids)
+    await events.publish(linked_user_ids, "delete", {"id": contact_id})
     return {"detail": "Contact deleted"}
 
-@router.get("/upcoming-birthdays/", response_model=List[ContactRead])
-async def upcoming_birthdays(
-        db: Session = Depends(get_db),
-        current_user=Depends(get_current_user)
-):
+@router.get("/cache-stats", dependencies=[Depends(is_admin)])
+async def cache_stats(cache: ContactListCache = Depends(get_contact_cache)):
     """
-    Retrieve a list of contacts with upcoming birthdays.
+    Return hit/miss counters of this worker's contact list cache and the state
+    of its Redis circuit breaker (admins only).
     """
-    return get_upcoming_birthdays(db, current_user.id)
+    return {**cache.stats(), "redis_breaker": redis_client.breaker.stats()}
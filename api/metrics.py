@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Response
+
+from services.metrics import CONTENT_TYPE, registry
+
+router = APIRouter()
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Expose the metrics of this worker in the Prometheus text format.
+    """
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
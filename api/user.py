@@ -1,19 +1,19 @@
 import uuid
 
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
-from fastapi_limiter.depends import RateLimiter
-from jose import jwt, JWTError
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, ConfigDict
-from auth import Hash, create_access_token, get_current_user, send_verification_email, SECRET_KEY, ALGORITHM, \
-    send_password_reset_email, is_admin
-from models import User
+from auth import create_access_token, get_current_user, send_verification_email, decode_access_token, \
+    send_password_reset_email, is_admin, invalidate_principal, Principal
 from database import get_db
-import cloudinary.uploader
+from services.hashing import password_hasher
+from services.outbox import outbox_worker
+from services.rate_limit import IPRateLimiter, RateLimit, RateLimiter
+from services.avatars import AvatarStorage, avatar_processor, get_avatar_storage, read_upload
+from repository.users import get_user_by_email, get_user_by_username, get_user_by_id, create_user
 from fastapi import UploadFile
 
 router = APIRouter()
-hash_handler = Hash()
 
 class SignupModel(BaseModel):
     """
@@ -24,127 +24,135 @@ class SignupModel(BaseModel):
     password: str
     model_config = ConfigDict(from_attributes=True)
 
-@router.post("/signup", status_code=status.HTTP_201_CREATED)
+@router.post(
+    "/signup",
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(IPRateLimiter("signup", RateLimit(5, 60), exact=True))]
+)
 async def signup(
         body: SignupModel,
-        background_tasks: BackgroundTasks,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
-    existing_user = db.query(User).filter(User.email == body.email).first()
+    existing_user = await get_user_by_email(db, body.email)
     if existing_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email already in use")
-    hashed_password = hash_handler.get_password_hash(body.password)
-    new_user = User(username=body.username, email=body.email, hashed_password=hashed_password, role="user")
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    hashed_password = await password_hasher.hash("signup", body.password)
+    verification_token = await create_access_token(data={"sub": body.email, "email": body.email}, expires_delta=60*60)
 
-    verification_token = await create_access_token(data={"sub": new_user.email, "email": new_user.email}, expires_delta=60*60)
-
-    await send_verification_email(new_user.email, verification_token, background_tasks)
+    # The queued email is committed together with the new user.
+    send_verification_email(db, body.email, verification_token)
+    await create_user(db, body.username, body.email, hashed_password)
+    outbox_worker.wake()
     """
     Create a new user account.
     """
     return {"message": "User created successfully, please verify your email"}
 
-@router.post("/login")
+@router.post("/login", dependencies=[Depends(IPRateLimiter("login", RateLimit(10, 60), exact=True))])
 async def login(
         body: SignupModel,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
     """
     Authenticate a user and return an access token.
     """
-    user = db.query(User).filter(User.username == body.username).first()
-    if not user or not hash_handler.verify_password(body.password, user.hashed_password):
+    user = await get_user_by_username(db, body.username)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    valid, new_hash = await password_hasher.verify_and_update("login", body.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    if new_hash:
+        # Stored hash used an outdated cost; upgrade it while we have the plain password.
+        user.hashed_password = new_hash
+        await db.commit()
     token = await create_access_token(data={"email": user.email, "sub": user.username})
 
     return {"access_token": token, "token_type": "bearer"}
 
 @router.get("/verify-email")
-async def verify_email(token: str, db: Session = Depends(get_db)):
+async def verify_email(token: str, db: AsyncSession = Depends(get_db)):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid token")
-    except JWTError:
+        email = decode_access_token(token)["sub"]
+    except ValueError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid token")
 
-    user = db.query(User).filter(User.email == email).first()
+    user = await get_user_by_email(db, email)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
     user.is_verified = True
-    db.commit()
+    await db.commit()
+    await invalidate_principal(user.email)
     """
     Verify user email using the provided token.
     """
     return {"message": "Email verified successfully"}
 
-@router.get("/me", dependencies=[Depends(RateLimiter(times=5, seconds=60))])
-async def get_user_profile(current_user=Depends(get_current_user)):
+@router.get("/me", dependencies=[Depends(RateLimiter("me", user=RateLimit(5, 60), admin=RateLimit(60, 60)))])
+async def get_user_profile(current_user: Principal = Depends(get_current_user)):
     """
     Retrieve the profile of the currently authenticated user.
     """
     return {
-        "username": current_user["username"],
-        "email": current_user["email"],
-        "role": current_user["role"]
+        "username": current_user.username,
+        "email": current_user.email,
+        "role": current_user.role
     }
 
 @router.post("/avatar/")
 async def upload_avatar(
         file: UploadFile,
-        current_user=Depends(is_admin),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(is_admin),
+        db: AsyncSession = Depends(get_db),
+        storage: AvatarStorage = Depends(get_avatar_storage)
 ):
-    result = cloudinary.uploader.upload(file.file, folder="avatars")
-    current_user.avatar_url = result.get("url")
-    db.commit()
     """
     Upload a new avatar for the authenticated user.
+
+    The image is stored as square WebP thumbnails; ``avatar_url`` points at the largest one.
     """
-    return {"avatar_url": current_user.avatar_url}
+    data = await read_upload(file)
+    sizes = await avatar_processor.process(data, storage)
+    user = await get_user_by_id(db, current_user.id)
+    user.avatar_url = sizes[max(sizes)]
+    await db.commit()
+    return {"avatar_url": user.avatar_url, "sizes": sizes}
 
-@router.post("/forgot-password")
-def forgot_password(email: str, db: Session = Depends(get_db)):
+@router.post("/forgot-password", dependencies=[Depends(IPRateLimiter("forgot_password", RateLimit(3, 300), exact=True))])
+async def forgot_password(email: str, db: AsyncSession = Depends(get_db)):
     """
     Generates a password reset token and sends it via email.
     """
-    user = db.query(User).filter(User.email == email).first()
+    user = await get_user_by_email(db, email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     reset_token = str(uuid.uuid4())
     user.reset_token = reset_token
-    db.commit()
-
-    send_password_reset_email(str(user.email), reset_token)
+    send_password_reset_email(db, str(user.email), reset_token)
+    await db.commit()
+    outbox_worker.wake()
     return {"message": "Check your email for password reset instructions"}
 
-@router.post("/reset-password")
-async def reset_password(token: str, new_password: str, db: Session = Depends(get_db)):
+@router.post("/reset-password", dependencies=[Depends(IPRateLimiter("reset_password", RateLimit(5, 300), exact=True))])
+async def reset_password(token: str, new_password: str, db: AsyncSession = Depends(get_db)):
     """
     Resets the user's password if the provided token is valid.
     """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=400, detail="Invalid token: No subject found")
-    except JWTError:
+        email = decode_access_token(token)["sub"]
+    except ValueError:
         raise HTTPException(status_code=400, detail="Invalid or expired token")
 
-    user = db.query(User).filter(User.email == email).first()
+    user = await get_user_by_email(db, email)
     if not user:
         raise HTTPException(status_code=400, detail="User not found")
 
-    from auth import Hash
-    user.hashed_password = Hash.get_password_hash(new_password)
+    user.hashed_password = await password_hasher.hash("reset_password", new_password)
     user.reset_token = None  # Remove used token
-    db.commit()
+    await db.commit()
+    await invalidate_principal(user.email)
 
     return {"message": "Password successfully changed"}
 
@@ -152,10 +160,10 @@ async def reset_password(token: str, new_password: str, db: Session = Depends(ge
 async def set_user_role(
         user_id: int,
         new_role: str,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
     """Admin can change roles for users."""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -163,7 +171,8 @@ async def set_user_role(
         raise HTTPException(status_code=400, detail="Invalid role")
 
     user.role = new_role
-    db.commit()
+    await db.commit()
+    await invalidate_principal(user.email)
 
     return {"message": f"Role of {user.username} changed to {new_role}"}
 
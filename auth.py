@@ -1,55 +1,33 @@
+import asyncio
+import hashlib
 import json
+import logging
 import os
-import smtplib
+import time
+from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta, timezone
-from email.mime.text import MIMEText
 
-import redis.asyncio as redis
 from dotenv import load_dotenv
-from fastapi import BackgroundTasks
 from fastapi import HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordBearer
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
 from jose import jwt, JWTError
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db
-from models import User
+from database import get_read_db, mark_recent_write, request_identity
+from repository.users import get_user_by_email
+from services.memory_cache import TTLCache
+from services.metrics import PRINCIPAL_LOOKUPS
+from services.outbox import enqueue_email
+from services.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("JWT_ALGORITHM")
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM=os.getenv("MAIL_FROM"),
-    MAIL_PORT=int(os.getenv("MAIL_PORT")),
-    MAIL_SERVER=os.getenv("MAIL_SERVER"),
-    MAIL_STARTTLS=os.getenv("MAIL_STARTTLS") == "True",
-    MAIL_SSL_TLS=os.getenv("MAIL_SSL_TLS") == "True",
-    USE_CREDENTIALS=os.getenv("USE_CREDENTIALS") == "True",
-)
-SMTP_SERVER = os.getenv("SMTP_SERVER")
-SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
-SMTP_USERNAME = os.getenv("SMTP_USERNAME")
-SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-
-class Hash:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-    @staticmethod
-    def verify_password(plain_password: str, hashed_password: str) -> bool:
-        """Verify if a plain password matches its hashed version."""
-        return Hash.pwd_context.verify(plain_password, hashed_password)
-
-    @staticmethod
-    def get_password_hash(password: str) -> str:
-        """Generate a bcrypt hash for a given password."""
-        return Hash.pwd_context.hash(password)
-
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/user/login")
 
 async def create_access_token(data: dict, expires_delta: int = None):
@@ -66,84 +44,181 @@ async def create_access_token(data: dict, expires_delta: int = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def decode_access_token(token: str):
-    """Decodes and verifies a JWT access token."""
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+verified_tokens = TTLCache(maxsize=10_000)
 
-        if "sub" not in payload:
-            raise ValueError("Invalid token: No 'sub' found")
+def decode_access_token(token: str) -> dict:
+    """
+    Decodes and verifies a JWT access token.
 
+    This is the single verification entry point. Verified payloads are cached under
+    a SHA-256 digest of the token until the token's ``exp``, so repeated requests
+    with the same token skip the signature check. Raises ``ValueError`` for
+    invalid or expired tokens; failures are never cached.
+    """
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = verified_tokens.get(digest)
+    if payload is not None:
         return payload
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         raise ValueError("Invalid token")
-
-async def send_verification_email(email: str, token: str, background_tasks: BackgroundTasks):
-    message = MessageSchema(
-        subject="Verify your email",
-        recipients=[email],
-        body=f"Click the link to verify your email: http://127.0.0.1:8000/user/verify-email?token={token}",
+    if "sub" not in payload:
+        raise ValueError("Invalid token: No 'sub' found")
+
+    expires_in = payload.get("exp", 0) - time.time()
+    if expires_in > 0:
+        verified_tokens.set(digest, payload, ttl=expires_in)
+    return payload
+
+def send_verification_email(db: AsyncSession, email: str, token: str):
+    """Queue the email-verification message; it goes out once ``db`` is committed."""
+    enqueue_email(
+        db,
+        email,
+        "Verify your email",
+        f"Click the link to verify your email: http://127.0.0.1:8000/user/verify-email?token={token}",
         subtype="html"
     )
-    fm = FastMail(conf)
-    background_tasks.add_task(fm.send_message, message)
 
-def send_password_reset_email(email: str, token: str):
-    """Sends a password reset email with a secure token."""
+def send_password_reset_email(db: AsyncSession, email: str, token: str):
+    """Queue a password reset email with a secure token; it goes out once ``db`` is committed."""
     reset_url = f"http://127.0.0.1:8000/reset-password?token={token}"
-    msg = MIMEText(f"Click the link to reset your password: {reset_url}")
-    msg["Subject"] = "Password Reset Request"
-    msg["From"] = SMTP_USERNAME
-    msg["To"] = email
+    enqueue_email(db, email, "Password Reset Request", f"Click the link to reset your password: {reset_url}")
 
-    try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.sendmail(SMTP_USERNAME, email, msg.as_string())
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
 
+PRINCIPAL_REDIS_TTL = 600
+PRINCIPAL_LOCAL_TTL = 60
+PRINCIPAL_INVALIDATION_CHANNEL = "auth:invalidate"
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    """The authenticated user as seen by request handlers."""
+    id: int
+    username: str
+    email: str
+    role: str
 
-redis_client = redis.Redis(host="localhost", port=6379, decode_responses=True)
+principal_cache = TTLCache(maxsize=10_000, ttl=PRINCIPAL_LOCAL_TTL)
 
-async def get_current_user(token: str, db: Session = Depends(get_db)):
+async def invalidate_principal(email: str):
     """
-    Get user from Redis cache or database.
+    Drop the cached principal for ``email`` in this worker, in Redis and, via pub/sub,
+    in every other worker.
+
+    Call after changing anything the principal carries or that should end a session:
+    role, password or verification state.
     """
+    principal_cache.pop(email)
+    # The change was made by someone else (an admin, a reset link): this user's next
+    # lookup must not come from a replica that has not replayed it yet.
+    await mark_recent_write(email)
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email = payload.get("sub")
-
-        if email is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.delete(f"user:{email}")
+        pipe.publish(PRINCIPAL_INVALIDATION_CHANNEL, email)
+        await pipe.execute()
+    except RedisError:
+        logger.warning("Could not broadcast principal invalidation for %s", email, exc_info=True)
+
+async def listen_for_principal_invalidations():
+    """Evict principals named on the invalidation channel; runs for the lifetime of the worker."""
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(PRINCIPAL_INVALIDATION_CHANNEL)
+            while True:
+                # Poll with a timeout: a blocking read would trip the pool's short socket timeout.
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is not None:
+                    principal_cache.pop(message["data"].decode())
+        except RedisError:
+            logger.warning("Principal invalidation listener lost Redis, retrying", exc_info=True)
+            # Entries may have been missed while disconnected.
+            principal_cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_read_db)) -> Principal:
+    """
+    Resolve the bearer token to a :class:`Principal`.
 
-    except JWTError:
+    Lookups go through an in-process LRU first, then Redis, then the database;
+    both cache tiers are invalidated by :func:`invalidate_principal`.
+    """
+    try:
+        email = decode_access_token(token)["sub"]
+    except ValueError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-    cached_user = await redis_client.get(f"user:{email}")
+    principal = principal_cache.get(email)
+    if principal is not None:
+        PRINCIPAL_LOOKUPS.inc("local")
+        return principal
+
+    try:
+        cached_user = await redis_client.get(f"user:{email}")
+    except RedisError:
+        logger.warning("Principal cache read failed", exc_info=True)
+        PRINCIPAL_LOOKUPS.inc("redis_error")
+        cached_user = None
     if cached_user:
-        return json.loads(cached_user)
+        PRINCIPAL_LOOKUPS.inc("redis")
+        principal = Principal(**json.loads(cached_user))
+        principal_cache.set(email, principal)
+        return principal
 
-    user = db.query(User).filter(User.email == email).first()
+    PRINCIPAL_LOOKUPS.inc("database")
+    user = await get_user_by_email(db, email)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    user_data = {
-        "id": user.id,
-        "username": user.username,
-        "email": user.email,
-        "role": user.role
-    }
-    await redis_client.set(f"user:{email}", json.dumps(user_data), ex=600)
+    principal = Principal(id=user.id, username=user.username, email=user.email, role=user.role)
+    try:
+        await redis_client.set(f"user:{email}", json.dumps(asdict(principal)), ex=PRINCIPAL_REDIS_TTL)
+    except RedisError:
+        logger.warning("Principal cache write failed", exc_info=True)
+    principal_cache.set(email, principal)
 
-    return user_data
+    return principal
 
-async def is_admin(current_user=Depends(get_current_user)):
-    if current_user["role"] != "admin":
+async def is_admin(current_user: Principal = Depends(get_current_user)) -> Principal:
+    if current_user.role != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied: Admins only"
         )
     return current_user
 
+class RequestIdentityMiddleware:
+    """
+    Publish the bearer token subject as :data:`database.request_identity`.
+
+    Read replica routing uses it to send callers that have just written to the
+    primary. Invalid or missing tokens simply leave the identity unset.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        identity = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and token:
+                    try:
+                        identity = decode_access_token(token).get("sub")
+                    except ValueError:
+                        pass
+                break
+        reset_token = request_identity.set(identity)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_identity.reset(reset_token)
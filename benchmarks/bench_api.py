@@ -0,0 +1,405 @@
+"""
+Route benchmark: throughput and latency percentiles of every route in
+``api/contacts.py`` and ``api/user.py``.
+
+The application runs in-process behind ``httpx.ASGITransport`` against a
+SQLite file seeded with ``--contacts`` contacts and an in-memory fakeredis
+server, so results do not depend on Postgres, Redis or network latency and
+mostly measure the application itself: routing, validation, dependencies,
+serialization, the query count of each route, bcrypt and Pillow work.
+
+Rate limits are evaluated as usual but never enforced, and the lifespan is not
+started (the outbox is left alone, so no mail is sent).
+
+Run from the repository root::
+
+    python -m benchmarks.bench_api --contacts 10000 --output results.json
+    python -m benchmarks.bench_api --contacts 10000 --baseline results.json --threshold 0.2
+
+With ``--baseline`` the exit status is 1 when a route's p95 latency grew, or
+its throughput fell, by more than ``--threshold`` compared to the stored run.
+Compare runs with the same options on the same machine.
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, replace
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+SEED_CHUNK = 20_000
+BENCH_PASSWORD = "benchmark-password"
+
+@dataclass(frozen=True)
+class Scenario:
+    """One route; ``build(i)`` returns the URL and ``httpx`` request options of the i-th request."""
+    name: str
+    method: str
+    build: Callable[[int], Tuple[str, dict]]
+    max_requests: Optional[int] = None
+
+def configure_environment(database_path: str):
+    # Must run before the application is imported: settings are read at import time.
+    os.environ["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{database_path}"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    os.environ.setdefault("JWT_ALGORITHM", "HS256")
+
+    from fakeredis import FakeAsyncRedis
+
+    import services.redis_client
+    from services.redis_client import ResilientRedis
+
+    class FakeResilientRedis(ResilientRedis, FakeAsyncRedis):
+        """The application's client class, circuit breaker included, talking to fakeredis."""
+
+    services.redis_client.redis_client = FakeResilientRedis()
+
+def tune_sqlite(engine):
+    from sqlalchemy import event
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+async def seed(engine, contacts: int) -> Dict[str, int]:
+    """Create the schema, the benchmark users and ``contacts`` contacts owned by the admin user."""
+    from sqlalchemy import insert
+
+    from database import Base
+    from models import Contact, User, birthday_key, user_contact_association
+    from services.hashing import pwd_context
+
+    hashed_password = pwd_context.hash(BENCH_PASSWORD)
+    rng = random.Random(0)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        users = {}
+        for name, role in (("bench", "admin"), ("reset", "user"), ("role", "user")):
+            result = await conn.execute(insert(User).values(
+                username=name, email=f"{name}@example.com", hashed_password=hashed_password, is_verified=True, role=role
+            ))
+            users[name] = result.inserted_primary_key[0]
+
+        first_names = ["Anna", "Bohdan", "Chris", "Dana", "Emil", "Fiona", "Greg", "Hanna", "Ivan", "Julia"]
+        last_names = ["Brown", "Kovalenko", "Lee", "Miller", "Novak", "Smith", "Shevchenko", "Taylor", "Wilson", "Young"]
+        for start in range(1, contacts + 1, SEED_CHUNK):
+            stop = min(start + SEED_CHUNK, contacts + 1)
+            rows = []
+            for number in range(start, stop):
+                birthday = date(1960, 1, 1) + timedelta(days=rng.randrange(365 * 40))
+                rows.append({
+                    "id": number,
+                    "first_name": rng.choice(first_names),
+                    "last_name": f"{rng.choice(last_names)}{number % 1000}",
+                    "email": f"contact{number}@example.com",
+                    "phone": f"+380{number:09d}",
+                    "birthday": birthday,
+                    "additional_info": None,
+                    "birthday_key": birthday_key(birthday),
+                })
+            await conn.execute(insert(Contact), rows)
+            await conn.execute(
+                insert(user_contact_association),
+                [
+                    {
+                        "user_id": users["bench"], "contact_id": row["id"], "last_name": row["last_name"],
+                        "first_name": row["first_name"], "birthday_key": row["birthday_key"]
+                    }
+                    for row in rows
+                ]
+            )
+    return users
+
+def avatar_image() -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (512, 512), (40, 120, 200)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+def scenarios(contacts: int, users: Dict[str, int], tokens: Dict[str, str]) -> List[Scenario]:
+    from repository.contacts import encode_change_cursor
+
+    rng = random.Random(1)
+    avatar = avatar_image()
+    # A client that has synced the first half of the seeded list (seeded links have change_seq 0).
+    half_synced = encode_change_cursor(0, contacts // 2)
+
+    def contact_payload(i: int, prefix: str) -> dict:
+        return {
+            "first_name": "Bench", "last_name": f"Run{i}", "email": f"{prefix}{i}@example.com",
+            "phone": f"+1555{i:07d}", "birthday": "1990-05-17", "additional_info": None,
+        }
+
+    def import_body(i: int) -> bytes:
+        lines = ["first_name,last_name,email,phone,birthday,additional_info"]
+        lines += [f"Imported,Row{row},import{i}-{row}@example.com,+1666{row:07d},1991-02-03," for row in range(20)]
+        return "\n".join(lines).encode()
+
+    def existing_id(i: int) -> int:
+        return rng.randrange(1, max(2, contacts // 2))
+
+    def batch_body(i: int) -> dict:
+        # Gets hit random contacts of the lower half and updates their own slice of it, so concurrent
+        # batches do not conflict; deletes take the third quarter, 5 per request.
+        half = max(10, contacts // 2)
+        update_ids = [1 + (i * 5 + k) % (half - 1) for k in range(5)]
+        get_ids = rng.sample([contact_id for contact_id in range(1, half) if contact_id not in update_ids], 5)
+        return {"operations": [
+            *({"op": "create", "contact": contact_payload(i * 5 + k, "batch")} for k in range(5)),
+            *({"op": "get", "id": contact_id} for contact_id in get_ids),
+            *(
+                {"op": "update", "id": contact_id, "contact": contact_payload(i * 5 + k, "batch-updated")}
+                for k, contact_id in enumerate(update_ids)
+            ),
+            *({"op": "delete", "id": half + i * 5 + k} for k in range(5)),
+        ]}
+
+    return [
+        Scenario("GET /contacts/", "GET", lambda i: ("/contacts/", {})),
+        Scenario("GET /contacts/ (filtered)", "GET", lambda i: ("/contacts/", {"params": {"name": "Ju", "limit": 20}})),
+        Scenario("GET /contacts/search", "GET", lambda i: ("/contacts/search", {"params": {"q": "shevchenko"}})),
+        Scenario("GET /contacts/upcoming-birthdays/", "GET", lambda i: ("/contacts/upcoming-birthdays/", {})),
+        Scenario("GET /contacts/{contact_id}/", "GET", lambda i: (f"/contacts/{existing_id(i)}/", {})),
+        Scenario("GET /contacts/export", "GET", lambda i: ("/contacts/export", {}), max_requests=3),
+        Scenario("GET /contacts/cache-stats", "GET", lambda i: ("/contacts/cache-stats", {})),
+        Scenario("POST /contacts/", "POST", lambda i: ("/contacts/", {"json": contact_payload(i, "created")})),
+        Scenario(
+            "PUT /contacts/{contact_id}/", "PUT",
+            lambda i: (f"/contacts/{existing_id(i)}/", {"json": contact_payload(i, "updated")})
+        ),
+        Scenario(
+            "POST /contacts/batch", "POST", lambda i: ("/contacts/batch", {"json": batch_body(i)}),
+            max_requests=max(1, contacts // 20)
+        ),
+        Scenario(
+            "POST /contacts/import", "POST",
+            lambda i: ("/contacts/import", {"content": import_body(i), "headers": {"Content-Type": "text/csv"}}),
+            max_requests=50
+        ),
+        Scenario(
+            "DELETE /contacts/{contact_id}/", "DELETE", lambda i: (f"/contacts/{contacts - i}/", {}),
+            max_requests=contacts // 4
+        ),
+        # After the writes, so the feed holds updated links and tombstones as well as seeded links.
+        Scenario("GET /contacts/changes", "GET", lambda i: ("/contacts/changes", {})),
+        Scenario(
+            "GET /contacts/changes (since)", "GET",
+            lambda i: ("/contacts/changes", {"params": {"since": half_synced}})
+        ),
+        Scenario("GET /user/me", "GET", lambda i: ("/user/me", {})),
+        Scenario(
+            "GET /user/verify-email", "GET", lambda i: ("/user/verify-email", {"params": {"token": tokens["verify"]}})
+        ),
+        Scenario(
+            "PUT /user/set-role/{user_id}", "PUT",
+            lambda i: (f"/user/set-role/{users['role']}", {"params": {"new_role": "user"}})
+        ),
+        Scenario(
+            "POST /user/forgot-password", "POST",
+            lambda i: ("/user/forgot-password", {"params": {"email": "reset@example.com"}})
+        ),
+        Scenario(
+            "POST /user/reset-password", "POST",
+            lambda i: ("/user/reset-password", {"params": {"token": tokens["reset"], "new_password": BENCH_PASSWORD}}),
+            max_requests=50
+        ),
+        Scenario(
+            "POST /user/signup", "POST",
+            lambda i: ("/user/signup", {"json": {
+                "username": f"signup{i}", "email": f"signup{i}@example.com", "password": BENCH_PASSWORD
+            }}),
+            max_requests=50
+        ),
+        Scenario(
+            "POST /user/login", "POST",
+            lambda i: ("/user/login", {"json": {
+                "username": "bench", "email": "bench@example.com", "password": BENCH_PASSWORD
+            }}),
+            max_requests=50
+        ),
+        Scenario(
+            "POST /user/avatar/", "POST",
+            lambda i: ("/user/avatar/", {"files": {"file": ("avatar.png", avatar, "image/png")}}),
+            max_requests=50
+        ),
+    ]
+
+def percentile(ordered: List[float], percent: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+async def run_scenario(client, scenario: Scenario, requests: int, concurrency: int, warmup: int) -> dict:
+    requests = min(requests, scenario.max_requests or requests)
+    # Warm-up requests use indexes after the measured ones, so unique values stay unique.
+    for i in range(requests, requests + min(warmup, requests)):
+        url, options = scenario.build(i)
+        await client.request(scenario.method, url, **options)
+
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            url, options = scenario.build(i)
+            started = time.perf_counter()
+            response = await client.request(scenario.method, url, **options)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+async def run(args) -> dict:
+    configure_environment(args.database)
+
+    import httpx
+
+    from auth import create_access_token
+    from database import dispose_engine, get_engine
+    from main import create_app
+    from services.avatars import LocalAvatarStorage, avatar_processor, get_avatar_storage
+    from services.hashing import password_hasher
+    from services.rate_limit import RateLimitStore, get_rate_limit_store
+    from services.redis_client import redis_client
+
+    class UnenforcedRateLimitStore(RateLimitStore):
+        """Does all the rate limiting work, then lets the request through anyway."""
+
+        async def hit(self, key, limit):
+            return replace(await super().hit(key, limit), allowed=True)
+
+        async def hit_exact(self, key, limit):
+            return replace(await super().hit_exact(key, limit), allowed=True)
+
+    engine = get_engine()
+    tune_sqlite(engine)
+    started = time.perf_counter()
+    users = await seed(engine, args.contacts)
+    print(f"seeded {args.contacts} contacts in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+    app = create_app()
+    rate_limit_store = UnenforcedRateLimitStore(redis_client)
+    app.dependency_overrides[get_rate_limit_store] = lambda: rate_limit_store
+    avatar_storage = LocalAvatarStorage(os.path.join(os.path.dirname(args.database), "avatars"))
+    app.dependency_overrides[get_avatar_storage] = lambda: avatar_storage
+
+    tokens = {
+        "access": await create_access_token({"email": "bench@example.com"}, expires_delta=24 * 3600),
+        "verify": await create_access_token({"email": "bench@example.com"}, expires_delta=24 * 3600),
+        "reset": await create_access_token({"email": "reset@example.com"}, expires_delta=24 * 3600),
+    }
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    headers = {"Authorization": f"Bearer {tokens['access']}"}
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+            for scenario in scenarios(args.contacts, users, tokens):
+                if args.routes and not any(part in scenario.name for part in args.routes):
+                    continue
+                results[scenario.name] = result = await run_scenario(
+                    client, scenario, args.requests, args.concurrency, args.warmup
+                )
+                print(format_row(scenario.name, result), file=sys.stderr)
+    finally:
+        await dispose_engine()
+        await redis_client.aclose()
+        password_hasher.shutdown()
+        avatar_processor.shutdown()
+
+    return {
+        "meta": {
+            "contacts": args.contacts,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        },
+        "routes": results,
+    }
+
+def format_row(name: str, result: dict) -> str:
+    errors = ", ".join(f"{status}x{count}" for status, count in result["errors"].items())
+    return (
+        f"{name:36} {result['rps']:9.1f} req/s  p50 {result['p50_ms']:8.2f}  p95 {result['p95_ms']:8.2f}  "
+        f"p99 {result['p99_ms']:8.2f} ms" + (f"  errors {errors}" if errors else "")
+    )
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """Return one message per route whose p95 or throughput regressed by more than ``threshold``."""
+    if current["meta"]["contacts"] != baseline["meta"]["contacts"]:
+        print(
+            f"warning: baseline was seeded with {baseline['meta']['contacts']} contacts, "
+            f"this run with {current['meta']['contacts']}", file=sys.stderr
+        )
+    regressions = []
+    for name, result in current["routes"].items():
+        previous = baseline["routes"].get(name)
+        if previous is None:
+            continue
+        p95_change = result["p95_ms"] / previous["p95_ms"] - 1
+        rps_change = result["rps"] / previous["rps"] - 1
+        print(f"{name:36} p95 {p95_change:+7.1%}  throughput {rps_change:+7.1%}", file=sys.stderr)
+        if p95_change > threshold:
+            regressions.append(f"{name}: p95 {previous['p95_ms']:.2f} -> {result['p95_ms']:.2f} ms")
+        if rps_change < -threshold:
+            regressions.append(f"{name}: throughput {previous['rps']:.1f} -> {result['rps']:.1f} req/s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--contacts", type=int, default=1_000, help="contacts to seed (1k-1M)")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per route")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--routes", nargs="*", help="only run routes whose name contains one of these")
+    parser.add_argument("--database", help="SQLite file to seed (default: a temporary file)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.database is None:
+            args.database = os.path.join(directory, "bench.db")
+        elif os.path.exists(args.database):
+            parser.error(f"{args.database} already exists")
+        results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Overhead of the metrics instrumentation.
+
+Measures, per request, a minimal FastAPI route called through raw ASGI with
+and without :class:`services.metrics.MetricsMiddleware`, and, per statement,
+an in-memory SQLite query with and without :func:`instrument_engine` hooks.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_metrics
+"""
+import asyncio
+import time
+
+from fastapi import FastAPI
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from services.metrics import MetricsMiddleware, RequestStats, instrument_engine, request_stats
+
+REQUESTS = 20_000
+QUERIES = 5_000
+
+def build_app(with_metrics: bool):
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        return {"id": item_id}
+
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+async def drive(app, count: int) -> float:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/items/1", "raw_path": b"/items/1", "root_path": "",
+        "query_string": b"", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    for _ in range(500):
+        await app(dict(scope), receive, send)
+    started = time.perf_counter()
+    for _ in range(count):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / count
+
+async def queries(instrumented: bool) -> float:
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    if instrumented:
+        instrument_engine(engine.sync_engine)
+    statement = text("SELECT 1")
+    async with engine.connect() as conn:
+        request_stats.set(RequestStats())
+        for _ in range(200):
+            await conn.execute(statement)
+        started = time.perf_counter()
+        for _ in range(QUERIES):
+            await conn.execute(statement)
+        elapsed = (time.perf_counter() - started) / QUERIES
+    await engine.dispose()
+    return elapsed
+
+async def main():
+    bare = await drive(build_app(False), REQUESTS)
+    measured = await drive(build_app(True), REQUESTS)
+    print(f"request without metrics   {bare * 1e6:8.2f} us")
+    print(f"request with metrics      {measured * 1e6:8.2f} us")
+    print(f"middleware overhead       {(measured - bare) * 1e6:8.2f} us/request")
+
+    plain = await queries(False)
+    hooked = await queries(True)
+    print(f"query without hooks       {plain * 1e6:8.2f} us")
+    print(f"query with hooks          {hooked * 1e6:8.2f} us")
+    print(f"hook overhead             {(hooked - plain) * 1e6:8.2f} us/statement")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""
+Contact list serialization: ORM objects validated through ``ContactRead``
+against row tuples dumped by a ``ContactRecord`` ``TypeAdapter``.
+
+For each size, selects that many contacts from an in-memory SQLite database
+(in a fresh session, as a request would) and builds the JSON body of a contact
+page both ways:
+
+* ``orm``: ``select(Contact)`` then ``ContactPage.model_validate(..., from_attributes=True)``
+  and ``model_dump_json()`` (the previous path of ``GET /contacts/``);
+* ``rows``: ``select(*READ_COLUMNS)`` then one ``CONTACT_RECORD_PAGE.dump_json()``.
+
+Both bodies are checked to be identical. Times are the best of ``--repeat`` runs.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_serialization --sizes 1000 10000 100000
+"""
+import argparse
+import asyncio
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from api.contacts import CONTACT_RECORD_PAGE, contact_records
+from database import Base
+from models import Contact, User, birthday_key, user_contact_association
+from repository.contacts import CONTACT_ORDER, READ_COLUMNS
+from schemas.contacts import ContactPage
+
+SEED_CHUNK = 10_000
+
+async def seed(engine, contacts: int) -> int:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        result = await conn.execute(insert(User).values(
+            username="bench", email="bench@example.com", hashed_password="-", is_verified=True, role="user"
+        ))
+        user_id = result.inserted_primary_key[0]
+        for start in range(1, contacts + 1, SEED_CHUNK):
+            stop = min(start + SEED_CHUNK, contacts + 1)
+            rows = []
+            for number in range(start, stop):
+                birthday = date(1960, 1, 1) + timedelta(days=number % (365 * 40))
+                rows.append({
+                    "id": number,
+                    "first_name": f"First{number % 97}",
+                    "last_name": f"Last{number % 1009}",
+                    "email": f"contact{number}@example.com",
+                    "phone": f"+380{number:09d}",
+                    "birthday": birthday,
+                    "additional_info": "Met at a conference" if number % 3 == 0 else None,
+                    "birthday_key": birthday_key(birthday),
+                })
+            await conn.execute(insert(Contact), rows)
+            await conn.execute(
+                insert(user_contact_association), [{"user_id": user_id, "contact_id": number} for number in range(start, stop)]
+            )
+    return user_id
+
+def contacts_query(columns, user_id: int, size: int):
+    return (
+        select(*columns)
+        .join(user_contact_association)
+        .where(user_contact_association.c.user_id == user_id)
+        .order_by(*CONTACT_ORDER)
+        .limit(size)
+    )
+
+async def orm_path(session, user_id: int, size: int) -> bytes:
+    result = await session.execute(contacts_query((Contact,), user_id, size))
+    items = result.scalars().all()
+    page = ContactPage.model_validate({"items": items, "next_cursor": None, "prev_cursor": None}, from_attributes=True)
+    return page.model_dump_json().encode()
+
+async def rows_path(session, user_id: int, size: int) -> bytes:
+    result = await session.execute(contacts_query(READ_COLUMNS, user_id, size))
+    items = result.all()
+    return CONTACT_RECORD_PAGE.dump_json({"items": contact_records(items), "next_cursor": None, "prev_cursor": None})
+
+async def best_of(session_factory, path, user_id: int, size: int, repeat: int):
+    best, body = float("inf"), b""
+    for _ in range(repeat):
+        async with session_factory() as session:
+            started = time.perf_counter()
+            body = await path(session, user_id, size)
+            best = min(best, time.perf_counter() - started)
+    return best, body
+
+async def main(sizes, repeat: int):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    user_id = await seed(engine, max(sizes))
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    print(f"{'rows':>8} {'orm ms':>10} {'rows ms':>10} {'speedup':>8} {'body KiB':>9}")
+    for size in sizes:
+        orm_seconds, orm_body = await best_of(session_factory, orm_path, user_id, size, repeat)
+        rows_seconds, rows_body = await best_of(session_factory, rows_path, user_id, size, repeat)
+        assert orm_body == rows_body, "the two paths produced different JSON"
+        print(
+            f"{size:8d} {orm_seconds * 1000:10.1f} {rows_seconds * 1000:10.1f} "
+            f"{orm_seconds / rows_seconds:7.1f}x {len(rows_body) / 1024:9.0f}"
+        )
+    await engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.repeat))
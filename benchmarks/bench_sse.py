@@ -0,0 +1,68 @@
+"""
+Cost of idle contact event streams.
+
+Opens ``--streams`` streams on one :class:`services.events.ContactEventHub`
+(each driven by its own task, as Starlette does for a streaming response) and
+reports the memory they hold while idle, the time of one heartbeat round and
+the time to fan one event out to all of them. Socket buffers and the HTTP
+server's per-connection state come on top of these numbers.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_sse --streams 20000
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from fakeredis import FakeAsyncRedis
+
+from services.events import ContactEventHub
+
+async def consume(body, received: asyncio.Queue):
+    async for frame in body:
+        received.put_nowait(len(frame))
+
+async def main(streams: int, users: int):
+    hub = ContactEventHub(FakeAsyncRedis(), max_connections=streams)
+    received = asyncio.Queue()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tasks = [asyncio.create_task(consume(hub.stream(number % users), received)) for number in range(streams)]
+    while received.qsize() < streams:
+        await asyncio.sleep(0.01)
+    while not received.empty():
+        received.get_nowait()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    held = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print(f"idle streams            {hub.connections:8d}")
+    print(f"memory per idle stream  {held / streams:8.0f} bytes (task, generator, buffer)")
+
+    started = time.perf_counter()
+    hub.heartbeat()
+    while received.qsize() < streams:
+        await asyncio.sleep(0)
+    print(f"heartbeat round         {(time.perf_counter() - started) * 1000:8.1f} ms")
+    while not received.empty():
+        received.get_nowait()
+
+    started = time.perf_counter()
+    hub.dispatch({"users": list(range(users)), "event": "update", "data": {"id": 1, "first_name": "Ann"}})
+    while received.qsize() < streams:
+        await asyncio.sleep(0)
+    print(f"fan-out to all streams  {(time.perf_counter() - started) * 1000:8.1f} ms")
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await hub.client.aclose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--streams", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=5_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.streams, args.users))
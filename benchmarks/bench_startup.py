@@ -0,0 +1,82 @@
+"""
+Startup benchmark: import time and time-to-ready of the application.
+
+Each run starts a fresh interpreter that imports ``main``, runs the lifespan
+startup and serves a first request in-process. Nothing should need Postgres,
+Redis or SMTP for that, so the numbers are comparable on any machine with the
+dependencies installed.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --runs 10 --max-import-ms 1500 --max-ready-ms 2500
+
+With ``--max-*`` limits the exit status is 1 when a median exceeds its limit,
+so the benchmark can gate CI.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = r"""
+import time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+import asyncio
+import json
+import sys
+
+import httpx
+
+async def ready():
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.get("/openapi.json")
+            response.raise_for_status()
+        return time.perf_counter()
+
+ready_at = asyncio.run(ready())
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "ready_ms": (ready_at - started) * 1000,
+    "heavy_modules": [name for name in ("cloudinary", "PIL", "asyncpg") if name in sys.modules],
+}))
+"""
+
+def run_once() -> dict:
+    env = {"SECRET_KEY": "benchmark-secret", "JWT_ALGORITHM": "HS256", **os.environ}
+    output = subprocess.run([sys.executable, "-c", CHILD], capture_output=True, text=True, check=True, env=env).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-ready-ms", type=float)
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    import_ms = statistics.median(result["import_ms"] for result in results)
+    ready_ms = statistics.median(result["ready_ms"] for result in results)
+    print(f"import main        {import_ms:8.1f} ms (median of {args.runs})")
+    print(f"time to ready      {ready_ms:8.1f} ms (import + lifespan + first request)")
+    heavy = results[-1]["heavy_modules"]
+    print(f"heavy imports      {', '.join(heavy) or 'none'}")
+
+    failed = False
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print(f"FAIL: import time exceeds {args.max_import_ms} ms")
+        failed = True
+    if args.max_ready_ms is not None and ready_ms > args.max_ready_ms:
+        print(f"FAIL: time to ready exceeds {args.max_ready_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
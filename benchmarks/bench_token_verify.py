@@ -0,0 +1,39 @@
+"""
+Micro-benchmark for access token verification.
+
+Compares a bare ``jwt.decode`` (what every request paid before) with
+``auth.decode_access_token`` on a repeated token, which is served from the
+verified-token cache after the first call.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_token_verify
+"""
+import asyncio
+import os
+import timeit
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+
+from jose import jwt
+
+import auth
+
+ROUNDS = 20_000
+
+def main():
+    token = asyncio.run(auth.create_access_token({"email": "bench@example.com"}, expires_delta=3600))
+
+    uncached = timeit.timeit(lambda: jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM]), number=ROUNDS)
+    auth.verified_tokens.clear()
+    cached = timeit.timeit(lambda: auth.decode_access_token(token), number=ROUNDS)
+
+    per_uncached = uncached / ROUNDS * 1e6
+    per_cached = cached / ROUNDS * 1e6
+    print(f"jwt.decode            {per_uncached:8.2f} us/request")
+    print(f"decode_access_token   {per_cached:8.2f} us/request")
+    print(f"saving                {per_uncached - per_cached:8.2f} us/request ({uncached / cached:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+Create the schema on an empty database and mark it as migrated.
+
+The early migrations only drop tables, so a fresh database cannot be built by
+replaying the alembic history. Following the alembic recipe for new databases,
+this creates the current schema from the models and stamps it at ``head``;
+afterwards ``alembic upgrade head`` applies new migrations as usual.
+
+Run from the repository root::
+
+    python init_db.py
+"""
+import asyncio
+
+from alembic import command
+from alembic.config import Config
+
+import models  # noqa: F401 -- registers the tables on Base.metadata
+from database import Base, dispose_engine, get_engine
+
+async def create_schema():
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await dispose_engine()
+
+def main():
+    asyncio.run(create_schema())
+    command.stamp(Config("alembic.ini"), "head")
+
+if __name__ == "__main__":
+    main()
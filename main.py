@@ -1,12 +1,19 @@
-import os
+import asyncio
 from contextlib import asynccontextmanager
-from redis.asyncio import Redis
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from api.contacts import router as contacts_router
 from api.user import router as user_router
-from database import Base, engine
-from fastapi_limiter import FastAPILimiter
+from api.metrics import router as metrics_router
+from auth import RequestIdentityMiddleware, listen_for_principal_invalidations
+from services.events import contact_events
+from services.avatars import AVATAR_STORAGE, AVATAR_URL_PREFIX, ImmutableStaticFiles, avatar_processor, avatar_storage
+from services.hashing import password_hasher
+from services.metrics import MetricsMiddleware
+from services.outbox import outbox_worker
+from services.rate_limit import RateLimit, RateLimiter
+from services.redis_client import close_redis_client
+from database import dispose_engine, replica_router
 
 description = """
 This is the main entry point of the application.
@@ -17,33 +24,61 @@ It sets up FastAPI and includes various routers.
 - `/user` - Manage users
 """
 
-Base.metadata.create_all(bind=engine)
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    redis = Redis(host="localhost", port=6379, decode_responses=True)
-    await FastAPILimiter.init(redis)
+    # Nothing here waits on the network: the engine, Redis connections and the SMTP
+    # connection are opened on first use. The schema is managed with alembic.
+    invalidation_listener = asyncio.create_task(listen_for_principal_invalidations())
+    outbox_drainer = asyncio.create_task(outbox_worker.run())
+    event_listener = asyncio.create_task(contact_events.run())
+    replica_monitor = asyncio.create_task(replica_router.run()) if replica_router.configured else None
     yield
-    await redis.close()
-
-app = FastAPI(
-    title="goit-pythonweb-hw-012",
-    description=description,
-    version="1.0.0",
-    lifespan=lifespan
-)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-app.include_router(contacts_router, prefix="/contacts", tags=["Contacts"])
-app.include_router(user_router, prefix="/user", tags=["User"])
+    invalidation_listener.cancel()
+    outbox_drainer.cancel()
+    event_listener.cancel()
+    if replica_monitor is not None:
+        replica_monitor.cancel()
+    await close_redis_client()
+    await dispose_engine()
+    password_hasher.shutdown()
+    avatar_processor.shutdown()
+
+contacts_rate_limit = RateLimiter("contacts", user=RateLimit(300, 60), admin=RateLimit(1200, 60))
+
+def create_app() -> FastAPI:
+    """
+    Build the application; it is ready to serve as soon as its lifespan starts.
+
+    Use ``uvicorn main:create_app --factory``, or the module-level ``app``.
+    """
+    app = FastAPI(
+        title="goit-pythonweb-hw-012",
+        description=description,
+        version="1.0.0",
+        lifespan=lifespan
+    )
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    if replica_router.configured:
+        app.add_middleware(RequestIdentityMiddleware)
+    app.add_middleware(MetricsMiddleware)
+
+    app.include_router(contacts_router, prefix="/contacts", tags=["Contacts"], dependencies=[Depends(contacts_rate_limit)])
+    app.include_router(user_router, prefix="/user", tags=["User"])
+    app.include_router(metrics_router)
+
+    if AVATAR_STORAGE == "local":
+        app.mount(AVATAR_URL_PREFIX, ImmutableStaticFiles(directory=avatar_storage.root, check_dir=False), name="avatars")
+    return app
+
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000, reload=True)
+    uvicorn.run("main:create_app", factory=True, host="127.0.0.1", port=8000, reload=True)
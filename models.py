@@ -1,13 +1,40 @@
-from sqlalchemy import Column, Integer, String, Date, Table, ForeignKey, Boolean
+from datetime import date, datetime, timezone
+
+from sqlalchemy import Column, Integer, SmallInteger, String, Text, Date, DateTime, Table, ForeignKey, Boolean, Index, Computed, DDL, event, func
+from sqlalchemy.orm import validates
 from database import Base
 
 user_contact_association = Table(
     "user_contact",
     Base.metadata,
     Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
-    Column("contact_id", Integer, ForeignKey("contacts.id"), primary_key=True)
+    Column("contact_id", Integer, ForeignKey("contacts.id"), primary_key=True),
+    # The user's contacts_version at the last change of this link or its contact (see /contacts/changes).
+    Column("change_seq", Integer, nullable=False, default=0, server_default="0"),
+    # Copies of contact columns, so a user's ordered list and upcoming birthdays are index scans of their own links.
+    Column("last_name", String, nullable=True),
+    Column("first_name", String, nullable=True),
+    Column("birthday_key", SmallInteger, nullable=True),
+    Index("ix_user_contact_user_change_seq", "user_id", "change_seq", "contact_id"),
+    Index("ix_user_contact_user_last_first", "user_id", "last_name", "first_name", "contact_id"),
+    Index("ix_user_contact_user_birthday_key", "user_id", "birthday_key", "contact_id")
+)
+
+CONTACT_SEARCH_EXPRESSION = (
+    "lower(coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' || "
+    "coalesce(email, '') || ' ' || coalesce(phone, ''))"
 )
 
+def utcnow() -> datetime:
+    """Current UTC time as a naive ``datetime``, the form stored in ``DateTime`` columns."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def birthday_key(birthday: date):
+    """Return the ``MMDD`` integer used to look up birthdays regardless of birth year."""
+    if birthday is None:
+        return None
+    return birthday.month * 100 + birthday.day
+
 class Contact(Base):
     __tablename__ = "contacts"
     id = Column(Integer, primary_key=True, index=True)
@@ -17,6 +44,49 @@ class Contact(Base):
     phone = Column(String, index=True)
     birthday = Column(Date, nullable=True)
     additional_info = Column(String, nullable=True)
+    search_text = Column(String, Computed(CONTACT_SEARCH_EXPRESSION, persisted=True))
+    birthday_key = Column(SmallInteger, nullable=True)
+    # Bumped by every ORM update (optimistic locking) and exposed as the ETag.
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime, nullable=False, default=utcnow, onupdate=utcnow, server_default=func.now())
+
+    __table_args__ = (
+        # Prefix filters compile to lower(column) LIKE 'prefix%'; text_pattern_ops lets Postgres range-scan them.
+        Index(
+            "ix_contacts_first_name_pattern",
+            func.lower(first_name).label("lower_first_name"),
+            postgresql_ops={"lower_first_name": "text_pattern_ops"}
+        ),
+        Index(
+            "ix_contacts_last_name_pattern",
+            func.lower(last_name).label("lower_last_name"),
+            postgresql_ops={"lower_last_name": "text_pattern_ops"}
+        ),
+        Index(
+            "ix_contacts_email_pattern",
+            func.lower(email).label("lower_email"),
+            postgresql_ops={"lower_email": "text_pattern_ops"}
+        ),
+        Index("ix_contacts_phone_pattern", "phone", postgresql_ops={"phone": "text_pattern_ops"}),
+        Index(
+            "ix_contacts_search_text_trgm",
+            "search_text",
+            postgresql_using="gin",
+            postgresql_ops={"search_text": "gin_trgm_ops"}
+        ),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
+    @validates("birthday")
+    def _sync_birthday_key(self, key, value):
+        self.birthday_key = birthday_key(value)
+        return value
+
+event.listen(
+    Contact.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
 
 class User(Base):
     __tablename__ = "users"
@@ -28,3 +98,44 @@ class User(Base):
     avatar_url = Column(String, nullable=True)
     role = Column(String, default="user")
     reset_token = Column(String, nullable=True)
+    # Version of the user's contact list, bumped by every write that changes it. The row
+    # lock taken by the bump orders concurrent writers, so it doubles as the user's
+    # change sequence.
+    contacts_version = Column(Integer, nullable=False, default=0, server_default="0")
+    contacts_updated_at = Column(DateTime, nullable=True)
+
+class ContactTombstone(Base):
+    """A contact that left a user's list (deleted or unlinked), kept for /contacts/changes."""
+    __tablename__ = "contact_tombstones"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    contact_id = Column(Integer, primary_key=True)
+    change_seq = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False, default=utcnow)
+
+    __table_args__ = (
+        Index("ix_contact_tombstones_user_change_seq", "user_id", "change_seq", "contact_id"),
+    )
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    id = Column(Integer, primary_key=True)
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    subtype = Column(String, nullable=False, default="plain")
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=utcnow)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index(
+            "ix_email_outbox_pending",
+            "next_attempt_at",
+            "id",
+            postgresql_where=status == "pending",
+            sqlite_where=status == "pending"
+        ),
+    )
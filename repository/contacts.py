@@ -1,58 +1,720 @@
-from sqlalchemy.orm import Session
-from models import Contact, user_contact_association
-from schemas.contacts import ContactCreate
-from sqlalchemy import and_
-from datetime import date, timedelta
+import base64
+import calendar
+import json
+from typing import Collection, Dict, List, Optional, Set, Tuple
 
-def create_contact(db: Session, contact_data: ContactCreate, user_id: int) -> Contact:
-    db_contact = db.query(Contact).filter(Contact.email == contact_data.email).first()
-    if not db_contact:
-        db_contact = Contact(**contact_data.model_dump())
-        db.add(db_contact)
-        db.commit()
-        db.refresh(db_contact)
+from sqlalchemy import and_, bindparam, func, literal, or_, select, text, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
+from models import Contact, ContactTombstone, User, user_contact_association, birthday_key, utcnow
+from repository import search_index
+from schemas.contacts import ContactBatchOperation, ContactCreate
+from datetime import date, datetime, timedelta
 
-    db.execute(
-        user_contact_association.insert().values(user_id=user_id, contact_id=db_contact.id)
+CONTACT_ORDER = (
+    user_contact_association.c.last_name, user_contact_association.c.first_name, user_contact_association.c.contact_id
+)
+# Contact columns copied onto the user's links, so per-user lookups are served by user_contact indexes.
+LINK_COPY_COLUMNS = ("last_name", "first_name", "birthday_key")
+EXPORT_COLUMNS = (
+    Contact.id, Contact.first_name, Contact.last_name, Contact.email,
+    Contact.phone, Contact.birthday, Contact.additional_info
+)
+# In ``ContactRead`` field order: rows of these columns serialize as ``ContactRecord``s without ORM objects.
+READ_COLUMNS = (
+    Contact.first_name, Contact.last_name, Contact.email, Contact.phone,
+    Contact.birthday, Contact.additional_info, Contact.id
+)
+READ_FIELDS = tuple(column.key for column in READ_COLUMNS)
+IMPORT_COLUMNS = ("first_name", "last_name", "email", "phone", "birthday", "additional_info", "birthday_key")
+
+class ContactVersionConflict(Exception):
+    """The contact's version is not one the caller expected (``If-Match``)."""
+
+def _insert(db: AsyncSession, table):
+    """Return the dialect-specific ``INSERT`` construct that supports ``ON CONFLICT``."""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+async def create_contact(db: AsyncSession, contact_data: ContactCreate, user_id: int) -> Tuple[Contact, str]:
+    """
+    Create a contact (or reuse the one with the same email) and link it to ``user_id``.
+
+    Both writes are ``INSERT ... ON CONFLICT DO NOTHING RETURNING`` statements in a
+    single transaction, so concurrent creates cannot race and repeating the call is
+    harmless. Returns the contact and ``"created"``, ``"linked"`` (existing contact,
+    new link) or ``"existing"`` (already linked).
+
+    Only a new link bumps the list version; it is then stamped with the new version.
+    """
+    contact = await db.scalar(
+        _insert(db, Contact)
+        .values(**_contact_row(contact_data))
+        .on_conflict_do_nothing(index_elements=[Contact.email])
+        .returning(Contact)
+    )
+    created = contact is not None
+    if not created:
+        contact = await db.scalar(select(Contact).where(Contact.email == contact_data.email))
+
+    linked = await db.scalar(
+        _insert(db, user_contact_association)
+        .values(user_id=user_id, contact_id=contact.id, **{name: getattr(contact, name) for name in LINK_COPY_COLUMNS})
+        .on_conflict_do_nothing()
+        .returning(user_contact_association.c.contact_id)
+    )
+    if linked is not None:
+        versions = await _bump_list_versions(db, user_ids=[user_id])
+        await db.execute(
+            update(user_contact_association)
+            .where(user_contact_association.c.user_id == user_id, user_contact_association.c.contact_id == contact.id)
+            .values(change_seq=versions[user_id])
+        )
+    await db.commit()
+
+    if created:
+        return contact, "created"
+    return contact, "linked" if linked is not None else "existing"
+
+async def _bump_list_versions(
+        db: AsyncSession,
+        user_ids: Collection[int] = (),
+        contact_ids: Collection[int] = ()
+) -> Dict[int, int]:
+    """
+    Bump the contact list version of ``user_ids`` and of every user linked to one of
+    ``contact_ids``, inside the caller's transaction; returns the new versions by user id.
+
+    The bumped ``users`` rows stay locked until commit, so each user's versions are
+    handed out in commit order and can serve as the change sequence.
+    """
+    conditions = []
+    if user_ids:
+        conditions.append(User.id.in_(user_ids))
+    if contact_ids:
+        conditions.append(User.id.in_(
+            select(user_contact_association.c.user_id).where(user_contact_association.c.contact_id.in_(contact_ids))
+        ))
+    result = await db.execute(
+        update(User)
+        .where(or_(*conditions))
+        .values(contacts_version=User.contacts_version + 1, contacts_updated_at=utcnow())
+        .returning(User.id, User.contacts_version)
+        .execution_options(synchronize_session=False)
+    )
+    return dict(result.all())
+
+async def get_list_version(db: AsyncSession, user_id: int) -> Tuple[int, Optional[datetime]]:
+    """Return ``(version, updated_at)`` of the user's contact list, for ``ETag``/``Last-Modified``."""
+    row = (await db.execute(
+        select(User.contacts_version, User.contacts_updated_at).where(User.id == user_id)
+    )).first()
+    return (row[0], row[1]) if row else (0, None)
+
+async def get_list_versions(db: AsyncSession, user_ids: Collection[int]) -> Dict[int, Tuple[int, Optional[datetime]]]:
+    """Return ``(version, updated_at)`` of several users' contact lists by user id."""
+    if not user_ids:
+        return {}
+    result = await db.execute(
+        select(User.id, User.contacts_version, User.contacts_updated_at).where(User.id.in_(user_ids))
+    )
+    return {user_id: (version, updated_at) for user_id, version, updated_at in result}
+
+def _contact_row(contact_data: ContactCreate) -> dict:
+    row = contact_data.model_dump()
+    row["birthday_key"] = birthday_key(row["birthday"])
+    return row
+
+async def _bulk_link_postgres(db: AsyncSession, user_id: int, rows: List[dict], change_seq: int):
+    columns = ", ".join(IMPORT_COLUMNS)
+    copies = ", ".join(LINK_COPY_COLUMNS)
+    await db.execute(text(
+        "CREATE TEMP TABLE contact_import ("
+        "first_name varchar, last_name varchar, email varchar, phone varchar, "
+        "birthday date, additional_info varchar, birthday_key smallint"
+        ") ON COMMIT DROP"
+    ))
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        "contact_import",
+        records=[tuple(row[column] for column in IMPORT_COLUMNS) for row in rows],
+        columns=IMPORT_COLUMNS
+    )
+    await db.execute(
+        text(
+            "WITH upserted AS ("
+            f"INSERT INTO contacts ({columns}, updated_at) SELECT {columns}, :now FROM contact_import "
+            f"ON CONFLICT (email) DO UPDATE SET email = EXCLUDED.email RETURNING id, {copies}"
+            ") "
+            f"INSERT INTO user_contact (user_id, contact_id, change_seq, {copies}) "
+            f"SELECT :user_id, id, :change_seq, {copies} FROM upserted "
+            "ON CONFLICT DO NOTHING"
+        ),
+        {"user_id": user_id, "now": utcnow(), "change_seq": change_seq}
+    )
+
+async def _bulk_link_generic(db: AsyncSession, user_id: int, rows: List[dict], change_seq: int):
+    stmt = _insert(db, Contact.__table__).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Contact.__table__.c.email],
+        set_={"email": stmt.excluded.email}
+    ).returning(Contact.__table__.c.id, *(Contact.__table__.c[name] for name in LINK_COPY_COLUMNS))
+    contacts = (await db.execute(stmt)).all()
+    await db.execute(
+        _insert(db, user_contact_association)
+        .values([
+            {"user_id": user_id, "contact_id": contact_id, "change_seq": change_seq, **dict(zip(LINK_COPY_COLUMNS, copy))}
+            for contact_id, *copy in contacts
+        ])
+        .on_conflict_do_nothing()
+    )
+
+async def bulk_link_contacts(db: AsyncSession, user_id: int, contacts: List[ContactCreate]) -> int:
+    """
+    Insert or reuse contacts by email and link all of them to ``user_id`` in one transaction.
+
+    Postgres rows are streamed with ``COPY`` into a temporary table and merged with a
+    single ``INSERT ... ON CONFLICT`` statement; SQLite uses a multi-row upsert.
+    Emails must be unique within ``contacts``. Returns the number of rows written.
+    """
+    if not contacts:
+        return 0
+    rows = [_contact_row(contact_data) for contact_data in contacts]
+    change_seq = (await _bump_list_versions(db, user_ids=[user_id]))[user_id]
+    if db.get_bind().dialect.name == "postgresql":
+        await _bulk_link_postgres(db, user_id, rows, change_seq)
+    else:
+        await _bulk_link_generic(db, user_id, rows, change_seq)
+    await db.commit()
+    return len(rows)
+
+async def get_user_contacts(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(Contact).join(user_contact_association).where(user_contact_association.c.user_id == user_id)
+    )
+    return result.scalars().all()
+
+async def stream_user_contacts(db: AsyncSession, user_id: int, batch_size: int = 1000):
+    """
+    Yield a user's contacts as lists of plain row tuples (``EXPORT_COLUMNS``), ordered by id.
+
+    Rows come from a server-side cursor ``batch_size`` at a time, so neither the
+    full result nor ORM objects are ever materialized.
+    """
+    result = await db.stream(
+        select(*EXPORT_COLUMNS)
+        .join(user_contact_association)
+        .where(user_contact_association.c.user_id == user_id)
+        .order_by(Contact.id)
+        .execution_options(yield_per=batch_size)
+    )
+    async for partition in result.partitions():
+        yield partition
+
+def _encode_cursor(contact, direction: str) -> str:
+    raw = json.dumps([direction, contact.last_name, contact.first_name, contact.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str):
+    """Decode an opaque cursor into its direction and ``(last_name, first_name, id)`` key."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, last_name, first_name, contact_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if direction not in ("next", "prev") or not isinstance(contact_id, int):
+        raise ValueError("Invalid cursor")
+    return direction, (last_name, first_name, contact_id)
+
+def encode_change_cursor(change_seq: int, contact_id: int) -> str:
+    raw = json.dumps(["changes", change_seq, contact_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_change_cursor(cursor: str) -> Tuple[int, int]:
+    """Decode a ``/contacts/changes`` cursor into its ``(change_seq, contact_id)`` position."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        kind, change_seq, contact_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if kind != "changes" or not isinstance(change_seq, int) or not isinstance(contact_id, int):
+        raise ValueError("Invalid cursor")
+    return change_seq, contact_id
+
+def _filter_contacts(stmt, name: Optional[str] = None, email: Optional[str] = None, phone: Optional[str] = None):
+    # lower(column) LIKE 'prefix%' rather than ILIKE, so the lower() pattern indexes apply.
+    if name:
+        stmt = stmt.where(or_(
+            func.lower(Contact.first_name).startswith(name.lower(), autoescape=True),
+            func.lower(Contact.last_name).startswith(name.lower(), autoescape=True)
+        ))
+    if email:
+        stmt = stmt.where(func.lower(Contact.email).startswith(email.lower(), autoescape=True))
+    if phone:
+        stmt = stmt.where(Contact.phone.startswith(phone, autoescape=True))
+    return stmt
+
+async def get_user_contacts_page(
+        db: AsyncSession,
+        user_id: int,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        name: Optional[str] = None,
+        email: Optional[str] = None,
+        phone: Optional[str] = None
+):
+    """
+    Return one keyset page of a user's contacts ordered by last name, first name and id.
+
+    The page is resolved with a row-value comparison against the cursor key on the
+    user's links, so an unfiltered page is served by ``ix_user_contact_user_last_first``
+    no matter how deep it is. Filters are prefix matches backed by the ``ix_contacts_*_pattern``
+    indexes; a filtered page either walks the user's links in order until it has
+    ``limit`` matches or starts from the matching contacts, so its cost depends on
+    how selective the filter is. Contacts are rows of ``READ_COLUMNS``. Returns a ``(contacts, next_cursor, prev_cursor)``
+    tuple; raises ``ValueError`` for a malformed cursor.
+    """
+    stmt = (
+        select(*READ_COLUMNS)
+        .select_from(user_contact_association)
+        .join(Contact, Contact.id == user_contact_association.c.contact_id)
+        .where(user_contact_association.c.user_id == user_id)
+    )
+    stmt = _filter_contacts(stmt, name, email, phone)
+
+    direction = "next"
+    if cursor:
+        direction, key = _decode_cursor(cursor)
+        if direction == "next":
+            stmt = stmt.where(tuple_(*CONTACT_ORDER) > tuple_(*key))
+        else:
+            stmt = stmt.where(tuple_(*CONTACT_ORDER) < tuple_(*key))
+
+    if direction == "next":
+        stmt = stmt.order_by(*CONTACT_ORDER)
+    else:
+        stmt = stmt.order_by(*(column.desc() for column in CONTACT_ORDER))
+
+    result = await db.execute(stmt.limit(limit + 1))
+    contacts = result.all()
+    has_more = len(contacts) > limit
+    contacts = contacts[:limit]
+
+    if direction == "next":
+        next_cursor = _encode_cursor(contacts[-1], "next") if has_more else None
+        prev_cursor = _encode_cursor(contacts[0], "prev") if cursor and contacts else None
+    else:
+        contacts.reverse()
+        prev_cursor = _encode_cursor(contacts[0], "prev") if has_more else None
+        next_cursor = _encode_cursor(contacts[-1], "next") if contacts else None
+
+    return contacts, next_cursor, prev_cursor
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+async def _search_postgres(db: AsyncSession, user_id: int, query: str, limit: int, offset: int):
+    score = func.word_similarity(query, Contact.search_text)
+    stmt = (
+        select(*READ_COLUMNS)
+        .join(user_contact_association)
+        .where(
+            user_contact_association.c.user_id == user_id,
+            or_(
+                Contact.search_text.like(f"%{_escape_like(query)}%", escape="\\"),
+                literal(query).op("<%")(Contact.search_text)
+            )
+        )
+        .order_by(score.desc(), Contact.id)
+        .offset(offset)
+        .limit(limit + 1)
     )
-    db.commit()
+    result = await db.execute(stmt)
+    return result.all()
+
+async def _search_fallback(db: AsyncSession, user_id: int, query: str, limit: int, offset: int):
+    version, _ = await get_list_version(db, user_id)
+    index = search_index.get_index(user_id, version)
+    contacts = None
+    if index is None:
+        result = await db.execute(
+            select(*READ_COLUMNS, Contact.search_text)
+            .join(user_contact_association)
+            .where(user_contact_association.c.user_id == user_id)
+        )
+        contacts = {contact.id: contact for contact in result.all()}
+        index = search_index.TrigramIndex((contact.id, contact.search_text) for contact in contacts.values())
+        search_index.set_index(user_id, version, index)
+
+    ids = [doc_id for doc_id, _ in index.search(query)[offset:offset + limit + 1]]
+    if not ids:
+        return []
+    if contacts is None:
+        result = await db.execute(select(*READ_COLUMNS).where(Contact.id.in_(ids)))
+        contacts = {contact.id: contact for contact in result.all()}
+    return [contacts[doc_id] for doc_id in ids if doc_id in contacts]
 
-    return db_contact
+async def search_contacts(db: AsyncSession, user_id: int, query: str, limit: int = 20, offset: int = 0):
+    """
+    Rank a user's contacts against ``query`` by prefix, substring and fuzzy match.
 
-def get_user_contacts(db: Session, user_id: int):
-    return db.query(Contact).join(user_contact_association).filter(user_contact_association.c.user_id == user_id).all()
+    On Postgres the lookup runs on the ``pg_trgm`` GIN index over ``search_text``;
+    other databases use the in-process trigram index from ``repository.search_index``,
+    cached per contact list version.
+    Returns a ``(contacts, next_offset)`` tuple with contacts as rows of ``READ_COLUMNS``.
+    """
+    query = query.strip().lower()
+    if db.get_bind().dialect.name == "postgresql":
+        contacts = await _search_postgres(db, user_id, query, limit, offset)
+    else:
+        contacts = await _search_fallback(db, user_id, query, limit, offset)
+    next_offset = offset + limit if len(contacts) > limit else None
+    return contacts[:limit], next_offset
 
-def get_contact_by_id(db: Session, contact_id: int, user_id: int):
-    return db.query(Contact).join(user_contact_association).filter(
-        and_(
+async def get_contact_by_id(db: AsyncSession, contact_id: int, user_id: int):
+    result = await db.execute(
+        select(Contact).join(user_contact_association).where(
+            and_(
+                user_contact_association.c.user_id == user_id,
+                user_contact_association.c.contact_id == contact_id
+            )
+        )
+    )
+    return result.scalars().first()
+
+async def get_contact_version(db: AsyncSession, contact_id: int, user_id: int) -> Optional[Tuple[int, datetime]]:
+    """Return ``(version, updated_at)`` of one of the user's contacts without loading it, or ``None``."""
+    row = (await db.execute(
+        select(Contact.version, Contact.updated_at).join(user_contact_association).where(
             user_contact_association.c.user_id == user_id,
             user_contact_association.c.contact_id == contact_id
         )
-    ).first()
+    )).first()
+    return (row[0], row[1]) if row else None
+
+async def _stamp_links(db: AsyncSession, contact_ids: Collection[int]):
+    """
+    Set the links of ``contact_ids`` to their users' freshly bumped list versions
+    and refresh their copies of the contacts' ``LINK_COPY_COLUMNS``.
+    """
+    copies = {
+        name: select(Contact.__table__.c[name]).where(
+            Contact.id == user_contact_association.c.contact_id
+        ).scalar_subquery()
+        for name in LINK_COPY_COLUMNS
+    }
+    await db.execute(
+        update(user_contact_association)
+        .where(user_contact_association.c.contact_id.in_(contact_ids))
+        .values(
+            change_seq=select(User.contacts_version).where(
+                User.id == user_contact_association.c.user_id
+            ).scalar_subquery(),
+            **copies
+        )
+    )
+
+async def _unlink(db: AsyncSession, condition):
+    """Delete the links matching ``condition``, leaving tombstones stamped with the bumped list versions."""
+    links = select(
+        user_contact_association.c.user_id, user_contact_association.c.contact_id, User.contacts_version, literal(utcnow())
+    ).join(User, User.id == user_contact_association.c.user_id).where(condition)
+    stmt = _insert(db, ContactTombstone).from_select(["user_id", "contact_id", "change_seq", "deleted_at"], links)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[ContactTombstone.user_id, ContactTombstone.contact_id],
+        set_={"change_seq": stmt.excluded.change_seq, "deleted_at": stmt.excluded.deleted_at}
+    ))
+    await db.execute(user_contact_association.delete().where(condition))
+
+def _check_version(contact: Contact, expected_versions: Optional[Set[int]]):
+    if expected_versions is not None and contact.version not in expected_versions:
+        raise ContactVersionConflict()
 
-def update_contact(db: Session, contact_id: int, contact_data: ContactCreate, user_id: int):
-    contact = get_contact_by_id(db, contact_id, user_id)
+async def update_contact(
+        db: AsyncSession,
+        contact_id: int,
+        contact_data: ContactCreate,
+        user_id: int,
+        expected_versions: Optional[Set[int]] = None
+) -> Tuple[Optional[Contact], List[int]]:
+    """
+    Update one of the user's contacts. Returns the contact (``None`` if it is not
+    theirs) and the ids of the users whose lists changed, which is every user
+    linked to it, or none when the data was already current.
+
+    The ``UPDATE`` is conditional on the version that was read, so it raises
+    ``ContactVersionConflict`` both when that version is not in ``expected_versions``
+    and when a concurrent update got there first.
+    """
+    contact = await get_contact_by_id(db, contact_id, user_id)
     if not contact:
-        return None
-    for key, value in contact_data.dict().items():
+        return None, []
+    _check_version(contact, expected_versions)
+    for key, value in contact_data.model_dump().items():
         setattr(contact, key, value)
-    db.commit()
-    return contact
+    if not db.is_modified(contact):
+        return contact, []
+    try:
+        await db.flush()
+        versions = await _bump_list_versions(db, contact_ids=[contact_id])
+        await _stamp_links(db, [contact_id])
+        await db.commit()
+    except StaleDataError:
+        await db.rollback()
+        raise ContactVersionConflict()
+    return contact, list(versions)
 
-def delete_contact(db: Session, contact_id: int, user_id: int) -> bool:
-    contact = get_contact_by_id(db, contact_id, user_id)
+async def delete_contact(
+        db: AsyncSession,
+        contact_id: int,
+        user_id: int,
+        expected_versions: Optional[Set[int]] = None
+) -> Tuple[bool, List[int]]:
+    """
+    Delete one of the user's contacts, for every user it is linked to. Returns whether
+    it was deleted (``False`` if it is not theirs) and the ids of the users it was
+    linked to. See :func:`update_contact` for versions.
+    """
+    contact = await get_contact_by_id(db, contact_id, user_id)
     if not contact:
-        return False
-    db.delete(contact)
-    db.commit()
-    return True
-
-def get_upcoming_birthdays(db: Session, user_id: int):
-    today = date.today()
-    next_week = today + timedelta(days=7)
-    return db.query(Contact).join(user_contact_association).filter(
-        and_(
+        return False, []
+    _check_version(contact, expected_versions)
+    versions = await _bump_list_versions(db, contact_ids=[contact_id])
+    await _unlink(db, user_contact_association.c.contact_id == contact_id)
+    await db.delete(contact)
+    try:
+        await db.commit()
+    except StaleDataError:
+        await db.rollback()
+        raise ContactVersionConflict()
+    return True, list(versions)
+
+def _record(row) -> dict:
+    """A ``ContactRecord`` dict from a row that starts with ``READ_COLUMNS``."""
+    return dict(zip(READ_FIELDS, row))
+
+async def _batch_create(db: AsyncSession, user_id: int, contacts: List[ContactCreate], change_seq: int) -> List[Tuple[str, dict]]:
+    """Insert or reuse ``contacts`` by email and link them, in three statements; returns ``(outcome, record)`` pairs."""
+    table = Contact.__table__
+    rows = [_contact_row(contact_data) for contact_data in contacts]
+    created = set((await db.execute(
+        _insert(db, table).values(rows).on_conflict_do_nothing(index_elements=[table.c.email]).returning(table.c.email)
+    )).scalars())
+    emails = [row["email"] for row in rows]
+    records = {row.email: _record(row) for row in (await db.execute(select(*READ_COLUMNS).where(Contact.email.in_(emails))))}
+    linked = set((await db.execute(
+        _insert(db, user_contact_association)
+        .values([
+            {
+                "user_id": user_id, "contact_id": records[email]["id"], "change_seq": change_seq,
+                "last_name": records[email]["last_name"], "first_name": records[email]["first_name"],
+                "birthday_key": birthday_key(records[email]["birthday"])
+            }
+            for email in emails
+        ])
+        .on_conflict_do_nothing()
+        .returning(user_contact_association.c.contact_id)
+    )).scalars())
+    outcomes = []
+    for email in emails:
+        record = records[email]
+        if email in created:
+            outcomes.append(("created", record))
+        else:
+            outcomes.append(("linked" if record["id"] in linked else "existing", record))
+    return outcomes
+
+async def apply_contact_batch(
+        db: AsyncSession,
+        user_id: int,
+        operations: List[ContactBatchOperation]
+) -> Tuple[List[Tuple[str, Optional[dict]]], Dict[int, List[int]]]:
+    """
+    Apply get/create/update/delete ``operations`` for ``user_id`` in one transaction.
+
+    The work is set-based, so a batch costs about a dozen statements however many
+    operations it holds:
+
+    - every contact named by id is checked against the user's links with one
+      ``WHERE id IN (...)`` query, which also locks them (Postgres) when any is written;
+    - creates are one multi-row upsert, one lookup and one multi-row link;
+    - updates are one executemany ``UPDATE``;
+    - deletes are one ``DELETE``.
+
+    Each operation gets an outcome with the contact as a ``ContactRecord`` dict, or
+    ``None`` when there is no contact to return:
+
+    - ``get``: ``found``;
+    - ``create``: ``created``, ``linked`` or ``existing`` (as for :func:`create_contact`);
+    - ``update``: ``updated`` or ``unchanged``;
+    - ``delete``: ``deleted``;
+    - any operation on an id the user does not have: ``not_found``;
+    - an operation whose ``version`` does not match: ``conflict``.
+
+    Failed operations do not stop the others. Also returns, for each updated or
+    deleted contact, the users linked to it. Operations must name distinct contacts
+    and distinct new emails (see ``ContactBatch``). Raises ``ContactVersionConflict``,
+    with nothing applied, if a concurrent writer changes a contact between the check
+    and the update.
+    """
+    ids = [operation.id for operation in operations if operation.op != "create"]
+    current = {}
+    if ids:
+        stmt = select(*READ_COLUMNS, Contact.version).join(user_contact_association).where(
             user_contact_association.c.user_id == user_id,
-            Contact.birthday.between(today, next_week)
+            user_contact_association.c.contact_id.in_(ids)
+        )
+        if any(operation.op in ("update", "delete") for operation in operations):
+            stmt = stmt.with_for_update(of=Contact)
+        current = {row.id: row for row in await db.execute(stmt)}
+
+    outcomes: List[Optional[Tuple[str, Optional[dict]]]] = []
+    creates, updates, deletes = [], [], []
+    for operation in operations:
+        if operation.op == "create":
+            creates.append(operation.contact)
+            outcomes.append(None)
+            continue
+        row = current.get(operation.id)
+        if row is None:
+            outcomes.append(("not_found", None))
+        elif operation.op == "get":
+            outcomes.append(("found", _record(row)))
+        elif operation.version is not None and operation.version != row.version:
+            outcomes.append(("conflict", None))
+        elif operation.op == "delete":
+            deletes.append(operation.id)
+            outcomes.append(("deleted", None))
+        else:
+            record = {**operation.contact.model_dump(), "id": operation.id}
+            if record == _record(row):
+                outcomes.append(("unchanged", record))
+                continue
+            updates.append({
+                "b_id": operation.id, "b_version": row.version,
+                **{f"b_{key}": value for key, value in _contact_row(operation.contact).items()}
+            })
+            outcomes.append(("updated", record))
+
+    changed = [values["b_id"] for values in updates] + deletes
+    linked_user_ids: Dict[int, List[int]] = {}
+    if changed:
+        links = await db.execute(
+            select(user_contact_association.c.contact_id, user_contact_association.c.user_id)
+            .where(user_contact_association.c.contact_id.in_(changed))
+        )
+        for contact_id, linked_user_id in links:
+            linked_user_ids.setdefault(contact_id, []).append(linked_user_id)
+    if not creates and not changed:
+        return outcomes, linked_user_ids
+
+    versions = await _bump_list_versions(db, user_ids=[user_id] if creates else (), contact_ids=changed)
+    if creates:
+        created = iter(await _batch_create(db, user_id, creates, versions[user_id]))
+        outcomes = [next(created) if outcome is None else outcome for outcome in outcomes]
+    if updates:
+        table = Contact.__table__
+        result = await db.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_id"), table.c.version == bindparam("b_version"))
+            .values(
+                **{column: bindparam(f"b_{column}") for column in IMPORT_COLUMNS},
+                version=table.c.version + 1,
+                updated_at=utcnow()
+            ),
+            updates
         )
-    ).all()
+        # Only reachable without row locks (SQLite); drivers that cannot count executemany rows skip it.
+        if db.get_bind().dialect.supports_sane_multi_rowcount and result.rowcount != len(updates):
+            await db.rollback()
+            raise ContactVersionConflict()
+        await _stamp_links(db, [values["b_id"] for values in updates])
+    if deletes:
+        await _unlink(db, user_contact_association.c.contact_id.in_(deletes))
+        await db.execute(Contact.__table__.delete().where(Contact.id.in_(deletes)))
+    await db.commit()
+    return outcomes, linked_user_ids
+
+async def get_contact_changes(
+        db: AsyncSession,
+        user_id: int,
+        after: Tuple[int, int] = (-1, 0),
+        limit: int = 500
+) -> Tuple[List[Tuple[int, int, Optional[Contact]]], bool]:
+    """
+    Return what changed in the user's contact list after the ``(change_seq, contact_id)``
+    position ``after``, oldest first, and whether more changes follow.
+
+    Each change is ``(change_seq, contact_id, contact)``, with ``contact`` ``None`` for
+    a tombstone. Both lookups are range scans on ``(user_id, change_seq, contact_id)``
+    indexes, so the cost depends on the number of changes, not on the list size.
+    """
+    position = tuple_(literal(after[0]), literal(after[1]))
+    links = await db.execute(
+        select(user_contact_association.c.change_seq, Contact)
+        .join(user_contact_association)
+        .where(
+            user_contact_association.c.user_id == user_id,
+            tuple_(user_contact_association.c.change_seq, user_contact_association.c.contact_id) > position
+        )
+        .order_by(user_contact_association.c.change_seq, user_contact_association.c.contact_id)
+        .limit(limit + 1)
+    )
+    tombstones = await db.execute(
+        select(ContactTombstone.change_seq, ContactTombstone.contact_id)
+        .where(
+            ContactTombstone.user_id == user_id,
+            tuple_(ContactTombstone.change_seq, ContactTombstone.contact_id) > position
+        )
+        .order_by(ContactTombstone.change_seq, ContactTombstone.contact_id)
+        .limit(limit + 1)
+    )
+    changes = [(seq, contact.id, contact) for seq, contact in links.all()]
+    changes += [(seq, contact_id, None) for seq, contact_id in tombstones.all()]
+    changes.sort(key=lambda change: (change[0], change[1]))
+    return changes[:limit], len(changes) > limit
+
+def _birthday_key_ranges(start: date, days: int):
+    """
+    Return inclusive ``(from_key, to_key)`` ranges of ``MMDD`` keys covering ``start``..``start + days``.
+
+    A window that crosses New Year is split in two. In common years Feb 29
+    birthdays are celebrated on Feb 28, so key 229 joins any window containing it.
+    """
+    end = start + timedelta(days=days)
+    if end.year == start.year:
+        ranges = [(birthday_key(start), birthday_key(end))]
+    else:
+        ranges = [(birthday_key(start), 1231), (101, birthday_key(end))]
+
+    for year in {start.year, end.year}:
+        if not calendar.isleap(year) and start <= date(year, 2, 28) <= end:
+            ranges.append((229, 229))
+    return ranges
+
+async def get_upcoming_birthdays(db: AsyncSession, user_id: int, days: int = 7, today: Optional[date] = None):
+    """
+    Return the user's contacts whose birthday falls within the next ``days`` days.
+
+    The lookup runs on ``ix_user_contact_user_birthday_key`` (the links carry a copy
+    of the contact's ``birthday_key``), so it scans only the user's own links in the
+    key ranges of the window and joins just those contacts. Contacts are rows of
+    ``READ_COLUMNS``, ordered by how soon the birthday comes.
+    """
+    today = today or date.today()
+    start_key = birthday_key(today)
+    link_key = user_contact_association.c.birthday_key
+    result = await db.execute(
+        select(*READ_COLUMNS)
+        .select_from(user_contact_association)
+        .join(Contact, Contact.id == user_contact_association.c.contact_id)
+        .where(
+            user_contact_association.c.user_id == user_id,
+            or_(*(link_key.between(low, high) for low, high in _birthday_key_ranges(today, days)))
+        )
+        .order_by(link_key < start_key, link_key, user_contact_association.c.contact_id)
+    )
+    return result.all()
@@ -0,0 +1,72 @@
+"""
+In-process trigram index used for contact search when the database has no
+``pg_trgm`` support (SQLite in development and tests).
+
+Postgres searches go straight to the GIN trigram index on ``contacts.search_text``;
+this module only mirrors that behaviour closely enough for local runs.
+"""
+from collections import defaultdict
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from services.memory_cache import TTLCache
+
+MIN_SCORE = 0.6
+SEARCH_INDEX_CACHE_SIZE = 1000
+SEARCH_INDEX_TTL = 600
+
+def trigrams(text: str) -> Set[str]:
+    """Return the padded trigrams of every word in ``text``, like ``pg_trgm`` does."""
+    result = set()
+    for word in text.split():
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+class TrigramIndex:
+    """Inverted trigram index over the ``search_text`` of one user's contacts."""
+
+    def __init__(self, documents: Iterable[Tuple[int, str]]):
+        self._documents: Dict[int, str] = {}
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        for doc_id, text in documents:
+            text = (text or "").lower()
+            self._documents[doc_id] = text
+            for gram in trigrams(text):
+                self._postings[gram].add(doc_id)
+
+    def _score(self, query: str, text: str) -> float:
+        position = text.find(query)
+        if position != -1:
+            # Whole-text prefix beats word prefix beats plain substring.
+            if position == 0:
+                return 3.0
+            return 2.0 if text[position - 1] == " " else 1.5
+        return max((SequenceMatcher(None, query, word).ratio() for word in text.split()), default=0.0)
+
+    def search(self, query: str) -> List[Tuple[int, float]]:
+        """Return ``(doc_id, score)`` pairs matching ``query``, best first."""
+        query = query.lower().strip()
+        if not query:
+            return []
+        candidates: Set[int] = set()
+        for gram in trigrams(query):
+            candidates.update(self._postings.get(gram, ()))
+
+        scored = []
+        for doc_id in candidates:
+            score = self._score(query, self._documents[doc_id])
+            if score >= MIN_SCORE:
+                scored.append((doc_id, score))
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored
+
+# Keyed by (user id, contact list version): any write to a user's list bumps the
+# version, so a stale index is never looked up again, in this worker or any other.
+_indexes = TTLCache(maxsize=SEARCH_INDEX_CACHE_SIZE, ttl=SEARCH_INDEX_TTL)
+
+def get_index(user_id: int, version: int) -> Optional[TrigramIndex]:
+    return _indexes.get((user_id, version))
+
+def set_index(user_id: int, version: int, index: TrigramIndex):
+    _indexes.set((user_id, version), index)
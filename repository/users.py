@@ -0,0 +1,24 @@
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User
+
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
+    result = await db.execute(select(User).where(User.email == email))
+    return result.scalars().first()
+
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User]:
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
+
+async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[User]:
+    return await db.get(User, user_id)
+
+async def create_user(db: AsyncSession, username: str, email: str, hashed_password: str, role: str = "user") -> User:
+    user = User(username=username, email=email, hashed_password=hashed_password, role=role)
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+    return user
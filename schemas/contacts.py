@@ -1,5 +1,6 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, model_validator
+from typing import List, Literal, Optional, Union
+from typing_extensions import Annotated, TypedDict
 from datetime import date
 
 class ContactCreate(BaseModel):
@@ -11,7 +12,111 @@ class ContactCreate(BaseModel):
     additional_info: Optional[str]
 
 class ContactRead(ContactCreate):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+
+class ContactRecord(TypedDict):
+    """
+    A ``ContactRead`` as a plain dict, for serializing rows read straight from the
+    database. The values were validated when they were written, so a ``TypeAdapter``
+    over this type only serializes them. Keys are in ``ContactRead`` field order.
+    """
+    first_name: str
+    last_name: str
+    email: str
+    phone: str
+    birthday: Optional[date]
+    additional_info: Optional[str]
     id: int
 
-    class Config:
-        orm_mode = True
+class ContactCreateResult(ContactRead):
+    result: Literal["created", "linked", "existing"]
+
+class ContactPage(BaseModel):
+    items: List[ContactRead]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+class ContactSearchPage(BaseModel):
+    items: List[ContactRead]
+    next_offset: Optional[int] = None
+
+class ContactRecordPage(TypedDict):
+    items: List[ContactRecord]
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+
+class ContactRecordSearchPage(TypedDict):
+    items: List[ContactRecord]
+    next_offset: Optional[int]
+
+class ContactChange(BaseModel):
+    seq: int
+    op: Literal["upsert", "delete"]
+    id: int
+    contact: Optional[ContactRead] = None
+
+class ContactChangesPage(BaseModel):
+    changes: List[ContactChange]
+    cursor: str
+    has_more: bool
+
+BATCH_MAX_OPERATIONS = 1000
+
+class ContactBatchGet(BaseModel):
+    op: Literal["get"]
+    id: int
+
+class ContactBatchCreate(BaseModel):
+    op: Literal["create"]
+    contact: ContactCreate
+
+class ContactBatchUpdate(BaseModel):
+    op: Literal["update"]
+    id: int
+    contact: ContactCreate
+    version: Optional[int] = Field(None, description="Apply only if the contact is at this version (like If-Match)")
+
+class ContactBatchDelete(BaseModel):
+    op: Literal["delete"]
+    id: int
+    version: Optional[int] = Field(None, description="Apply only if the contact is at this version (like If-Match)")
+
+ContactBatchOperation = Annotated[
+    Union[ContactBatchGet, ContactBatchCreate, ContactBatchUpdate, ContactBatchDelete], Field(discriminator="op")
+]
+
+class ContactBatch(BaseModel):
+    operations: List[ContactBatchOperation] = Field(..., min_length=1, max_length=BATCH_MAX_OPERATIONS)
+
+    @model_validator(mode="after")
+    def _distinct_targets(self):
+        ids = [operation.id for operation in self.operations if operation.op != "create"]
+        if len(ids) != len(set(ids)):
+            raise ValueError("Each contact id may appear in only one operation per batch")
+        emails = [operation.contact.email for operation in self.operations if operation.op == "create"]
+        if len(emails) != len(set(emails)):
+            raise ValueError("Each email may be created only once per batch")
+        return self
+
+class ContactBatchResult(TypedDict):
+    op: Literal["get", "create", "update", "delete"]
+    id: int
+    status: int
+    result: Literal["found", "created", "linked", "existing", "updated", "unchanged", "deleted", "not_found", "conflict"]
+    contact: Optional[ContactRecord]
+
+class ContactBatchReport(TypedDict):
+    results: List[ContactBatchResult]
+
+class ContactImportError(BaseModel):
+    row: int
+    errors: List[str]
+
+class ContactImportReport(BaseModel):
+    processed: int
+    imported: int
+    failed: int
+    errors: List[ContactImportError]
+    errors_truncated: bool = False
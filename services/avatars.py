@@ -0,0 +1,165 @@
+"""
+Avatar upload pipeline.
+
+Uploads are read in chunks with a hard size cap, then decoded, cropped and
+resized to a fixed set of square thumbnails on a small thread pool (Pillow
+releases the GIL while it decodes and resamples). Thumbnails are stored under
+content-hash names through a pluggable backend, so a stored URL never changes
+meaning and can be cached forever.
+"""
+import abc
+import asyncio
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile, status
+from starlette.staticfiles import StaticFiles
+
+AVATAR_MAX_BYTES = int(os.getenv("AVATAR_MAX_BYTES", 5 * 1024 * 1024))
+AVATAR_MAX_PIXELS = int(os.getenv("AVATAR_MAX_PIXELS", 40_000_000))
+AVATAR_CHUNK_SIZE = 64 * 1024
+AVATAR_SIZES = (256, 128, 64)
+AVATAR_FORMATS = {"JPEG", "PNG", "WEBP", "GIF"}
+AVATAR_WORKERS = int(os.getenv("AVATAR_WORKERS", 2))
+AVATAR_STORAGE = os.getenv("AVATAR_STORAGE", "cloudinary")
+AVATAR_LOCAL_DIR = os.getenv("AVATAR_LOCAL_DIR", "media/avatars")
+AVATAR_URL_PREFIX = "/avatars"
+AVATAR_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+class AvatarTooLargeError(HTTPException):
+    def __init__(self, max_bytes: int):
+        super().__init__(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Avatar must not exceed {max_bytes} bytes"
+        )
+
+class InvalidAvatarError(HTTPException):
+    def __init__(self, detail: str = "Avatar must be a JPEG, PNG, WebP or GIF image"):
+        super().__init__(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=detail)
+
+async def read_upload(file: UploadFile, max_bytes: int = AVATAR_MAX_BYTES, chunk_size: int = AVATAR_CHUNK_SIZE) -> bytes:
+    """Read ``file`` chunk by chunk, failing as soon as it grows past ``max_bytes``."""
+    if file.size is not None and file.size > max_bytes:
+        raise AvatarTooLargeError(max_bytes)
+    buffer = bytearray()
+    while chunk := await file.read(chunk_size):
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise AvatarTooLargeError(max_bytes)
+    return bytes(buffer)
+
+def render_thumbnails(data: bytes, sizes: Tuple[int, ...] = AVATAR_SIZES) -> Dict[int, bytes]:
+    """Decode ``data`` and return a square WebP thumbnail per size; blocking, run it off the loop."""
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format not in AVATAR_FORMATS:
+                raise InvalidAvatarError()
+            # Checked before decoding, so a small file claiming huge dimensions costs nothing.
+            if image.width * image.height > AVATAR_MAX_PIXELS:
+                raise InvalidAvatarError("Avatar dimensions are too large")
+            image = ImageOps.exif_transpose(image).convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+    except (OSError, Image.DecompressionBombError, SyntaxError):
+        raise InvalidAvatarError()
+
+    thumbnails = {}
+    for size in sizes:
+        thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        thumbnail.save(output, format="WEBP", quality=85, method=4)
+        thumbnails[size] = output.getvalue()
+    return thumbnails
+
+class AvatarStorage(abc.ABC):
+    """Stores immutable, content-addressed avatar files and returns their public URLs."""
+
+    @abc.abstractmethod
+    async def save(self, name: str, data: bytes, content_type: str) -> str:
+        ...
+
+class LocalAvatarStorage(AvatarStorage):
+    """Writes avatars under ``root``; they are served by :class:`ImmutableStaticFiles` at ``url_prefix``."""
+
+    def __init__(self, root: str = AVATAR_LOCAL_DIR, url_prefix: str = AVATAR_URL_PREFIX):
+        self.root = Path(root)
+        self.url_prefix = url_prefix.rstrip("/")
+
+    def _write(self, name: str, data: bytes):
+        path = self.root / name
+        if path.exists():
+            # Same name means same content; nothing to do.
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    async def save(self, name: str, data: bytes, content_type: str) -> str:
+        await asyncio.to_thread(self._write, name, data)
+        return f"{self.url_prefix}/{name}"
+
+class CloudinaryAvatarStorage(AvatarStorage):
+    """Uploads avatars to Cloudinary, whose versioned CDN URLs are already cached long-term."""
+
+    def __init__(self, folder: str = "avatars"):
+        self.folder = folder
+
+    async def save(self, name: str, data: bytes, content_type: str) -> str:
+        # Imported on first upload: the SDK is slow to import and reads CLOUDINARY_URL when it does.
+        import cloudinary.uploader
+
+        public_id = name.rsplit(".", 1)[0]
+        result = await asyncio.to_thread(
+            cloudinary.uploader.upload,
+            io.BytesIO(data),
+            folder=self.folder,
+            public_id=public_id,
+            overwrite=False,
+            resource_type="image"
+        )
+        return result.get("secure_url") or result.get("url")
+
+class ImmutableStaticFiles(StaticFiles):
+    """Static files whose names change with their content, so responses may be cached forever."""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = AVATAR_CACHE_CONTROL
+        return response
+
+class AvatarProcessor:
+    """Runs :func:`render_thumbnails` on a bounded thread pool and stores the results."""
+
+    def __init__(self, workers: int = AVATAR_WORKERS, sizes: Tuple[int, ...] = AVATAR_SIZES):
+        self.workers = workers
+        self.sizes = sizes
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def process(self, data: bytes, storage: AvatarStorage) -> Dict[int, str]:
+        """Return the URL of each stored thumbnail, keyed by size."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="avatar")
+        loop = asyncio.get_running_loop()
+        thumbnails = await loop.run_in_executor(self._executor, render_thumbnails, data, self.sizes)
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        urls = await asyncio.gather(*(
+            storage.save(f"{digest}_{size}.webp", thumbnail, "image/webp")
+            for size, thumbnail in thumbnails.items()
+        ))
+        return dict(zip(thumbnails, urls))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+avatar_processor = AvatarProcessor()
+avatar_storage: AvatarStorage = LocalAvatarStorage() if AVATAR_STORAGE == "local" else CloudinaryAvatarStorage()
+
+def get_avatar_storage() -> AvatarStorage:
+    return avatar_storage
@@ -0,0 +1,134 @@
+"""
+Redis cache for rendered contact list responses.
+
+Entries hold the final JSON bytes of a response, keyed by user, the user's
+contact list version (``users.contacts_version``) and a variant string
+describing the query. The cache also keeps a copy of each user's list version
+and its ``Last-Modified`` time, so a hit, and a 304, costs no database read.
+
+Writers store the versions they committed (:meth:`ContactListCache.set_versions`),
+which retires the older entries; they simply expire, so no key scanning is needed.
+The stored version only ever moves forward, so a reader that loaded an older one
+from the database cannot roll it back. The copy expires after ``version_ttl``
+(much shorter than entries), which bounds how long responses can lag a write
+that could not reach Redis, at one database read per user per ``version_ttl``.
+"""
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from services.metrics import registry
+from services.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+CONTACT_CACHE_TTL = 300
+CONTACT_VERSION_TTL = 30
+
+# Store ARGV[1]:ARGV[2] unless the key already holds a version at least ARGV[1].
+SET_VERSION_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current and tonumber(string.match(current, '^%d+')) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1] .. ':' .. ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+class ContactListCache:
+    """Per-user cache of serialized contact list responses, keyed by contact list version."""
+
+    def __init__(self, client: redis.Redis, ttl: int = CONTACT_CACHE_TTL, version_ttl: int = CONTACT_VERSION_TTL):
+        self.client = client
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._set_version = client.register_script(SET_VERSION_SCRIPT)
+
+    @staticmethod
+    def _version_key(user_id: int) -> str:
+        return f"contacts:ver:{user_id}"
+
+    @staticmethod
+    def _entry_key(user_id: int, version: int, variant: str) -> str:
+        digest = hashlib.sha1(variant.encode()).hexdigest()
+        return f"contacts:list:{user_id}:{version}:{digest}"
+
+    async def get_version(self, user_id: int) -> Optional[Tuple[int, Optional[datetime]]]:
+        """Return the stored ``(list version, updated_at)`` of the user, or ``None`` if unknown or Redis is unavailable."""
+        try:
+            value = await self.client.get(self._version_key(user_id))
+        except RedisError:
+            logger.warning("Contact cache version read failed", exc_info=True)
+            self.errors += 1
+            return None
+        if value is None:
+            return None
+        version, _, updated_at = value.decode().partition(":")
+        return int(version), datetime.fromisoformat(updated_at) if updated_at else None
+
+    async def set_versions(self, versions: Dict[int, Tuple[int, Optional[datetime]]]):
+        """Store ``(list version, updated_at)`` per user in one pipelined round trip, unless Redis holds a newer one."""
+        if not versions:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for user_id, (version, updated_at) in versions.items():
+                await self._set_version(
+                    keys=[self._version_key(user_id)],
+                    args=[version, updated_at.isoformat() if updated_at else "", self.version_ttl],
+                    client=pipe
+                )
+            await pipe.execute()
+        except RedisError:
+            logger.warning("Contact cache version update failed", exc_info=True)
+            self.errors += 1
+
+    async def get(self, user_id: int, version: int, variant: str) -> Optional[bytes]:
+        """Return the cached response rendered at list ``version``, or ``None`` on a miss."""
+        try:
+            payload = await self.client.get(self._entry_key(user_id, version, variant))
+        except RedisError:
+            logger.warning("Contact cache read failed", exc_info=True)
+            self.errors += 1
+            payload = None
+        if payload is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return payload
+
+    async def set(self, user_id: int, version: int, variant: str, payload: bytes):
+        try:
+            await self.client.set(self._entry_key(user_id, version, variant), payload, ex=self.ttl)
+        except RedisError:
+            logger.warning("Contact cache write failed", exc_info=True)
+            self.errors += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
+contact_cache = ContactListCache(redis_client)
+
+registry.callback(
+    "contact_cache_lookups_total",
+    "Contact list cache lookups by result; errors are also counted as misses.",
+    lambda: [(("hit",), contact_cache.hits), (("miss",), contact_cache.misses), (("error",), contact_cache.errors)],
+    ["result"],
+    type="counter"
+)
+
+def get_contact_cache() -> ContactListCache:
+    return contact_cache
@@ -0,0 +1,86 @@
+"""
+HTTP conditional requests: ``ETag``/``Last-Modified`` validators and the
+``If-None-Match``, ``If-Modified-Since`` and ``If-Match`` preconditions.
+
+Validators come from version counters kept in the database (a version per
+contact and a contact list version per user), so a request can be answered
+with 304 or 412 after reading one small row instead of the data itself.
+"""
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, List, Optional, Set
+
+from fastapi import HTTPException, Request, Response, status
+
+CACHE_CONTROL = "private, no-cache"
+
+class PreconditionFailedError(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="The contact was changed since it was read; fetch it again and retry"
+        )
+
+def contact_etag(version: int) -> str:
+    return f'"v{version}"'
+
+def list_etag(version: int, variant_digest: str) -> str:
+    return f'"{version}-{variant_digest}"'
+
+def http_date(value: datetime) -> str:
+    """Format a naive UTC ``datetime`` as an HTTP date."""
+    return format_datetime(value.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+def validator_headers(etag: str, last_modified: Optional[datetime] = None) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+def parse_etags(header: str) -> List[str]:
+    """Split an ``If-Match``/``If-None-Match`` value into entity tags (``"*"`` stays as is)."""
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+def has_conditions(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """
+    Evaluate ``If-None-Match`` (weak comparison) or, when it is absent,
+    ``If-Modified-Since`` against the current validators of a GET.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.removeprefix("W/") for tag in parse_etags(if_none_match)}
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+
+def not_modified(etag: str, last_modified: Optional[datetime] = None) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validator_headers(etag, last_modified))
+
+def if_match_versions(request: Request) -> Optional[Set[int]]:
+    """
+    Return the contact versions an ``If-Match`` header accepts, or ``None`` when
+    any version will do (no header, or ``*``).
+
+    Weak tags never match (strong comparison), so they yield an empty set.
+    """
+    header = request.headers.get("if-match")
+    if header is None:
+        return None
+    versions = set()
+    for tag in parse_etags(header):
+        if tag == "*":
+            return None
+        if tag.startswith('"v') and tag.endswith('"') and tag[2:-1].isdigit():
+            versions.add(int(tag[2:-1]))
+    return versions
@@ -0,0 +1,251 @@
+"""
+Server-sent contact events.
+
+Writers publish one message per change on a single Redis pub/sub channel.
+Each worker holds exactly one subscription to it (:meth:`ContactEventHub.run`)
+and fans every message out to the local streams of the users it names, so
+Redis sees one subscriber per worker however many clients are connected.
+
+An idle stream costs a few kilobytes, mostly the task serving it
+(``benchmarks/bench_sse.py`` measures it): the SSE frame of a message is
+encoded once and shared by all recipients, heartbeats come from one timer per
+worker rather than one per connection, and each stream buffers at most
+``SSE_BUFFER_SIZE`` frames. A client that falls further behind is sent a
+``resync`` event and disconnected instead of buffering without bound; it
+catches up with ``/contacts/changes`` and reconnects.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict, deque
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import redis.asyncio as redis
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+
+from services.metrics import registry
+from services.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+CONTACT_EVENTS_CHANNEL = "contacts:events"
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", 15))
+SSE_BUFFER_SIZE = int(os.getenv("SSE_BUFFER_SIZE", 64))
+SSE_MAX_CONNECTIONS = int(os.getenv("SSE_MAX_CONNECTIONS", 20_000))
+SSE_RETRY_MS = 5000
+
+HEARTBEAT_FRAME = b": ping\n\n"
+RESYNC_FRAME = b'event: resync\ndata: {"reason": "slow consumer"}\n\n'
+
+class StreamLimitError(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many event streams on this server, try again later",
+            headers={"Retry-After": str(int(SSE_HEARTBEAT_INTERVAL))}
+        )
+
+def encode_frame(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+class Subscriber:
+    """One open stream: a bounded buffer of encoded frames and an event to wake its writer."""
+    __slots__ = ("user_id", "frames", "wakeup", "overflowed", "max_frames")
+
+    def __init__(self, user_id: int, max_frames: int = SSE_BUFFER_SIZE):
+        self.user_id = user_id
+        self.frames = deque()
+        self.wakeup = asyncio.Event()
+        self.overflowed = False
+        self.max_frames = max_frames
+
+    def push(self, frame: bytes) -> bool:
+        """Buffer ``frame``; returns ``False`` (and marks the stream for resync) when the buffer is full."""
+        if self.overflowed:
+            return False
+        if len(self.frames) >= self.max_frames:
+            self.overflowed = True
+            self.frames.clear()
+            self.wakeup.set()
+            return False
+        self.frames.append(frame)
+        self.wakeup.set()
+        return True
+
+    async def next_frame(self) -> Optional[bytes]:
+        """Wait for the next frame; ``None`` once the stream has overflowed."""
+        while not self.frames:
+            if self.overflowed:
+                return None
+            self.wakeup.clear()
+            await self.wakeup.wait()
+        return self.frames.popleft()
+
+class ContactEventHub:
+    """This worker's end of the contact event channel: publishing and local fan-out."""
+
+    def __init__(
+            self,
+            client: redis.Redis,
+            heartbeat_interval: float = SSE_HEARTBEAT_INTERVAL,
+            buffer_size: int = SSE_BUFFER_SIZE,
+            max_connections: int = SSE_MAX_CONNECTIONS
+    ):
+        self.client = client
+        self.heartbeat_interval = heartbeat_interval
+        self.buffer_size = buffer_size
+        self.max_connections = max_connections
+        self.subscribers: Dict[int, Set[Subscriber]] = defaultdict(set)
+        self.connections = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.publish_errors = 0
+
+    def admit(self):
+        """Raise :class:`StreamLimitError` if this worker cannot take another stream."""
+        if self.connections >= self.max_connections:
+            raise StreamLimitError()
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        subscriber = Subscriber(user_id, self.buffer_size)
+        self.subscribers[user_id].add(subscriber)
+        self.connections += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        streams = self.subscribers.get(subscriber.user_id)
+        if streams is None or subscriber not in streams:
+            return
+        streams.discard(subscriber)
+        if not streams:
+            del self.subscribers[subscriber.user_id]
+        self.connections -= 1
+
+    async def publish(self, user_ids: Iterable[int], event: str, data: dict):
+        """
+        Send ``event`` to the streams of ``user_ids`` on every worker.
+
+        Without Redis the event still reaches this worker's streams.
+        """
+        user_ids = sorted(set(user_ids))
+        if not user_ids:
+            return
+        message = {"users": user_ids, "event": event, "data": data}
+        try:
+            await self.client.publish(CONTACT_EVENTS_CHANNEL, json.dumps(message, separators=(",", ":")))
+        except RedisError:
+            logger.warning("Contact event publish failed, delivering locally only", exc_info=True)
+            self.publish_errors += 1
+            self.dispatch(message)
+
+    async def publish_many(self, events: Iterable[Tuple[Iterable[int], str, dict]]):
+        """Like :meth:`publish` for several ``(user_ids, event, data)`` events, in one pipelined round trip."""
+        messages = []
+        for user_ids, event, data in events:
+            user_ids = sorted(set(user_ids))
+            if user_ids:
+                messages.append({"users": user_ids, "event": event, "data": data})
+        if not messages:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for message in messages:
+                pipe.publish(CONTACT_EVENTS_CHANNEL, json.dumps(message, separators=(",", ":")))
+            await pipe.execute()
+        except RedisError:
+            logger.warning("Contact event publish failed, delivering locally only", exc_info=True)
+            self.publish_errors += 1
+            for message in messages:
+                self.dispatch(message)
+
+    def dispatch(self, message: dict):
+        """Hand one published message to the local streams of the users it names."""
+        frame = None
+        for user_id in message["users"]:
+            for subscriber in tuple(self.subscribers.get(user_id, ())):
+                if frame is None:
+                    frame = encode_frame(message["event"], message["data"])
+                if subscriber.push(frame):
+                    self.delivered += 1
+                else:
+                    self.dropped += 1
+                    self.unsubscribe(subscriber)
+
+    def heartbeat(self):
+        for streams in self.subscribers.values():
+            for subscriber in streams:
+                if not subscriber.frames:
+                    subscriber.push(HEARTBEAT_FRAME)
+
+    async def run_heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            self.heartbeat()
+
+    async def run(self):
+        """Hold this worker's subscription and dispatch messages; runs for the lifetime of the worker."""
+        heartbeat = asyncio.create_task(self.run_heartbeat())
+        try:
+            while True:
+                pubsub = self.client.pubsub()
+                try:
+                    await pubsub.subscribe(CONTACT_EVENTS_CHANNEL)
+                    while True:
+                        # Poll with a timeout: a blocking read would trip the pool's short socket timeout.
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                        if message is None:
+                            continue
+                        try:
+                            self.dispatch(json.loads(message["data"]))
+                        except (ValueError, KeyError, TypeError):
+                            logger.warning("Ignoring malformed contact event %r", message["data"])
+                except RedisError:
+                    logger.warning("Contact event listener lost Redis, retrying", exc_info=True)
+                    await asyncio.sleep(1)
+                finally:
+                    await pubsub.aclose()
+        finally:
+            heartbeat.cancel()
+
+    async def stream(self, user_id: int):
+        """
+        Yield the SSE byte stream of ``user_id`` until the client leaves or falls behind.
+
+        The subscription is made on the first iteration, so a response that is never
+        sent leaves nothing behind.
+        """
+        subscriber = self.subscribe(user_id)
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n".encode()
+            while True:
+                frame = await subscriber.next_frame()
+                if frame is None:
+                    yield RESYNC_FRAME
+                    return
+                yield frame
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "publish_errors": self.publish_errors
+        }
+
+contact_events = ContactEventHub(redis_client)
+
+registry.callback("sse_connections", "Open contact event streams.", lambda: [((), contact_events.connections)])
+registry.callback(
+    "sse_events_total",
+    "Contact events by outcome: delivered to a stream, or dropped when its buffer was full.",
+    lambda: [(("delivered",), contact_events.delivered), (("dropped",), contact_events.dropped)],
+    ["result"],
+    type="counter"
+)
+
+def get_contact_events() -> ContactEventHub:
+    return contact_events
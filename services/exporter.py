@@ -0,0 +1,47 @@
+"""
+Streaming contact export as CSV or NDJSON, optionally gzip-compressed on the fly.
+"""
+import csv
+import io
+import json
+import zlib
+from typing import AsyncIterator, Sequence
+
+from repository.contacts import EXPORT_COLUMNS, stream_user_contacts
+
+EXPORT_FIELDS = [column.key for column in EXPORT_COLUMNS]
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+def _format_csv(rows: Sequence[tuple]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue()
+
+def _format_ndjson(rows: Sequence[tuple]) -> str:
+    return "".join(
+        json.dumps(dict(zip(EXPORT_FIELDS, row)), default=lambda value: value.isoformat()) + "\n"
+        for row in rows
+    )
+
+async def export_contacts(session_factory, user_id: int, format: str, compress: bool = False) -> AsyncIterator[bytes]:
+    """
+    Yield the encoded export of ``user_id``'s contacts one cursor batch at a time.
+
+    The session is opened here rather than taken from the request so that it stays
+    alive for the whole response.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(text: str) -> bytes:
+        data = text.encode()
+        return compressor.compress(data) if compressor else data
+
+    if format == "csv":
+        yield encode(_format_csv([EXPORT_FIELDS]))
+    async with session_factory() as db:
+        async for rows in stream_user_contacts(db, user_id):
+            chunk = encode(_format_csv(rows) if format == "csv" else _format_ndjson(rows))
+            if chunk:
+                yield chunk
+    if compressor:
+        yield compressor.flush()
@@ -0,0 +1,125 @@
+"""
+Password hashing off the event loop.
+
+bcrypt is deliberately slow (100-300 ms per call), so hashing and verification
+run on a dedicated thread pool; the ``bcrypt`` extension releases the GIL while
+it works. Admission is bounded: once the global queue or an endpoint's share of
+it is full, callers fail fast with 503 instead of piling up behind the pool.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from services.metrics import registry
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", os.cpu_count() or 1))
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", 64))
+HASH_ENDPOINT_LIMITS = {
+    "login": 48,
+    "signup": 8,
+    "reset_password": 4,
+}
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+class HashingBusyError(HTTPException):
+    """The hashing queue is full; the client should retry after ``retry_after`` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many password operations in progress, try again later",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+class PasswordHasher:
+    """Runs ``pwd_context`` operations on a bounded thread pool with per-endpoint admission limits."""
+
+    def __init__(
+            self,
+            context: CryptContext = pwd_context,
+            workers: int = HASH_WORKERS,
+            queue_size: int = HASH_QUEUE_SIZE,
+            endpoint_limits: Optional[Dict[str, int]] = None
+    ):
+        self.context = context
+        self.workers = workers
+        self.queue_size = queue_size
+        self.endpoint_limits = HASH_ENDPOINT_LIMITS if endpoint_limits is None else endpoint_limits
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = 0
+        self._per_endpoint: Dict[str, int] = defaultdict(int)
+        self.calls = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        # calls and total_seconds are updated from the pool's threads.
+        self._stats_lock = threading.Lock()
+
+    def _retry_after(self) -> int:
+        average = self.total_seconds / self.calls if self.calls else 0.25
+        return max(1, math.ceil(self._in_flight / self.workers * average))
+
+    def _timed(self, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                self.total_seconds += elapsed
+                self.calls += 1
+
+    async def _submit(self, endpoint: str, func, *args):
+        limit = self.endpoint_limits.get(endpoint, self.queue_size)
+        if self._in_flight >= self.queue_size or self._per_endpoint[endpoint] >= limit:
+            self.rejected += 1
+            raise HashingBusyError(self._retry_after())
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._in_flight += 1
+        self._per_endpoint[endpoint] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._timed, func, *args)
+        finally:
+            self._in_flight -= 1
+            self._per_endpoint[endpoint] -= 1
+
+    async def hash(self, endpoint: str, password: str) -> str:
+        return await self._submit(endpoint, self.context.hash, password)
+
+    async def verify(self, endpoint: str, password: str, hashed_password: str) -> bool:
+        return await self._submit(endpoint, self.context.verify, password, hashed_password)
+
+    async def verify_and_update(self, endpoint: str, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verify ``password``; on success also return a new hash when the stored one
+        uses a different cost than the configured ``BCRYPT_ROUNDS`` (else ``None``).
+        """
+        return await self._submit(endpoint, self.context.verify_and_update, password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+password_hasher = PasswordHasher()
+
+registry.callback("bcrypt_operations_total", "Completed password hash and verify calls.",
+                  lambda: [((), password_hasher.calls)], type="counter")
+registry.callback("bcrypt_seconds_total", "Thread time spent in bcrypt.",
+                  lambda: [((), password_hasher.total_seconds)], type="counter")
+registry.callback("bcrypt_rejected_total", "Password operations refused because the queue was full.",
+                  lambda: [((), password_hasher.rejected)], type="counter")
+registry.callback("bcrypt_in_flight", "Password operations queued or running.",
+                  lambda: [((), password_hasher._in_flight)])
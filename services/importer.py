@@ -0,0 +1,156 @@
+"""
+Streaming contact import from CSV or NDJSON request bodies.
+
+The body is decoded incrementally and validated against ``ContactCreate`` in
+fixed-size batches, so memory use depends on the batch size rather than on the
+size of the upload.
+"""
+import codecs
+import csv
+import json
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from repository.contacts import bulk_link_contacts
+from schemas.contacts import ContactCreate
+
+IMPORT_BATCH_SIZE = 500
+MAX_LINE_LENGTH = 64 * 1024
+MAX_REPORTED_ERRORS = 1000
+
+Row = Tuple[int, Optional[dict], Optional[str]]
+
+class ImportFormatError(ValueError):
+    """Raised when the body cannot be decoded or split into records."""
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Yield decoded lines from a stream of byte chunks without buffering the whole body."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    try:
+        async for chunk in chunks:
+            buffer += decoder.decode(chunk)
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                yield line.rstrip("\r")
+            if len(buffer) > MAX_LINE_LENGTH:
+                raise ImportFormatError("Line too long")
+        buffer += decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        raise ImportFormatError("Body is not valid UTF-8")
+    if buffer:
+        yield buffer.rstrip("\r")
+
+async def iter_csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[Row]:
+    """Yield ``(row_number, data, error)`` for every CSV record after the header row."""
+    header = None
+    record = None
+    row_number = 0
+    async for line in lines:
+        record = line if record is None else f"{record}\n{line}"
+        if record.count('"') % 2:
+            # A quoted field continues on the next line.
+            if len(record) > MAX_LINE_LENGTH:
+                raise ImportFormatError("Record too long")
+            continue
+        fields = next(csv.reader([record]), [])
+        record = None
+        if not any(fields):
+            continue
+        if header is None:
+            header = [name.strip() for name in fields]
+            continue
+        row_number += 1
+        if len(fields) != len(header):
+            yield row_number, None, f"Expected {len(header)} fields, got {len(fields)}"
+            continue
+        yield row_number, dict(zip(header, fields)), None
+    if record is not None:
+        row_number += 1
+        yield row_number, None, "Unterminated quoted field"
+
+async def iter_ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[Row]:
+    """Yield ``(row_number, data, error)`` for every non-blank NDJSON line."""
+    row_number = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield row_number, None, "Invalid JSON"
+            continue
+        if not isinstance(data, dict):
+            yield row_number, None, "Expected a JSON object"
+            continue
+        yield row_number, data, None
+
+def _clean(data: dict) -> dict:
+    cleaned = {field: None for field in ContactCreate.model_fields}
+    for key, value in data.items():
+        if isinstance(value, str):
+            value = value.strip() or None
+        cleaned[key] = value
+    return cleaned
+
+class ImportReport:
+    """Accumulates import counters and a capped list of per-row errors."""
+
+    def __init__(self):
+        self.processed = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[Dict] = []
+
+    def add_error(self, row: int, messages: List[str]):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "errors": messages})
+
+    def as_dict(self) -> dict:
+        return {
+            "processed": self.processed,
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors)
+        }
+
+async def import_contacts(
+        db: AsyncSession,
+        user_id: int,
+        rows: AsyncIterator[Row],
+        batch_size: int = IMPORT_BATCH_SIZE
+) -> ImportReport:
+    """Validate ``rows`` and write them to ``user_id``'s contacts batch by batch."""
+    report = ImportReport()
+    batch: Dict[str, ContactCreate] = {}
+
+    async def flush():
+        report.imported += await bulk_link_contacts(db, user_id, list(batch.values()))
+        batch.clear()
+
+    async for row_number, data, error in rows:
+        report.processed += 1
+        if error:
+            report.add_error(row_number, [error])
+            continue
+        try:
+            contact = ContactCreate.model_validate(_clean(data))
+        except ValidationError as exc:
+            report.add_error(row_number, [
+                f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in exc.errors()
+            ])
+            continue
+        if contact.email in batch:
+            report.add_error(row_number, [f"email: duplicate of an earlier row ({contact.email})"])
+            continue
+        batch[contact.email] = contact
+        if len(batch) >= batch_size:
+            await flush()
+
+    await flush()
+    return report
@@ -0,0 +1,262 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Recording is a dict lookup and a few additions, with no locks (everything runs
+on one event loop, and the pool/bcrypt threads only touch counters read at
+scrape time), so it can stay on at full traffic. Values that other components
+already count (cache hits, bcrypt time, breaker state) are read by callbacks
+when ``/metrics`` is scraped instead of being recorded twice.
+
+Per request, :class:`MetricsMiddleware` records latency and status by route
+template, and the SQLAlchemy hooks installed by :func:`instrument_engine` add
+up statement count and database time in :data:`request_stats`.
+"""
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+from services.query_recorder import (
+    QUERY_LOG_ENABLED, QUERY_LOG_MAX_SECONDS, QUERY_LOG_MAX_STATEMENTS, QueryRecorder, query_recorder
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return lines
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: [count per bucket (+Inf last), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def count(self, *labels: str) -> int:
+        state = self._values.get(labels)
+        return sum(state[0]) if state else 0
+
+    def samples(self):
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, labels, le), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, labels), total
+            yield f"{self.name}_count", _format_labels(self.labelnames, labels), cumulative
+
+class CallbackMetric(Metric):
+    """Gauge or counter whose samples are produced by ``callback`` at scrape time."""
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            callback: Callable[[], Iterable[Tuple[Sequence[str], float]]],
+            labelnames: Sequence[str] = (),
+            type: str = "gauge"
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.type = type
+
+    def samples(self):
+        for labels, value in self.callback():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, callback, labelnames: Sequence[str] = (), type: str = "gauge"):
+        return self.register(CallbackMetric(name, documentation, callback, labelnames, type))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter("http_requests_total", "HTTP requests by route template and status.", ["method", "route", "status"])
+HTTP_LATENCY = registry.histogram("http_request_duration_seconds", "HTTP request latency.", ["method", "route"])
+REQUEST_DB_QUERIES = registry.histogram(
+    "http_request_db_queries", "SQL statements issued per HTTP request.", ["route"], buckets=DB_QUERY_BUCKETS
+)
+REQUEST_DB_SECONDS = registry.histogram("http_request_db_seconds", "Database time per HTTP request.", ["route"])
+DB_QUERIES = registry.counter("db_queries_total", "SQL statements executed.")
+DB_SECONDS = registry.counter("db_query_seconds_total", "Time spent executing SQL statements.")
+DB_POOL_WAIT = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Time checkouts spent waiting in the pool queue, excluding opening new connections.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+DB_POOL_CONNECT = registry.histogram(
+    "db_pool_connect_seconds", "Time spent opening new database connections for pool checkouts.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+PRINCIPAL_LOOKUPS = registry.counter(
+    "principal_cache_lookups_total", "get_current_user lookups by the tier that answered.", ["tier"]
+)
+
+class RequestStats:
+    """What one request spent in the database."""
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    DB_QUERIES.inc()
+    DB_SECONDS.inc(amount=elapsed)
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+    recorder = query_recorder.get()
+    if recorder is not None:
+        recorder.add(statement, elapsed)
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+def instrument_engine(sync_engine):
+    """Count statements and database time of ``sync_engine`` (``AsyncEngine.sync_engine`` for async engines)."""
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency, status and database usage per route template.
+
+    With query logging enabled (see :mod:`services.query_recorder`) it also records
+    each request's statements and logs requests over the configured budget.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        recorder = recorder_token = None
+        if QUERY_LOG_ENABLED and query_recorder.get() is None:
+            recorder = QueryRecorder()
+            recorder_token = query_recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_stats.reset(token)
+            route = scope.get("route")
+            path = route.path if route is not None else "<unmatched>"
+            method = scope["method"]
+            if recorder is not None:
+                query_recorder.reset(recorder_token)
+                if recorder.exceeds(QUERY_LOG_MAX_STATEMENTS, QUERY_LOG_MAX_SECONDS):
+                    logger.warning("%s %s is over its query budget: %s", method, path, recorder.report())
+            HTTP_REQUESTS.inc(method, path, str(status))
+            HTTP_LATENCY.observe(elapsed, method, path)
+            if stats.queries:
+                REQUEST_DB_QUERIES.observe(stats.queries, path)
+                REQUEST_DB_SECONDS.observe(stats.db_seconds, path)
@@ -0,0 +1,231 @@
+"""
+Transactional email outbox.
+
+Request handlers only insert an ``EmailOutbox`` row, in the same transaction as
+the change that triggered the email, and return. A background worker claims
+due rows in batches, sends them over one reused SMTP connection with no
+transaction open, and retries failures with exponential backoff.
+"""
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from email.message import EmailMessage
+from typing import Optional
+
+import aiosmtplib
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_session_factory
+from models import EmailOutbox, utcnow
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_POLL_INTERVAL = 5.0
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_BACKOFF_BASE = 30
+OUTBOX_BACKOFF_MAX = 3600
+OUTBOX_LEASE = 600
+
+def enqueue_email(db: AsyncSession, recipient: str, subject: str, body: str, subtype: str = "plain") -> EmailOutbox:
+    """Stage an email for delivery; it is sent once the caller commits ``db``."""
+    message = EmailOutbox(recipient=recipient, subject=subject, body=body, subtype=subtype)
+    db.add(message)
+    return message
+
+class SMTPMailer:
+    """Sends messages over a single long-lived SMTP connection, reconnecting when it drops."""
+
+    def __init__(
+            self,
+            hostname: str,
+            port: int,
+            sender: str,
+            username: Optional[str] = None,
+            password: Optional[str] = None,
+            start_tls: bool = False,
+            use_tls: bool = False,
+            timeout: float = 10.0
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.start_tls = start_tls
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.connections_opened = 0
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def from_env(cls) -> "SMTPMailer":
+        return cls(
+            hostname=os.getenv("MAIL_SERVER", "localhost"),
+            port=int(os.getenv("MAIL_PORT", 1025)),
+            sender=os.getenv("MAIL_FROM", "noreply@localhost"),
+            username=os.getenv("MAIL_USERNAME") if os.getenv("USE_CREDENTIALS") == "True" else None,
+            password=os.getenv("MAIL_PASSWORD"),
+            start_tls=os.getenv("MAIL_STARTTLS") == "True",
+            use_tls=os.getenv("MAIL_SSL_TLS") == "True"
+        )
+
+    async def _connect(self):
+        await self.close()
+        smtp = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            use_tls=self.use_tls,
+            start_tls=self.start_tls,
+            timeout=self.timeout
+        )
+        await smtp.connect()
+        if self.username:
+            await smtp.login(self.username, self.password)
+        self._smtp = smtp
+        self.connections_opened += 1
+
+    async def send(self, recipient: str, subject: str, body: str, subtype: str = "plain"):
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = recipient
+        message["Subject"] = subject
+        message.set_content(body, subtype=subtype)
+
+        async with self._lock:
+            if self._smtp is None or not self._smtp.is_connected:
+                await self._connect()
+            try:
+                await self._smtp.send_message(message)
+            except aiosmtplib.SMTPServerDisconnected:
+                await self._connect()
+                await self._smtp.send_message(message)
+
+    async def close(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None and smtp.is_connected:
+            try:
+                await smtp.quit()
+            except aiosmtplib.SMTPException:
+                smtp.close()
+
+class OutboxWorker:
+    """
+    Drains pending outbox rows; run one per application worker via :meth:`run`.
+
+    Without explicit arguments the application session factory and an
+    :class:`SMTPMailer` configured from the environment are created on first use.
+    """
+
+    def __init__(
+            self,
+            session_factory=None,
+            mailer: Optional[SMTPMailer] = None,
+            batch_size: int = OUTBOX_BATCH_SIZE,
+            poll_interval: float = OUTBOX_POLL_INTERVAL,
+            max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+            backoff_base: float = OUTBOX_BACKOFF_BASE
+    ):
+        self.session_factory = session_factory
+        self.mailer = mailer
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self._wakeup = asyncio.Event()
+
+    def wake(self):
+        """Start the next drain now instead of at the next poll; call after committing new rows."""
+        self._wakeup.set()
+
+    def _backoff(self, attempts: int) -> timedelta:
+        return timedelta(seconds=min(self.backoff_base * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX))
+
+    async def _claim(self):
+        """
+        Lease a batch of due messages by pushing their ``next_attempt_at`` past
+        ``OUTBOX_LEASE`` and commit, so no transaction or row lock is held while sending.
+        A message whose worker dies mid-send becomes due again when its lease runs out.
+        """
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(EmailOutbox)
+                .where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= utcnow())
+                .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            messages = result.scalars().all()
+            claimed = [
+                (message.id, message.attempts, message.recipient, message.subject, message.body, message.subtype)
+                for message in messages
+            ]
+            leased_until = utcnow() + timedelta(seconds=OUTBOX_LEASE)
+            for message in messages:
+                message.next_attempt_at = leased_until
+            await db.commit()
+        return claimed
+
+    async def _record(self, message_ids, **values):
+        async with self.session_factory() as db:
+            await db.execute(update(EmailOutbox).where(EmailOutbox.id.in_(message_ids)).values(**values))
+            await db.commit()
+
+    async def drain_once(self) -> int:
+        """
+        Send one batch of due messages and return how many were attempted.
+
+        Each result is written on its own as soon as it is known. After a
+        connection-level failure the rest of the batch is put back with the same
+        delay, without counting an attempt, rather than each waiting out the timeout.
+        """
+        if self.session_factory is None:
+            self.session_factory = get_session_factory()
+        if self.mailer is None:
+            self.mailer = SMTPMailer.from_env()
+        claimed = await self._claim()
+        for index, (message_id, attempts, recipient, subject, body, subtype) in enumerate(claimed):
+            attempts += 1
+            try:
+                await self.mailer.send(recipient, subject, body, subtype)
+            except (aiosmtplib.SMTPException, OSError) as exc:
+                error = str(exc)[:500]
+                if attempts >= self.max_attempts:
+                    logger.error("Giving up on outbox message %s: %s", message_id, exc)
+                    await self._record([message_id], attempts=attempts, last_error=error, status="failed")
+                else:
+                    retry_at = utcnow() + self._backoff(attempts)
+                    await self._record([message_id], attempts=attempts, last_error=error, next_attempt_at=retry_at)
+                if isinstance(exc, OSError):
+                    # The server is unreachable (aiosmtplib's connect and disconnect errors are OSErrors too).
+                    rest = [message[0] for message in claimed[index + 1:]]
+                    if rest:
+                        await self._record(rest, next_attempt_at=utcnow() + self._backoff(1))
+                    return index + 1
+            else:
+                await self._record([message_id], attempts=attempts, status="sent", sent_at=utcnow())
+        return len(claimed)
+
+    async def run(self):
+        try:
+            while True:
+                try:
+                    attempted = await self.drain_once()
+                except Exception:
+                    logger.exception("Outbox drain failed")
+                    attempted = 0
+                if attempted >= self.batch_size:
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+        finally:
+            if self.mailer is not None:
+                await self.mailer.close()
+
+outbox_worker = OutboxWorker()
@@ -0,0 +1,108 @@
+"""
+Request-scoped SQL statement recording and query budgets.
+
+While a :class:`QueryRecorder` is active in the current context, the engine
+hooks from :func:`services.metrics.instrument_engine` append every statement
+with its duration. Statements whose SQL text repeats are reported as
+duplicates, the usual symptom of an N+1 loop.
+
+Tests wrap requests in :func:`query_budget`; in production, setting
+``QUERY_LOG_MAX_STATEMENTS`` or ``QUERY_LOG_MAX_SECONDS`` makes the metrics
+middleware record each request and log the ones over budget together with
+their statements.
+"""
+import functools
+import os
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+QUERY_LOG_MAX_STATEMENTS = int(os.getenv("QUERY_LOG_MAX_STATEMENTS", 0))
+QUERY_LOG_MAX_SECONDS = float(os.getenv("QUERY_LOG_MAX_SECONDS", 0))
+QUERY_LOG_ENABLED = bool(QUERY_LOG_MAX_STATEMENTS or QUERY_LOG_MAX_SECONDS)
+
+class QueryRecorder:
+    """Statements executed while this recorder was active, with their durations."""
+    __slots__ = ("statements", "db_seconds")
+
+    def __init__(self):
+        self.statements: List[Tuple[str, float]] = []
+        self.db_seconds = 0.0
+
+    def add(self, statement: str, elapsed: float):
+        self.statements.append((statement, elapsed))
+        self.db_seconds += elapsed
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def duplicates(self) -> Dict[str, int]:
+        """Map SQL text executed more than once to its number of executions."""
+        counts = Counter(statement for statement, _ in self.statements)
+        return {statement: count for statement, count in counts.items() if count > 1}
+
+    def exceeds(self, max_statements: int = 0, max_seconds: float = 0) -> bool:
+        return bool(max_statements and self.count > max_statements or max_seconds and self.db_seconds > max_seconds)
+
+    def report(self, limit: int = 50) -> str:
+        lines = [f"{self.count} statements, {self.db_seconds * 1000:.1f} ms"]
+        for statement, count in self.duplicates().items():
+            lines.append(f"  duplicated x{count}: {' '.join(statement.split())}")
+        for index, (statement, elapsed) in enumerate(self.statements[:limit], 1):
+            lines.append(f"  {index:3d}. {elapsed * 1000:7.2f} ms  {' '.join(statement.split())}")
+        if self.count > limit:
+            lines.append(f"  ... {self.count - limit} more")
+        return "\n".join(lines)
+
+query_recorder: ContextVar[Optional[QueryRecorder]] = ContextVar("query_recorder", default=None)
+
+@contextmanager
+def record_queries():
+    """Record the statements executed in this context for the duration of the block."""
+    recorder = QueryRecorder()
+    token = query_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        query_recorder.reset(token)
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+class query_budget:
+    """
+    Fail when the wrapped code issues more than ``max_statements`` statements, or
+    repeats one, unless ``allow_duplicates``.
+
+    Use as ``with query_budget(2): ...`` or decorate an async test with ``@query_budget(2)``.
+    """
+
+    def __init__(self, max_statements: int, allow_duplicates: bool = False):
+        self.max_statements = max_statements
+        self.allow_duplicates = allow_duplicates
+        self.recorder: Optional[QueryRecorder] = None
+        self._context = None
+
+    def __enter__(self) -> QueryRecorder:
+        self._context = record_queries()
+        self.recorder = self._context.__enter__()
+        return self.recorder
+
+    def __exit__(self, exc_type, exc, tb):
+        self._context.__exit__(exc_type, exc, tb)
+        if exc_type is not None:
+            return False
+        if self.recorder.count > self.max_statements:
+            raise QueryBudgetExceeded(f"Query budget of {self.max_statements} exceeded: {self.recorder.report()}")
+        if not self.allow_duplicates and self.recorder.duplicates():
+            raise QueryBudgetExceeded(f"Duplicate statements (possible N+1): {self.recorder.report()}")
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with query_budget(self.max_statements, self.allow_duplicates):
+                return await func(*args, **kwargs)
+        return wrapper
@@ -0,0 +1,243 @@
+"""
+Rate limiting.
+
+Two strategies share one interface:
+
+* ``hit`` (default) keeps a token bucket per key in each worker and only talks
+  to Redis in batches: local consumption is pushed with ``INCRBY`` every
+  ``sync_every`` hits or ``sync_interval`` seconds, and the returned global
+  count caps the local bucket. Limits are therefore approximate across workers,
+  overshooting by at most ``sync_every`` per worker, but most requests cost no
+  network round trip at all.
+* ``hit_exact`` runs an atomic sliding-window log in Lua, one round trip per
+  request, for routes where the limit must hold exactly (login, password reset).
+
+Limits are declared per route and per role with :class:`RateLimiter`, which
+also sets the ``RateLimit-Limit``/``-Remaining``/``-Reset`` response headers.
+"""
+import logging
+import math
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import redis.asyncio as redis
+from fastapi import Depends, HTTPException, Request, Response, status
+from redis.exceptions import RedisError
+
+from auth import Principal, get_current_user
+from services.metrics import registry
+from services.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_SYNC_EVERY = 10
+RATE_LIMIT_SYNC_INTERVAL = 1.0
+
+SLIDING_WINDOW_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local window = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now_ms - window)
+local count = redis.call('ZCARD', KEYS[1])
+if count < limit then
+    redis.call('ZADD', KEYS[1], now_ms, ARGV[3])
+    redis.call('PEXPIRE', KEYS[1], window)
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return {1, limit - count - 1, tonumber(oldest[2]) + window - now_ms}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, 0, tonumber(oldest[2]) + window - now_ms}
+"""
+
+@dataclass(frozen=True, slots=True)
+class RateLimit:
+    """Allow ``times`` requests per ``seconds``."""
+    times: int
+    seconds: int
+
+@dataclass(frozen=True, slots=True)
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset: float
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(max(0, math.ceil(self.reset))),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = headers["RateLimit-Reset"]
+        return headers
+
+class _Bucket:
+    __slots__ = ("tokens", "updated_at", "window", "global_used", "pending", "synced_at")
+
+    def __init__(self, capacity: int, now: float):
+        self.tokens = float(capacity)
+        self.updated_at = now
+        self.window = 0
+        self.global_used = 0
+        self.pending = 0
+        self.synced_at = now
+
+class RateLimitStore:
+    """Per-worker rate limit state backed by Redis; see the module docstring for the two modes."""
+
+    def __init__(
+            self,
+            client: redis.Redis,
+            sync_every: int = RATE_LIMIT_SYNC_EVERY,
+            sync_interval: float = RATE_LIMIT_SYNC_INTERVAL,
+            max_keys: int = 100_000
+    ):
+        self.client = client
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.max_keys = max_keys
+        self.redis_calls = 0
+        self.errors = 0
+        self._buckets: Dict[str, _Bucket] = {}
+        self._sliding_window = client.register_script(SLIDING_WINDOW_SCRIPT)
+
+    def _bucket(self, key: str, limit: RateLimit, now: float) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                # Dropping everything only forgets local state; Redis still holds the global counts.
+                self._buckets.clear()
+            bucket = self._buckets[key] = _Bucket(limit.times, now)
+            return bucket
+        rate = limit.times / limit.seconds
+        bucket.tokens = min(limit.times, bucket.tokens + (now - bucket.updated_at) * rate)
+        bucket.updated_at = now
+        return bucket
+
+    async def _sync(self, key: str, bucket: _Bucket, limit: RateLimit, window: int):
+        pending, bucket.pending = bucket.pending, 0
+        bucket.synced_at = time.monotonic()
+        redis_key = f"ratelimit:{key}:{window}"
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.incrby(redis_key, pending)
+            pipe.expire(redis_key, limit.seconds * 2)
+            global_used, _ = await pipe.execute()
+        except RedisError:
+            logger.warning("Rate limit sync failed, enforcing local limits only", exc_info=True)
+            self.errors += 1
+            return
+        finally:
+            self.redis_calls += 1
+        if bucket.window == window:
+            bucket.global_used = int(global_used)
+
+    async def hit(self, key: str, limit: RateLimit) -> RateLimitResult:
+        """Consume one request from the local bucket, syncing with Redis in batches."""
+        now = time.monotonic()
+        window = int(time.time() // limit.seconds)
+        reset = (window + 1) * limit.seconds - time.time()
+        bucket = self._bucket(key, limit, now)
+        if bucket.window != window:
+            bucket.window, bucket.global_used = window, 0
+
+        global_left = limit.times - bucket.global_used - bucket.pending
+        allowed = bucket.tokens >= 1 and global_left >= 1
+        if allowed:
+            bucket.tokens -= 1
+            bucket.pending += 1
+            global_left -= 1
+            if bucket.pending >= self.sync_every or now - bucket.synced_at >= self.sync_interval:
+                await self._sync(key, bucket, limit, window)
+                global_left = limit.times - bucket.global_used
+        remaining = max(0, min(int(bucket.tokens), global_left))
+        return RateLimitResult(allowed, limit.times, remaining, reset)
+
+    async def hit_exact(self, key: str, limit: RateLimit) -> RateLimitResult:
+        """Consume one request from an atomic sliding window shared by all workers."""
+        self.redis_calls += 1
+        try:
+            allowed, remaining, reset_ms = await self._sliding_window(
+                keys=[f"ratelimit:exact:{key}"],
+                args=[limit.seconds * 1000, limit.times, uuid.uuid4().hex]
+            )
+        except RedisError:
+            logger.warning("Exact rate limit check failed, falling back to the local bucket", exc_info=True)
+            self.errors += 1
+            return await self.hit(key, limit)
+        return RateLimitResult(bool(allowed), limit.times, int(remaining), int(reset_ms) / 1000)
+
+    def stats(self) -> dict:
+        return {"redis_calls": self.redis_calls, "errors": self.errors, "local_keys": len(self._buckets)}
+
+rate_limit_store = RateLimitStore(redis_client)
+
+registry.callback("rate_limit_redis_calls_total", "Redis round trips made by the rate limiter.",
+                  lambda: [((), rate_limit_store.redis_calls)], type="counter")
+
+def get_rate_limit_store() -> RateLimitStore:
+    return rate_limit_store
+
+class RateLimiter:
+    """
+    Dependency limiting an authenticated route per user, with limits chosen by role.
+
+    ``RateLimiter("me", user=RateLimit(5, 60), admin=RateLimit(60, 60))``; roles
+    without an entry use ``default``, and a role mapped to ``None`` is unlimited.
+    """
+
+    def __init__(
+            self,
+            scope: str,
+            default: Optional[RateLimit] = None,
+            exact: bool = False,
+            **role_limits: Optional[RateLimit]
+    ):
+        self.scope = scope
+        self.default = default
+        self.exact = exact
+        self.role_limits = role_limits
+
+    def limit_for(self, role: str) -> Optional[RateLimit]:
+        return self.role_limits.get(role, self.default)
+
+    async def check(self, store: RateLimitStore, response: Response, identity: str, role: str):
+        limit = self.limit_for(role)
+        if limit is None:
+            return
+        key = f"{self.scope}:{identity}"
+        result = await (store.hit_exact(key, limit) if self.exact else store.hit(key, limit))
+        if not result.allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers=result.headers()
+            )
+        response.headers.update(result.headers())
+
+    async def __call__(
+            self,
+            response: Response,
+            current_user: Principal = Depends(get_current_user),
+            store: RateLimitStore = Depends(get_rate_limit_store)
+    ):
+        await self.check(store, response, f"user:{current_user.id}", current_user.role)
+
+class IPRateLimiter(RateLimiter):
+    """Variant of :class:`RateLimiter` for unauthenticated routes, keyed by client address."""
+
+    def __init__(self, scope: str, limit: RateLimit, exact: bool = False):
+        super().__init__(scope, default=limit, exact=exact)
+
+    async def __call__(
+            self,
+            request: Request,
+            response: Response,
+            store: RateLimitStore = Depends(get_rate_limit_store)
+    ):
+        client = request.client.host if request.client else "unknown"
+        await self.check(store, response, f"ip:{client}", "anonymous")
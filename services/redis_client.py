@@ -0,0 +1,167 @@
+"""
+The application's single Redis client.
+
+Every Redis user (principal cache, contact list cache, rate limiter, pub/sub
+invalidation) shares one bounded connection pool configured from the
+environment, with short socket timeouts so a slow Redis costs milliseconds,
+not seconds.
+
+Commands and pipelines go through a :class:`CircuitBreaker`. After repeated
+connection errors, timeouts or slow replies it opens and calls fail instantly
+with :class:`CircuitOpenError`, a ``RedisError``, so callers take the fallback
+paths they already have (database, in-process tier, local rate limits) without
+waiting on the network. After ``reset_timeout`` one probe call is let through
+to decide whether to close again.
+"""
+import logging
+import os
+import time
+from typing import Optional
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+from redis.asyncio.client import Pipeline
+from redis.exceptions import ConnectionError, RedisError, TimeoutError
+
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 0.25))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 0.25))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 0.5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+REDIS_BREAKER_FAILURES = int(os.getenv("REDIS_BREAKER_FAILURES", 5))
+REDIS_BREAKER_SLOW_CALL = float(os.getenv("REDIS_BREAKER_SLOW_CALL", 0.1))
+REDIS_BREAKER_RESET_TIMEOUT = float(os.getenv("REDIS_BREAKER_RESET_TIMEOUT", 5.0))
+
+class CircuitOpenError(RedisError):
+    """Raised instead of calling Redis while the circuit breaker is open."""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker; slow successful calls count as failures."""
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+            self,
+            failure_threshold: int = REDIS_BREAKER_FAILURES,
+            slow_call_threshold: float = REDIS_BREAKER_SLOW_CALL,
+            reset_timeout: float = REDIS_BREAKER_RESET_TIMEOUT
+    ):
+        self.failure_threshold = failure_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_total = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                self.rejected += 1
+                return False
+            self._probing = True
+        return True
+
+    def record(self, elapsed: float, failed: bool):
+        self._probing = False
+        if failed or elapsed > self.slow_call_threshold:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Redis circuit breaker opened after %d bad calls", self.failures)
+                    self.opened_total += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+        else:
+            if self.state != self.CLOSED:
+                logger.info("Redis circuit breaker closed")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    async def call(self, func, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError("Redis circuit breaker is open")
+        started = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+        except (ConnectionError, TimeoutError, OSError):
+            self.record(time.perf_counter() - started, failed=True)
+            raise
+        except BaseException:
+            # Command errors and cancellations say nothing about Redis health.
+            self._probing = False
+            raise
+        self.record(time.perf_counter() - started, failed=False)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "state_value": self.STATE_VALUES[self.state],
+            "failures": self.failures,
+            "opened_total": self.opened_total,
+            "rejected": self.rejected
+        }
+
+class ResilientPipeline(Pipeline):
+    breaker: CircuitBreaker
+
+    async def execute(self, raise_on_error: bool = True):
+        return await self.breaker.call(super().execute, raise_on_error)
+
+class ResilientRedis(redis.Redis):
+    """``redis.asyncio.Redis`` whose commands, scripts and pipelines go through a :class:`CircuitBreaker`."""
+
+    def __init__(self, *args, breaker: Optional[CircuitBreaker] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = breaker or CircuitBreaker()
+
+    async def execute_command(self, *args, **options):
+        return await self.breaker.call(super().execute_command, *args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> ResilientPipeline:
+        pipe = ResilientPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipe.breaker = self.breaker
+        return pipe
+
+def create_redis_client(url: str = REDIS_URL, **overrides) -> ResilientRedis:
+    """Build a client with its own pool; connections are only opened on first use."""
+    options = dict(
+        max_connections=REDIS_MAX_CONNECTIONS,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        retry_on_timeout=False
+    )
+    options.update(overrides)
+    pool = redis.BlockingConnectionPool.from_url(url, timeout=REDIS_POOL_TIMEOUT, **options)
+    return ResilientRedis(connection_pool=pool)
+
+redis_client = create_redis_client()
+
+registry.callback("redis_circuit_breaker_state", "Redis circuit breaker state: 0 closed, 1 half-open, 2 open.",
+                  lambda: [((), redis_client.breaker.STATE_VALUES[redis_client.breaker.state])])
+registry.callback("redis_circuit_breaker_opened_total", "Times the Redis circuit breaker opened.",
+                  lambda: [((), redis_client.breaker.opened_total)], type="counter")
+registry.callback("redis_circuit_breaker_rejected_total", "Redis calls skipped while the breaker was open.",
+                  lambda: [((), redis_client.breaker.rejected)], type="counter")
+
+async def close_redis_client():
+    await redis_client.aclose(close_connection_pool=True)
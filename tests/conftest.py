@@ -1,16 +1,96 @@
+import os
+
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+os.environ.setdefault("MAIL_USERNAME", "test")
+os.environ.setdefault("MAIL_PASSWORD", "test")
+os.environ.setdefault("MAIL_FROM", "test@example.com")
+os.environ.setdefault("MAIL_PORT", "1025")
+os.environ.setdefault("MAIL_SERVER", "localhost")
+
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from database import Base, get_db
+from fakeredis import FakeAsyncRedis
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from database import Base, get_db, get_read_db, get_session_factory
+from models import User
+from repository import search_index
+from services.metrics import instrument_engine
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
 
 @pytest.fixture(scope="function")
-def db():
-    Base.metadata.create_all(bind=engine)
-    session = TestingSessionLocal()
-    yield session
-    session.close()
-    Base.metadata.drop_all(bind=engine)
\ No newline at end of file
+async def db():
+    engine = create_async_engine(SQLALCHEMY_DATABASE_URL, poolclass=StaticPool)
+    instrument_engine(engine.sync_engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    TestingSessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    async with TestingSessionLocal() as session:
+        yield session
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
+    # Cached search indexes are keyed by (user id, list version), which the next database reuses.
+    search_index._indexes.clear()
+
+@pytest.fixture
+async def user(db):
+    user = User(username="testuser", email="test@example.com", hashed_password="x", role="user")
+    db.add(user)
+    await db.commit()
+    return user
+
+@pytest.fixture
+async def contact_cache():
+    from services.cache import ContactListCache
+
+    redis = FakeAsyncRedis()
+    yield ContactListCache(redis)
+    await redis.aclose()
+
+@pytest.fixture
+async def contact_events():
+    from services.events import ContactEventHub
+
+    redis = FakeAsyncRedis()
+    yield ContactEventHub(redis)
+    await redis.aclose()
+
+@pytest.fixture
+async def rate_limit_store():
+    from services.rate_limit import RateLimitStore
+
+    redis = FakeAsyncRedis()
+    yield RateLimitStore(redis)
+    await redis.aclose()
+
+@pytest.fixture
+async def client(db, user, contact_cache, contact_events, rate_limit_store):
+    from main import app
+    from auth import Principal, get_current_user
+    from services.cache import get_contact_cache
+    from services.events import get_contact_events
+    from services.rate_limit import get_rate_limit_store
+
+    async def override_get_db():
+        yield db
+
+    current_user = Principal(id=user.id, username=user.username, email=user.email, role=user.role)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: async_sessionmaker(
+        bind=db.bind, class_=AsyncSession, autoflush=False, expire_on_commit=False
+    )
+    app.dependency_overrides[get_current_user] = lambda: current_user
+    app.dependency_overrides[get_contact_cache] = lambda: contact_cache
+    app.dependency_overrides[get_contact_events] = lambda: contact_events
+    app.dependency_overrides[get_rate_limit_store] = lambda: rate_limit_store
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        yield ac
+    app.dependency_overrides.clear()
@@ -1,6 +1,13 @@
+import io
+import os
+import subprocess
+import sys
+
+import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 from fastapi.testclient import TestClient
 from main import app
+from services.query_recorder import query_budget
 
 client = TestClient(app)
 
@@ -75,3 +82,447 @@ def test_upcoming_birthdays(mock_db, mock_get_birthdays, mock_get_user):
     response = client.get("/contacts/upcoming-birthdays/", headers=headers)
     print("Upcoming birthdays response:", response.json())
     assert response.status_code in [200, 202]
+
+@pytest.mark.anyio
+async def test_contacts_crud(client):
+    payload = {
+        "first_name": "Bob", "last_name": "Brown", "email": "bob@example.com",
+        "phone": "123", "birthday": None, "additional_info": None
+    }
+    response = await client.post("/contacts/", json=payload)
+    assert response.status_code == 201
+    assert response.json()["result"] == "created"
+    contact_id = response.json()["id"]
+
+    response = await client.post("/contacts/", json=payload)
+    assert (response.status_code, response.json()["result"]) == (200, "existing")
+
+    response = await client.get("/contacts/")
+    assert [c["id"] for c in response.json()["items"]] == [contact_id]
+
+    response = await client.put(f"/contacts/{contact_id}/", json={**payload, "phone": "456"})
+    assert response.json()["phone"] == "456"
+
+    response = await client.delete(f"/contacts/{contact_id}/")
+    assert response.status_code == 204
+    response = await client.get(f"/contacts/{contact_id}/")
+    assert response.status_code == 404
+
+@pytest.mark.anyio
+async def test_get_contacts_rejects_bad_cursor(client):
+    response = await client.get("/contacts/", params={"cursor": "garbage"})
+    assert response.status_code == 400
+
+@pytest.mark.anyio
+async def test_search_contacts(client):
+    await client.post("/contacts/", json={
+        "first_name": "Bob", "last_name": "Brown", "email": "bob@example.com",
+        "phone": "123", "birthday": None, "additional_info": None
+    })
+    response = await client.get("/contacts/search", params={"q": "brwn"})
+    assert response.status_code == 200
+    assert [c["first_name"] for c in response.json()["items"]] == ["Bob"]
+
+@pytest.mark.anyio
+async def test_upcoming_birthdays_days_bounds(client):
+    assert (await client.get("/contacts/upcoming-birthdays/", params={"days": 30})).status_code == 200
+    assert (await client.get("/contacts/upcoming-birthdays/", params={"days": 0})).status_code == 422
+
+@pytest.mark.anyio
+async def test_contact_lists_serialize_rows_like_contact_read(client):
+    from datetime import date, timedelta
+    from schemas.contacts import ContactPage, ContactRead, ContactSearchPage
+
+    response = await client.post("/contacts/", json={
+        "first_name": "Ann", "last_name": "Lee", "email": "ann@example.com", "phone": "380501",
+        "birthday": (date.today() + timedelta(days=2)).isoformat(), "additional_info": "Met at \"PyCon\" ✓"
+    })
+    contact = ContactRead.model_validate(response.json())
+
+    page = await client.get("/contacts/")
+    search = await client.get("/contacts/search", params={"q": "ann"})
+    birthdays = await client.get("/contacts/upcoming-birthdays/")
+
+    assert page.content == ContactPage(items=[contact]).model_dump_json().encode()
+    assert search.content == ContactSearchPage(items=[contact]).model_dump_json().encode()
+    assert birthdays.json() == [contact.model_dump(mode="json")]
+
+@pytest.mark.anyio
+async def test_cached_birthdays_follow_the_list_version(client, db, user, contact_cache):
+    from datetime import date, timedelta
+    from repository.contacts import create_contact
+    from schemas.contacts import ContactCreate
+
+    assert (await client.get("/contacts/upcoming-birthdays/")).json() == []
+    # Written without updating the cached list version, as when Redis is unreachable during a write:
+    # the cached response lives on, but only until the version copy expires.
+    await create_contact(db, ContactCreate(
+        first_name="Ann", last_name="Lee", email="ann@example.com", phone="380501",
+        birthday=date.today() + timedelta(days=2), additional_info=None
+    ), user.id)
+    assert (await client.get("/contacts/upcoming-birthdays/")).json() == []
+    await contact_cache.client.delete(f"contacts:ver:{user.id}")
+    assert [c["first_name"] for c in (await client.get("/contacts/upcoming-birthdays/")).json()] == ["Ann"]
+
+@pytest.mark.anyio
+async def test_import_contacts_csv(client):
+    body = (
+        "first_name,last_name,email,phone,birthday,additional_info\n"
+        "Ann,Lee,ann@example.com,111,1990-01-02,\"likes\ntea\"\n"
+        "Bad,Row,not-an-email,222,,\n"
+        "Cid,Moss,cid@example.com,333,,\n"
+    )
+    response = await client.post("/contacts/import", content=body, headers={"Content-Type": "text/csv"})
+    report = response.json()
+    assert response.status_code == 200
+    assert (report["processed"], report["imported"], report["failed"]) == (3, 2, 1)
+    assert report["errors"][0]["row"] == 2
+
+    items = (await client.get("/contacts/")).json()["items"]
+    assert [c["first_name"] for c in items] == ["Ann", "Cid"]
+    assert items[0]["additional_info"] == "likes\ntea"
+
+@pytest.mark.anyio
+async def test_import_contacts_ndjson_is_idempotent(client):
+    body = '{"first_name": "Ann", "last_name": "Lee", "email": "ann@example.com", "phone": "1"}\n[1]\n'
+    for _ in range(2):
+        response = await client.post("/contacts/import", params={"format": "ndjson"}, content=body)
+        assert (response.json()["imported"], response.json()["failed"]) == (1, 1)
+    assert len((await client.get("/contacts/")).json()["items"]) == 1
+
+@pytest.mark.anyio
+async def test_import_contacts_requires_known_format(client):
+    response = await client.post("/contacts/import", content=b"x", headers={"Content-Type": "text/plain"})
+    assert response.status_code == 415
+
+@pytest.mark.anyio
+async def test_export_contacts_round_trips_import(client):
+    body = "first_name,last_name,email,phone,birthday,additional_info\nAnn,Lee,ann@example.com,111,1990-01-02,\n"
+    await client.post("/contacts/import", content=body, headers={"Content-Type": "text/csv"})
+
+    csv_response = await client.get("/contacts/export", headers={"Accept-Encoding": "gzip"})
+    assert csv_response.headers["content-encoding"] == "gzip"
+    lines = csv_response.text.splitlines()
+    assert lines[0] == "id,first_name,last_name,email,phone,birthday,additional_info"
+    assert lines[1].endswith("Ann,Lee,ann@example.com,111,1990-01-02,")
+
+    ndjson_response = await client.get("/contacts/export", params={"format": "ndjson", "gzip": "false"})
+    assert "content-encoding" not in ndjson_response.headers
+    assert '"birthday": "1990-01-02"' in ndjson_response.text
+
+@pytest.mark.anyio
+async def test_contact_list_cache_hits_and_invalidates(client, contact_cache):
+    payload = {
+        "first_name": "Bob", "last_name": "Brown", "email": "bob@example.com",
+        "phone": "123", "birthday": None, "additional_info": None
+    }
+    assert (await client.get("/contacts/")).json()["items"] == []
+    assert (await client.get("/contacts/")).json()["items"] == []
+    assert (contact_cache.hits, contact_cache.misses) == (1, 1)
+
+    contact_id = (await client.post("/contacts/", json=payload)).json()["id"]
+    assert [c["id"] for c in (await client.get("/contacts/")).json()["items"]] == [contact_id]
+
+    await client.put(f"/contacts/{contact_id}/", json={**payload, "phone": "999"})
+    assert (await client.get("/contacts/")).json()["items"][0]["phone"] == "999"
+    assert (contact_cache.hits, contact_cache.misses) == (1, 3)
+
+def make_png(width=300, height=200) -> bytes:
+    from PIL import Image
+
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(output, format="PNG")
+    return output.getvalue()
+
+@pytest.mark.anyio
+async def test_upload_avatar_stores_content_addressed_thumbnails(client, tmp_path):
+    from auth import get_current_user, is_admin
+    from services.avatars import LocalAvatarStorage, get_avatar_storage
+
+    app.dependency_overrides[is_admin] = app.dependency_overrides[get_current_user]
+    app.dependency_overrides[get_avatar_storage] = lambda: LocalAvatarStorage(tmp_path)
+    image = make_png()
+
+    response = await client.post("/user/avatar/", files={"file": ("avatar.png", image, "image/png")})
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body["sizes"]) == {"256", "128", "64"}
+    assert body["avatar_url"] == body["sizes"]["256"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(url.rsplit("/", 1)[1] for url in body["sizes"].values())
+
+    again = await client.post("/user/avatar/", files={"file": ("copy.png", image, "image/png")})
+    assert again.json() == body
+
+@pytest.mark.anyio
+async def test_upload_avatar_rejects_non_images(client, tmp_path):
+    from auth import get_current_user, is_admin
+    from services.avatars import LocalAvatarStorage, get_avatar_storage
+
+    app.dependency_overrides[is_admin] = app.dependency_overrides[get_current_user]
+    app.dependency_overrides[get_avatar_storage] = lambda: LocalAvatarStorage(tmp_path)
+
+    response = await client.post("/user/avatar/", files={"file": ("avatar.png", b"fake image data", "image/png")})
+    assert response.status_code == 422
+    assert list(tmp_path.iterdir()) == []
+
+@pytest.mark.anyio
+async def test_me_is_rate_limited_per_role(client):
+    responses = [await client.get("/user/me") for _ in range(6)]
+
+    assert [response.status_code for response in responses] == [200] * 5 + [429]
+    assert responses[0].headers["RateLimit-Limit"] == "5"
+    assert responses[0].headers["RateLimit-Remaining"] == "4"
+    assert "Retry-After" in responses[-1].headers
+
+def test_importing_main_has_no_side_effects():
+    code = (
+        "import sys, database, main\n"
+        "assert database._engine is None\n"
+        "assert not {'cloudinary', 'PIL', 'asyncpg'} & set(sys.modules), sys.modules.keys()\n"
+        "assert main.create_app() is not main.app\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=root)
+    assert result.returncode == 0, result.stderr
+
+@pytest.mark.anyio
+async def test_metrics_records_routes_and_db_usage(client, db):
+    from services.metrics import HTTP_LATENCY, REQUEST_DB_QUERIES
+
+    before = HTTP_LATENCY.count("GET", "/contacts/{contact_id}/")
+    queries_before = REQUEST_DB_QUERIES.count("/contacts/{contact_id}/")
+
+    assert (await client.get("/contacts/12345/")).status_code == 404
+    response = await client.get("/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert HTTP_LATENCY.count("GET", "/contacts/{contact_id}/") == before + 1
+    assert REQUEST_DB_QUERIES.count("/contacts/{contact_id}/") == queries_before + 1
+    assert 'http_requests_total{method="GET",route="/contacts/{contact_id}/",status="404"}' in response.text
+    assert "# TYPE redis_circuit_breaker_state gauge" in response.text
+    assert 'contact_cache_lookups_total{result="hit"}' in response.text
+
+@pytest.mark.anyio
+@query_budget(2)
+async def test_contact_list_query_budget(client):
+    assert (await client.get("/contacts/")).status_code == 200
+
+@pytest.mark.anyio
+async def test_contact_endpoints_stay_within_query_budgets(client):
+    payload = {
+        "first_name": "Ann", "last_name": "Lee", "email": "ann@example.com",
+        "phone": "123", "birthday": None, "additional_info": None
+    }
+    with query_budget(5):
+        contact_id = (await client.post("/contacts/", json=payload)).json()["id"]
+    with query_budget(1):
+        assert (await client.get(f"/contacts/{contact_id}/")).status_code == 200
+    with query_budget(5):
+        assert (await client.put(f"/contacts/{contact_id}/", json={**payload, "phone": "456"})).status_code == 200
+    with query_budget(2):
+        assert (await client.get("/contacts/search", params={"q": "Ann"})).status_code == 200
+    with query_budget(2):
+        assert (await client.get("/contacts/upcoming-birthdays/")).status_code == 200
+    with query_budget(6):
+        assert (await client.delete(f"/contacts/{contact_id}/")).status_code == 204
+
+@pytest.mark.anyio
+async def test_requests_over_query_budget_are_logged(client, monkeypatch, caplog):
+    import services.metrics
+
+    payload = {
+        "first_name": "Ann", "last_name": "Lee", "email": "ann@example.com",
+        "phone": "123", "birthday": None, "additional_info": None
+    }
+    contact_id = (await client.post("/contacts/", json=payload)).json()["id"]
+    monkeypatch.setattr(services.metrics, "QUERY_LOG_ENABLED", True)
+    monkeypatch.setattr(services.metrics, "QUERY_LOG_MAX_STATEMENTS", 4)
+    with caplog.at_level("WARNING", logger="services.metrics"):
+        await client.get("/contacts/")
+        assert not caplog.records
+        await client.put(f"/contacts/{contact_id}/", json={**payload, "phone": "456"})
+
+    [record] = caplog.records
+    assert "PUT /contacts/{contact_id}/ is over its query budget: 5 statements" in record.getMessage()
+    assert "UPDATE contacts SET phone=?" in record.getMessage()
+
+@pytest.mark.anyio
+async def test_contact_list_etag_changes_with_the_list(client):
+    payload = {
+        "first_name": "Ann", "last_name": "Lee", "email": "ann@example.com",
+        "phone": "123", "birthday": None, "additional_info": None
+    }
+    first = await client.get("/contacts/")
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "private, no-cache"
+
+    # The version is cached with the pages, so neither a 304 nor a cached page reads the database.
+    with query_budget(0):
+        response = await client.get("/contacts/", headers={"If-None-Match": etag})
+        assert (await client.get("/contacts/")).headers["etag"] == etag
+    assert (response.status_code, response.content) == (304, b"")
+    assert (await client.get("/contacts/", params={"limit": 10}, headers={"If-None-Match": etag})).status_code == 200
+
+    await client.post("/contacts/", json=payload)
+    response = await client.get("/contacts/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    last_modified = response.headers["last-modified"]
+    assert (await client.get("/contacts/", headers={"If-Modified-Since": last_modified})).status_code == 304
+
+@pytest.mark.anyio
+async def test_contact_etag_and_if_match(client):
+    payload = {
+        "first_name": "Ann", "last_name": "Lee", "email": "ann@example.com",
+        "phone": "123", "birthday": None, "additional_info": None
+    }
+    contact_id = (await client.post("/contacts/", json=payload)).json()["id"]
+    response = await client.get(f"/contacts/{contact_id}/")
+    etag = response.headers["etag"]
+    assert etag == '"v1"'
+
+    with query_budget(1) as recorder:
+        assert (await client.get(f"/contacts/{contact_id}/", headers={"If-None-Match": etag})).status_code == 304
+    assert recorder.statements[0][0].startswith("SELECT contacts.version, contacts.updated_at")
+
+    response = await client.put(f"/contacts/{contact_id}/", json={**payload, "phone": "456"}, headers={"If-Match": etag})
+    assert (response.status_code, response.headers["etag"]) == (200, '"v2"')
+
+    # A second writer still holding the old ETag is refused instead of overwriting.
+    response = await client.put(f"/contacts/{contact_id}/", json={**payload, "phone": "789"}, headers={"If-Match": etag})
+    assert response.status_code == 412
+    assert (await client.delete(f"/contacts/{contact_id}/", headers={"If-Match": etag})).status_code == 412
+    assert (await client.get(f"/contacts/{contact_id}/")).json()["phone"] == "456"
+
+    assert (await client.get(f"/contacts/{contact_id}/", headers={"If-None-Match": etag})).status_code == 200
+    assert (await client.delete(f"/contacts/{contact_id}/", headers={"If-Match": '"v2"'})).status_code == 204
+
+@pytest.mark.anyio
+async def test_contact_changes_feed(client, db):
+    from sqlalchemy import select
+    from models import user_contact_association
+
+    def payload(name):
+        return {
+            "first_name": name, "last_name": "Lee", "email": f"{name.lower()}@example.com",
+            "phone": "123", "birthday": None, "additional_info": None
+        }
+
+    ann = (await client.post("/contacts/", json=payload("Ann"))).json()["id"]
+    bob = (await client.post("/contacts/", json=payload("Bob"))).json()["id"]
+
+    page = (await client.get("/contacts/changes", params={"limit": 1})).json()
+    assert [(c["op"], c["id"]) for c in page["changes"]] == [("upsert", ann)]
+    assert page["has_more"] is True
+    page = (await client.get("/contacts/changes", params={"since": page["cursor"]})).json()
+    assert [(c["op"], c["id"], c["contact"]["first_name"]) for c in page["changes"]] == [("upsert", bob, "Bob")]
+    assert page["has_more"] is False
+    cursor = page["cursor"]
+
+    empty = (await client.get("/contacts/changes", params={"since": cursor})).json()
+    assert (empty["changes"], empty["cursor"]) == ([], cursor)
+
+    await client.put(f"/contacts/{ann}/", json={**payload("Ann"), "phone": "456"})
+    await client.delete(f"/contacts/{bob}/")
+    with query_budget(2):
+        page = (await client.get("/contacts/changes", params={"since": cursor})).json()
+    assert [(c["op"], c["id"]) for c in page["changes"]] == [("upsert", ann), ("delete", bob)]
+    assert page["changes"][0]["contact"]["phone"] == "456"
+    assert page["changes"][1]["contact"] is None
+
+    # Deleting a contact also removes its links.
+    links = await db.execute(select(user_contact_association).where(user_contact_association.c.contact_id == bob))
+    assert links.all() == []
+
+    assert (await client.get("/contacts/changes", params={"since": "garbage"})).status_code == 400
+
+@pytest.mark.anyio
+async def test_contact_writes_are_pushed_to_event_streams(client, contact_events, user):
+    import asyncio
+    import json
+
+    listener = asyncio.create_task(contact_events.run())
+    for _ in range(100):
+        if (await contact_events.client.pubsub_numsub("contacts:events"))[0][1]:
+            break
+        await asyncio.sleep(0.01)
+    subscriber = contact_events.subscribe(user.id)
+
+    payload = {
+        "first_name": "Ann", "last_name": "Lee", "email": "ann@example.com",
+        "phone": "123", "birthday": None, "additional_info": None
+    }
+    contact_id = (await client.post("/contacts/", json=payload)).json()["id"]
+    await client.put(f"/contacts/{contact_id}/", json={**payload, "phone": "456"})
+    await client.delete(f"/contacts/{contact_id}/")
+
+    events = []
+    for _ in range(3):
+        event, data = (await asyncio.wait_for(subscriber.next_frame(), 1)).decode().strip().splitlines()
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    assert [(name, data["id"]) for name, data in events] == [
+        ("create", contact_id), ("update", contact_id), ("delete", contact_id)
+    ]
+    assert events[1][1]["phone"] == "456"
+    listener.cancel()
+
+    contact_events.max_connections = 0
+    response = await client.get("/contacts/stream")
+    assert response.status_code == 503
+
+@pytest.mark.anyio
+async def test_contact_batch_applies_operations_in_one_transaction(client, db):
+    from sqlalchemy import select
+    from models import Contact, user_contact_association
+
+    def contact(number, **changes):
+        return {
+            "first_name": f"Name{number}", "last_name": "Lee", "email": f"c{number}@example.com",
+            "phone": "123", "birthday": None, "additional_info": None, **changes
+        }
+
+    with query_budget(5):
+        response = await client.post("/contacts/batch", json={
+            "operations": [{"op": "create", "contact": contact(number)} for number in range(20)]
+        })
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert {(result["status"], result["result"]) for result in results} == {(201, "created")}
+    ids = [result["id"] for result in results]
+
+    operations = [
+        {"op": "get", "id": ids[0]},
+        {"op": "get", "id": 10_000},
+        {"op": "create", "contact": contact(1)},
+        {"op": "create", "contact": contact(20)},
+        {"op": "update", "id": ids[2], "contact": contact(2, phone="456"), "version": 1},
+        {"op": "update", "id": ids[3], "contact": contact(3)},
+        {"op": "update", "id": ids[4], "contact": contact(4, phone="456"), "version": 7},
+        *({"op": "update", "id": ids[number], "contact": contact(number, phone="789")} for number in range(5, 10)),
+        *({"op": "delete", "id": ids[number]} for number in range(10, 20)),
+    ]
+    with query_budget(12):
+        response = await client.post("/contacts/batch", json={"operations": operations})
+    results = response.json()["results"]
+    assert [(result["status"], result["result"]) for result in results[:7]] == [
+        (200, "found"), (404, "not_found"), (200, "existing"), (201, "created"),
+        (200, "updated"), (200, "unchanged"), (412, "conflict"),
+    ]
+    assert results[0]["contact"] == {**contact(0), "id": ids[0]}
+    assert results[4]["contact"]["phone"] == "456"
+    assert {result["status"] for result in results[12:]} == {204}
+
+    updated = (await client.get(f"/contacts/{ids[2]}/"))
+    assert (updated.json()["phone"], updated.headers["ETag"]) == ("456", '"v2"')
+    assert (await client.get(f"/contacts/{ids[4]}/")).json()["phone"] == "123"
+    remaining = await db.scalars(select(Contact.id).where(Contact.id.in_(ids)))
+    assert sorted(remaining) == ids[:10]
+    links = await db.execute(select(user_contact_association).where(user_contact_association.c.contact_id.in_(ids[10:])))
+    assert links.all() == []
+
+    changes = (await client.get("/contacts/changes")).json()["changes"]
+    assert {change["id"] for change in changes if change["op"] == "delete"} == set(ids[10:])
+
+    duplicate = [{"op": "get", "id": ids[0]}, {"op": "delete", "id": ids[0]}]
+    assert (await client.post("/contacts/batch", json={"operations": duplicate})).status_code == 422
+    assert (await client.post("/contacts/batch", json={"operations": []})).status_code == 422
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from fakeredis import FakeAsyncRedis
+from fastapi import HTTPException
+
+import auth
+from auth import Principal, create_access_token, decode_access_token, get_current_user, invalidate_principal, is_admin
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def redis(monkeypatch):
+    client = FakeAsyncRedis()
+    monkeypatch.setattr(auth, "redis_client", client)
+    auth.principal_cache.clear()
+    yield client
+    auth.principal_cache.clear()
+    await client.aclose()
+
+async def test_get_current_user_fills_both_tiers(db, user, redis):
+    token = await create_access_token({"email": user.email})
+
+    principal = await get_current_user(token, db)
+
+    assert principal == Principal(id=user.id, username="testuser", email=user.email, role="user")
+    assert await redis.get(f"user:{user.email}") is not None
+    # Served from memory: no database session is needed any more.
+    assert await get_current_user(token, None) is principal
+
+async def test_get_current_user_rejects_bad_token(db, redis):
+    with pytest.raises(HTTPException) as exc:
+        await get_current_user("not-a-token", db)
+    assert exc.value.status_code == 401
+
+async def test_invalidate_principal_reaches_other_workers(db, user, redis):
+    token = await create_access_token({"email": user.email})
+    await get_current_user(token, db)
+    listener = asyncio.create_task(auth.listen_for_principal_invalidations())
+    await asyncio.sleep(0.05)
+
+    user.role = "admin"
+    await db.commit()
+    # Simulate another worker: the local entry is re-added after this worker's own eviction.
+    await invalidate_principal(user.email)
+    auth.principal_cache.set(user.email, Principal(id=user.id, username="testuser", email=user.email, role="user"))
+    await redis.publish(auth.PRINCIPAL_INVALIDATION_CHANNEL, user.email)
+    await asyncio.sleep(0.05)
+    listener.cancel()
+
+    principal = await get_current_user(token, db)
+    assert principal.role == "admin"
+    assert await is_admin(principal) is principal
+
+async def test_decode_access_token_caches_verified_tokens(monkeypatch):
+    auth.verified_tokens.clear()
+    token = await create_access_token({"email": "a@example.com"})
+    assert decode_access_token(token)["sub"] == "a@example.com"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("signature checked twice")
+
+    monkeypatch.setattr(auth.jwt, "decode", fail)
+    assert decode_access_token(token)["sub"] == "a@example.com"
+
+async def test_decode_access_token_does_not_cache_failures_or_expired_tokens():
+    auth.verified_tokens.clear()
+    expired = await create_access_token({"email": "a@example.com"}, expires_delta=-1)
+
+    for token in (expired, "garbage"):
+        with pytest.raises(ValueError):
+            decode_access_token(token)
+    assert len(auth.verified_tokens) == 0
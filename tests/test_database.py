@@ -0,0 +1,100 @@
+import pytest
+from fakeredis import FakeAsyncRedis, FakeServer
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+import database
+from database import PrimarySession, ReplicaRouter, WriteFences, request_identity
+from models import Contact
+from services.metrics import DB_POOL_CONNECT, DB_POOL_WAIT
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def routing(monkeypatch, tmp_path, db):
+    router = ReplicaRouter([f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}"], max_lag=5)
+    redis = FakeAsyncRedis()
+    primary = async_sessionmaker(
+        bind=db.bind, class_=AsyncSession, sync_session_class=PrimarySession, expire_on_commit=False
+    )
+    monkeypatch.setattr(database, "replica_router", router)
+    monkeypatch.setattr(database, "write_fences", WriteFences(redis, ttl=10))
+    monkeypatch.setattr(database, "get_session_factory", lambda: primary)
+    token = request_identity.set("alice@example.com")
+    yield router
+    request_identity.reset(token)
+    await router.dispose()
+    await redis.aclose()
+
+async def read_bind():
+    sessions = database.get_read_db()
+    session = await sessions.__anext__()
+    await sessions.aclose()
+    return session.bind
+
+async def test_primary_session_tracks_committed_writes(db):
+    factory = async_sessionmaker(bind=db.bind, class_=AsyncSession, sync_session_class=PrimarySession)
+    async with factory() as session:
+        await session.execute(select(Contact))
+        await session.commit()
+        assert "wrote" not in session.info
+
+        await session.execute(insert(Contact).values(first_name="A", email="a@example.com"))
+        await session.rollback()
+        await session.commit()
+        assert "wrote" not in session.info
+
+        session.add(Contact(first_name="B", email="b@example.com"))
+        await session.commit()
+        assert session.info["wrote"] is True
+
+async def test_read_db_waits_for_replica_to_catch_up_with_own_writes(routing):
+    replica = routing.replicas[0]
+    assert await read_bind() is not replica.engine, "lag unknown before the first poll"
+
+    await routing.poll_once()
+    assert await read_bind() is replica.engine
+
+    async for session in database.get_db():
+        session.add(Contact(first_name="C", email="c@example.com"))
+        await session.commit()
+    assert await read_bind() is not replica.engine
+
+    # Another client is not affected by this caller's write.
+    token = request_identity.set("bob@example.com")
+    assert await read_bind() is replica.engine
+    request_identity.reset(token)
+
+    await routing.poll_once()
+    assert await read_bind() is replica.engine
+
+async def test_replica_lagging_past_max_lag_gets_no_reads(routing):
+    await routing.poll_once()
+    routing.replicas[0].caught_up_at -= 10
+    assert routing.choose() is None
+
+async def test_write_fences_are_shared_and_fail_safe():
+    server = FakeServer()
+    redis = FakeAsyncRedis(server=server)
+    await WriteFences(redis, ttl=10).record("alice@example.com")
+    assert await WriteFences(redis).get("alice@example.com") > 0
+    assert await WriteFences(redis).get("bob@example.com") == 0.0
+
+    server.connected = False
+    assert await WriteFences(redis).get("bob@example.com") > 0
+    await redis.aclose()
+
+async def test_pool_times_queue_wait_apart_from_connecting(tmp_path):
+    def count(histogram):
+        state = histogram._values.get(())
+        return sum(state[0]) if state else 0
+
+    engine = database.create_engine_from_settings(f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}")
+    waits, connects = count(DB_POOL_WAIT), count(DB_POOL_CONNECT)
+    for _ in range(2):
+        async with engine.connect():
+            pass
+    await engine.dispose()
+
+    assert count(DB_POOL_WAIT) == waits + 2
+    assert count(DB_POOL_CONNECT) == connects + 1
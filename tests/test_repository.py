@@ -1,11 +1,25 @@
-from unittest.mock import MagicMock
-from repository.contacts import create_contact, get_contact_by_id, delete_contact
+from datetime import date
+
+import pytest
+from repository.contacts import (
+    create_contact,
+    get_contact_by_id,
+    delete_contact,
+    get_list_version,
+    get_user_contacts,
+    get_user_contacts_page,
+    get_upcoming_birthdays,
+    search_contacts,
+    update_contact
+)
+from repository import search_index
 from schemas.contacts import ContactCreate
-from models import Contact
+from models import User
+
+pytestmark = pytest.mark.anyio
 
-def test_create_contact():
-    db_mock = MagicMock()
-    contact_data = ContactCreate(
+def make_contact_data(**overrides):
+    data = dict(
         first_name="John",
         last_name="Doe",
         email="john@example.com",
@@ -13,39 +27,184 @@ def test_create_contact():
         birthday=None,
         additional_info="Friend"
     )
+    data.update(overrides)
+    return ContactCreate(**data)
+
+async def make_user(db, username="owner"):
+    user = User(username=username, email=f"{username}@example.com", hashed_password="x")
+    db.add(user)
+    await db.commit()
+    return user
 
-    db_mock.query.return_value.filter.return_value.first.return_value = None
-    db_mock.add = MagicMock()
-    db_mock.commit = MagicMock()
-    db_mock.refresh = MagicMock()
+async def test_create_contact(db):
+    user = await make_user(db)
 
-    contact = create_contact(db_mock, contact_data, user_id=1)
+    contact, _ = await create_contact(db, make_contact_data(), user_id=user.id)
 
+    assert contact.id is not None
     assert contact.email == "john@example.com"
-    db_mock.add.assert_called_once()
-    db_mock.commit.assert_called()
+    assert [c.id for c in await get_user_contacts(db, user.id)] == [contact.id]
+
+async def test_create_contact_is_idempotent_and_links_shared_contacts(db):
+    owner = await make_user(db)
+    other = await make_user(db, "other")
+
+    contact, first = await create_contact(db, make_contact_data(), user_id=owner.id)
+    version = await get_list_version(db, owner.id)
+    again, second = await create_contact(db, make_contact_data(), user_id=owner.id)
+    assert await get_list_version(db, owner.id) == version
+    shared, third = await create_contact(db, make_contact_data(), user_id=other.id)
 
-def test_get_contact_by_id():
-    db_mock = MagicMock()
-    contact = Contact(id=1, first_name="Alice", email="alice@example.com")
+    assert (first, second, third) == ("created", "existing", "linked")
+    assert again.id == shared.id == contact.id
+    assert len(await get_user_contacts(db, owner.id)) == 1
+    assert [c.id for c in await get_user_contacts(db, other.id)] == [contact.id]
 
-    db_mock.query.return_value.join.return_value.filter.return_value.first.return_value = contact
-    fetched_contact = get_contact_by_id(db_mock, contact_id=1, user_id=1)
+async def test_get_contact_by_id(db):
+    user = await make_user(db)
+    other = await make_user(db, "other")
+    contact, _ = await create_contact(db, make_contact_data(first_name="Alice", email="alice@example.com"), user_id=user.id)
+
+    fetched_contact = await get_contact_by_id(db, contact_id=contact.id, user_id=user.id)
 
     assert fetched_contact is not None
     assert fetched_contact.email == "alice@example.com"
+    assert await get_contact_by_id(db, contact_id=contact.id, user_id=other.id) is None
+
+async def test_update_contact(db):
+    user = await make_user(db)
+    contact, _ = await create_contact(db, make_contact_data(), user_id=user.id)
+
+    updated, linked_user_ids = await update_contact(db, contact.id, make_contact_data(phone="555"), user_id=user.id)
 
-def test_delete_contact():
-    db_mock = MagicMock()
-    contact = Contact(id=2, first_name="Mike", email="mike@example.com")
+    assert updated.phone == "555"
+    assert linked_user_ids == [user.id]
+    assert await update_contact(db, contact.id, make_contact_data(phone="555"), user_id=user.id) == (updated, [])
 
-    db_mock.query.return_value.join.return_value.filter.return_value.first.return_value = contact
-    db_mock.delete = MagicMock()
-    db_mock.commit = MagicMock()
+async def test_delete_contact(db):
+    user = await make_user(db)
+    contact, _ = await create_contact(db, make_contact_data(first_name="Mike", email="mike@example.com"), user_id=user.id)
 
-    success = delete_contact(db_mock, contact_id=2, user_id=1)
+    success, linked_user_ids = await delete_contact(db, contact_id=contact.id, user_id=user.id)
 
     assert success is True
-    db_mock.delete.assert_called_once()
-    db_mock.commit.assert_called_once()
+    assert linked_user_ids == [user.id]
+    assert await get_contact_by_id(db, contact_id=contact.id, user_id=user.id) is None
+    assert await delete_contact(db, contact_id=contact.id, user_id=user.id) == (False, [])
+
+async def test_get_user_contacts_page_walks_forward_and_back(db):
+    user = await make_user(db)
+    names = ["Evans", "Adams", "Clark", "Baker", "Davis"]
+    for index, last_name in enumerate(names):
+        await create_contact(db, make_contact_data(last_name=last_name, email=f"c{index}@example.com"), user_id=user.id)
+
+    first, next_cursor, prev_cursor = await get_user_contacts_page(db, user.id, limit=2)
+    assert [c.last_name for c in first] == ["Adams", "Baker"]
+    assert prev_cursor is None
+
+    second, next_cursor, prev_cursor = await get_user_contacts_page(db, user.id, limit=2, cursor=next_cursor)
+    assert [c.last_name for c in second] == ["Clark", "Davis"]
+
+    last, end_cursor, _ = await get_user_contacts_page(db, user.id, limit=2, cursor=next_cursor)
+    assert [c.last_name for c in last] == ["Evans"]
+    assert end_cursor is None
+
+    back, _, first_prev = await get_user_contacts_page(db, user.id, limit=2, cursor=prev_cursor)
+    assert [c.last_name for c in back] == ["Adams", "Baker"]
+    assert first_prev is None
+
+async def test_get_user_contacts_page_filters(db):
+    user = await make_user(db)
+    await create_contact(db, make_contact_data(first_name="Ann", email="ann@example.com", phone="380501"), user_id=user.id)
+    await create_contact(db, make_contact_data(first_name="Bob", email="bob@test.org", phone="380672"), user_id=user.id)
+
+    by_name, _, _ = await get_user_contacts_page(db, user.id, name="an")
+    by_email, _, _ = await get_user_contacts_page(db, user.id, email="bob@")
+    by_phone, _, _ = await get_user_contacts_page(db, user.id, phone="38050")
+
+    assert [c.first_name for c in by_name] == ["Ann"]
+    assert [c.first_name for c in by_email] == ["Bob"]
+    assert [c.first_name for c in by_phone] == ["Ann"]
+
+async def test_get_user_contacts_page_rejects_bad_cursor(db):
+    user = await make_user(db)
+    with pytest.raises(ValueError):
+        await get_user_contacts_page(db, user.id, cursor="not-a-cursor")
+
+async def test_search_contacts_ranks_prefix_substring_and_typos(db):
+    user = await make_user(db)
+    await create_contact(db, make_contact_data(first_name="John", last_name="Smith", email="js@example.com"), user_id=user.id)
+    await create_contact(db, make_contact_data(first_name="Mary", last_name="Johnson", email="mj@example.com"), user_id=user.id)
+    await create_contact(db, make_contact_data(first_name="Peter", last_name="Parker", email="pp@web.net", phone="777"), user_id=user.id)
+
+    prefix, _ = await search_contacts(db, user.id, "john")
+    typo, _ = await search_contacts(db, user.id, "jhon")
+    substring, _ = await search_contacts(db, user.id, "web.n")
+
+    assert [c.first_name for c in prefix] == ["John", "Mary"]
+    assert typo[0].first_name == "John"
+    assert [c.first_name for c in substring] == ["Peter"]
+
+async def test_search_contacts_paginates_and_sees_updates(db):
+    user = await make_user(db)
+    for index in range(3):
+        await create_contact(db, make_contact_data(first_name=f"Anna{index}", email=f"a{index}@example.com"), user_id=user.id)
+
+    page, next_offset = await search_contacts(db, user.id, "anna", limit=2)
+    rest, end = await search_contacts(db, user.id, "anna", limit=2, offset=next_offset)
+    assert len(page) == 2 and len(rest) == 1 and end is None
+
+    await create_contact(db, make_contact_data(first_name="Annabel", email="bel@example.com"), user_id=user.id)
+    everything, _ = await search_contacts(db, user.id, "anna", limit=10)
+    assert len(everything) == 4
+
+async def test_get_upcoming_birthdays_ignores_birth_year(db):
+    user = await make_user(db)
+    await create_contact(db, make_contact_data(first_name="Soon", email="soon@example.com", birthday=date(1990, 6, 3)), user_id=user.id)
+    await create_contact(db, make_contact_data(first_name="Later", email="later@example.com", birthday=date(1985, 6, 20)), user_id=user.id)
+
+    week = await get_upcoming_birthdays(db, user.id, today=date(2025, 6, 1))
+    month = await get_upcoming_birthdays(db, user.id, days=30, today=date(2025, 6, 1))
+
+    assert [c.first_name for c in week] == ["Soon"]
+    assert [c.first_name for c in month] == ["Soon", "Later"]
+
+async def test_get_upcoming_birthdays_wraps_new_year_and_feb_29(db):
+    user = await make_user(db)
+    await create_contact(db, make_contact_data(first_name="Jan", email="jan@example.com", birthday=date(1990, 1, 2)), user_id=user.id)
+    await create_contact(db, make_contact_data(first_name="Dec", email="dec@example.com", birthday=date(1990, 12, 30)), user_id=user.id)
+    await create_contact(db, make_contact_data(first_name="Leap", email="leap@example.com", birthday=date(1992, 2, 29)), user_id=user.id)
+
+    new_year = await get_upcoming_birthdays(db, user.id, today=date(2025, 12, 29))
+    common_year = await get_upcoming_birthdays(db, user.id, days=3, today=date(2025, 2, 25))
+
+    assert [c.first_name for c in new_year] == ["Dec", "Jan"]
+    assert [c.first_name for c in common_year] == ["Leap"]
+
+async def test_update_contact_refreshes_birthday_key(db):
+    user = await make_user(db)
+    contact, _ = await create_contact(db, make_contact_data(birthday=date(1990, 3, 1)), user_id=user.id)
+
+    await update_contact(db, contact.id, make_contact_data(birthday=date(1990, 7, 4)), user_id=user.id)
+
+    assert [c.id for c in await get_upcoming_birthdays(db, user.id, today=date(2025, 7, 1))] == [contact.id]
+
+async def test_update_contact_refreshes_list_order(db):
+    user = await make_user(db)
+    contact, _ = await create_contact(db, make_contact_data(last_name="Adams", email="a@example.com"), user_id=user.id)
+    await create_contact(db, make_contact_data(last_name="Baker", email="b@example.com"), user_id=user.id)
+
+    await update_contact(db, contact.id, make_contact_data(last_name="Clark", email="a@example.com"), user_id=user.id)
+
+    page, _, _ = await get_user_contacts_page(db, user.id)
+    assert [c.last_name for c in page] == ["Baker", "Clark"]
+
+async def test_search_index_survives_other_users_writes(db):
+    user, other = await make_user(db), await make_user(db, username="other")
+    await create_contact(db, make_contact_data(first_name="Anna", email="anna@example.com"), user_id=user.id)
+    await search_contacts(db, user.id, "anna")
+    version, _ = await get_list_version(db, user.id)
+
+    await create_contact(db, make_contact_data(first_name="Bob", email="bob@example.com"), user_id=other.id)
 
+    assert search_index.get_index(user.id, version) is not None
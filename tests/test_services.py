@@ -0,0 +1,370 @@
+import asyncio
+import io
+import socket
+import threading
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from fakeredis import FakeAsyncRedis, FakeServer
+from fastapi import UploadFile
+from httpx import ASGITransport, AsyncClient
+from passlib.context import CryptContext
+from redis.exceptions import ConnectionError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from models import EmailOutbox, utcnow
+from services.avatars import (
+    AvatarTooLargeError, ImmutableStaticFiles, InvalidAvatarError, LocalAvatarStorage, read_upload, render_thumbnails
+)
+from services.cache import ContactListCache
+from services.events import CONTACT_EVENTS_CHANNEL, HEARTBEAT_FRAME, RESYNC_FRAME, ContactEventHub, Subscriber
+from services.hashing import HashingBusyError, PasswordHasher
+from services.importer import iter_csv_rows, iter_lines
+from services.metrics import Registry
+from services.outbox import OutboxWorker, SMTPMailer, enqueue_email
+from services.query_recorder import QueryBudgetExceeded, query_budget, record_queries
+from services.rate_limit import RateLimit, RateLimitStore
+from services.redis_client import CircuitBreaker, CircuitOpenError, create_redis_client
+
+pytestmark = pytest.mark.anyio
+
+async def chunked(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+async def test_iter_lines_handles_split_chunks():
+    data = "﻿name\r\nJosé\nŁukasz".encode()
+    lines = [line async for line in iter_lines(chunked(data, 3))]
+    assert lines == ["name", "José", "Łukasz"]
+
+async def test_iter_csv_rows_reports_bad_records():
+    data = b'a,b\n1,2\n3\n"4\n'
+    rows = [row async for row in iter_csv_rows(iter_lines(chunked(data, 2)))]
+    assert rows == [(1, {"a": "1", "b": "2"}, None), (2, None, "Expected 2 fields, got 1"), (3, None, "Unterminated quoted field")]
+
+async def test_contact_cache_survives_redis_errors():
+    client = MagicMock()
+    client.get = AsyncMock(side_effect=ConnectionError)
+    client.set = AsyncMock(side_effect=ConnectionError)
+    cache = ContactListCache(client)
+
+    assert await cache.get_version(1) is None
+    assert await cache.get(1, 3, "list") is None
+    await cache.set(1, 3, "list", b"[]")
+    assert cache.stats()["errors"] == 3
+
+async def test_contact_cache_versions_only_move_forward():
+    from datetime import datetime
+
+    cache = ContactListCache(FakeAsyncRedis(), version_ttl=7)
+    await cache.set_versions({1: (5, datetime(2025, 1, 2, 3, 4, 5)), 2: (0, None)})
+    await cache.set_versions({1: (4, datetime(2025, 1, 1))})
+    assert await cache.get_version(1) == (5, datetime(2025, 1, 2, 3, 4, 5))
+    assert await cache.get_version(2) == (0, None)
+    assert await cache.get_version(3) is None
+    assert 0 < await cache.client.ttl("contacts:ver:1") <= 7
+    await cache.client.aclose()
+
+@pytest.fixture
+def fast_context():
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=4)
+
+async def test_password_hasher_round_trip_and_rehash(fast_context):
+    hasher = PasswordHasher(context=fast_context, workers=2)
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=5).hash("secret")
+
+    assert await hasher.verify("login", "secret", await hasher.hash("signup", "secret"))
+    valid, new_hash = await hasher.verify_and_update("login", "secret", old_hash)
+    assert valid and new_hash.startswith("$2b$04$")
+    assert await hasher.verify_and_update("login", "wrong", old_hash) == (False, None)
+    hasher.shutdown()
+
+async def test_password_hasher_fails_fast_when_endpoint_is_saturated(fast_context):
+    hasher = PasswordHasher(context=fast_context, workers=1, queue_size=8, endpoint_limits={"signup": 1})
+    release = threading.Event()
+    blocked = asyncio.ensure_future(hasher._submit("signup", release.wait))
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(HashingBusyError) as exc:
+        await hasher.hash("signup", "secret")
+    assert exc.value.status_code == 503
+    assert int(exc.value.headers["Retry-After"]) >= 1
+
+    release.set()
+    await blocked
+    assert await hasher.hash("signup", "secret")
+    hasher.shutdown()
+
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+@pytest.fixture
+def smtp_server():
+    controller_module = pytest.importorskip("aiosmtpd.controller")
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    handler = RecordingHandler()
+    controller = controller_module.Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    yield handler, port
+    controller.stop()
+
+async def test_outbox_drains_batch_over_one_connection(db, smtp_server):
+    handler, port = smtp_server
+    mailer = SMTPMailer("127.0.0.1", port, sender="noreply@example.com")
+    worker = OutboxWorker(async_sessionmaker(bind=db.bind, expire_on_commit=False), mailer)
+    for index in range(3):
+        enqueue_email(db, f"user{index}@example.com", "Hello", "Body")
+    await db.commit()
+
+    assert await worker.drain_once() == 3
+    await mailer.close()
+
+    assert [m.rcpt_tos for m in handler.messages] == [[f"user{index}@example.com"] for index in range(3)]
+    assert mailer.connections_opened == 1
+    statuses = (await db.execute(select(EmailOutbox.status).execution_options(populate_existing=True))).scalars().all()
+    assert statuses == ["sent"] * 3
+
+async def test_outbox_retries_with_backoff_then_gives_up(db):
+    mailer = MagicMock()
+    mailer.send = AsyncMock(side_effect=ConnectionRefusedError("smtp down"))
+    worker = OutboxWorker(async_sessionmaker(bind=db.bind, expire_on_commit=False), mailer, max_attempts=2)
+    message = enqueue_email(db, "user@example.com", "Hello", "Body")
+    await db.commit()
+
+    assert await worker.drain_once() == 1
+    await db.refresh(message)
+    assert (message.status, message.attempts) == ("pending", 1)
+    assert message.next_attempt_at > utcnow()
+    assert await worker.drain_once() == 0
+
+    message.next_attempt_at = utcnow()
+    await db.commit()
+    assert await worker.drain_once() == 1
+    await db.refresh(message)
+    assert (message.status, message.last_error) == ("failed", "smtp down")
+
+async def test_outbox_stops_batch_at_connection_failure_and_keeps_results(db):
+    mailer = MagicMock()
+    mailer.send = AsyncMock(side_effect=[None, ConnectionRefusedError("smtp down")])
+    worker = OutboxWorker(async_sessionmaker(bind=db.bind, expire_on_commit=False), mailer)
+    messages = [enqueue_email(db, f"user{index}@example.com", "Hello", "Body") for index in range(3)]
+    await db.commit()
+
+    assert await worker.drain_once() == 2
+    assert mailer.send.await_count == 2
+    for message in messages:
+        await db.refresh(message)
+    assert [(m.status, m.attempts) for m in messages] == [("sent", 1), ("pending", 1), ("pending", 0)]
+    assert messages[2].next_attempt_at > utcnow()
+
+async def test_read_upload_enforces_size_cap():
+    upload = UploadFile(io.BytesIO(b"x" * 100))
+    assert await read_upload(upload, max_bytes=100, chunk_size=16) == b"x" * 100
+
+    upload = UploadFile(io.BytesIO(b"x" * 101))
+    with pytest.raises(AvatarTooLargeError):
+        await read_upload(upload, max_bytes=100, chunk_size=16)
+
+def test_render_thumbnails_crops_to_squares():
+    from PIL import Image
+
+    source = io.BytesIO()
+    Image.new("RGBA", (400, 100), (0, 0, 255, 128)).save(source, format="PNG")
+    thumbnails = render_thumbnails(source.getvalue(), sizes=(64, 32))
+    assert [Image.open(io.BytesIO(data)).size for data in thumbnails.values()] == [(64, 64), (32, 32)]
+
+    with pytest.raises(InvalidAvatarError):
+        render_thumbnails(b"not an image")
+
+async def test_immutable_static_files_sets_cache_headers(tmp_path):
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+
+    url = await LocalAvatarStorage(tmp_path).save("abc_64.webp", b"data", "image/webp")
+    app = Starlette(routes=[Mount("/avatars", ImmutableStaticFiles(directory=tmp_path))])
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get(url)
+    assert response.content == b"data"
+    assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+
+async def test_rate_limit_store_batches_redis_syncs():
+    store = RateLimitStore(FakeAsyncRedis(), sync_every=5, sync_interval=3600)
+    limit = RateLimit(times=20, seconds=60)
+    results = [await store.hit("me:user:1", limit) for _ in range(21)]
+
+    assert [result.allowed for result in results] == [True] * 20 + [False]
+    assert results[0].remaining == 19
+    assert store.redis_calls == 4
+
+async def test_rate_limit_store_caps_local_bucket_by_global_count():
+    redis = FakeAsyncRedis()
+    limit = RateLimit(times=10, seconds=60)
+    first, second = RateLimitStore(redis, sync_every=1), RateLimitStore(redis, sync_every=1)
+    for _ in range(8):
+        assert (await first.hit("me:user:1", limit)).allowed
+
+    allowed = [(await second.hit("me:user:1", limit)).allowed for _ in range(4)]
+    assert allowed == [True, True, False, False]
+
+async def test_rate_limit_store_exact_sliding_window():
+    redis = FakeAsyncRedis()
+    limit = RateLimit(times=3, seconds=60)
+    workers = [RateLimitStore(redis), RateLimitStore(redis)]
+    results = [await workers[index % 2].hit_exact("login:ip:1", limit) for index in range(4)]
+
+    assert [result.remaining for result in results] == [2, 1, 0, 0]
+    assert not results[-1].allowed
+    assert 0 < results[-1].reset <= 60
+    assert results[-1].headers()["Retry-After"] == results[-1].headers()["RateLimit-Reset"]
+
+async def test_rate_limit_store_exact_falls_back_to_local_bucket():
+    redis = MagicMock()
+    redis.register_script.return_value = AsyncMock(side_effect=ConnectionError("down"))
+    redis.pipeline.side_effect = ConnectionError("down")
+    store = RateLimitStore(redis)
+
+    results = [await store.hit_exact("login:ip:1", RateLimit(times=2, seconds=60)) for _ in range(3)]
+    assert [result.allowed for result in results] == [True, True, False]
+
+def test_circuit_breaker_opens_and_probes():
+    breaker = CircuitBreaker(failure_threshold=2, slow_call_threshold=0.1, reset_timeout=0)
+    breaker.record(0.01, failed=True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(0.5, failed=False)
+    assert breaker.stats()["state_value"] == 2
+
+    # reset_timeout elapsed: exactly one probe goes through.
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record(0.01, failed=False)
+    assert (breaker.state, breaker.opened_total) == (CircuitBreaker.CLOSED, 1)
+
+async def test_resilient_redis_fails_fast_once_open():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    client = create_redis_client(f"redis://127.0.0.1:{port}/0")
+    client.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            await client.get("key")
+    with pytest.raises(CircuitOpenError):
+        await client.get("key")
+    pipe = client.pipeline(transaction=False)
+    pipe.incr("key")
+    with pytest.raises(CircuitOpenError):
+        await pipe.execute()
+    assert client.breaker.rejected == 2
+
+    # Callers that already tolerate Redis errors degrade to a cache miss.
+    cache = ContactListCache(client)
+    assert await cache.get_version(1) is None
+    assert await cache.get(1, 0, "list") is None
+    await client.aclose(close_connection_pool=True)
+
+def test_metrics_render_prometheus_text():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.", ["route"])
+    latency = registry.histogram("latency_seconds", "Latency.", ["route"], buckets=(0.1, 1.0))
+    registry.callback("queue_depth", "Depth.", lambda: [((), 3)])
+    requests.inc('/a"b')
+    requests.inc('/a"b', amount=2)
+    latency.observe(0.05, "/a")
+    latency.observe(0.5, "/a")
+    latency.observe(5, "/a")
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/a\\"b"} 3',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{route="/a"} 5.55',
+        'latency_seconds_count{route="/a"} 3',
+        "# HELP queue_depth Depth.",
+        "# TYPE queue_depth gauge",
+        "queue_depth 3",
+    ]
+
+def test_query_budget_reports_excess_and_duplicate_statements():
+    with record_queries() as recorder:
+        recorder.add("SELECT 1", 0.001)
+    with pytest.raises(QueryBudgetExceeded, match="budget of 0 exceeded"):
+        with query_budget(0) as recorder:
+            recorder.add("SELECT 1", 0.001)
+    with pytest.raises(QueryBudgetExceeded, match="N\\+1"):
+        with query_budget(5) as recorder:
+            for contact_id in (1, 2):
+                recorder.add("SELECT * FROM contacts WHERE id = ?", 0.001)
+    with query_budget(5, allow_duplicates=True) as recorder:
+        recorder.add("SELECT 1", 0.001)
+        recorder.add("SELECT 1", 0.001)
+    assert recorder.duplicates() == {"SELECT 1": 2}
+    assert recorder.exceeds(max_statements=1) and not recorder.exceeds(max_seconds=1.0)
+
+async def wait_for_subscription(redis):
+    for _ in range(100):
+        if dict(await redis.pubsub_numsub(CONTACT_EVENTS_CHANNEL)).get(CONTACT_EVENTS_CHANNEL.encode()):
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("event listener did not subscribe")
+
+async def test_contact_events_fan_out_across_workers():
+    server = FakeServer()
+    publisher = ContactEventHub(FakeAsyncRedis(server=server))
+    worker = ContactEventHub(FakeAsyncRedis(server=server))
+    listener = asyncio.create_task(worker.run())
+    await wait_for_subscription(worker.client)
+
+    streams = [worker.subscribe(1), worker.subscribe(1), worker.subscribe(2)]
+    await publisher.publish([1, 3], "delete", {"id": 7})
+    frames = [await asyncio.wait_for(stream.next_frame(), 1) for stream in streams[:2]]
+    assert frames == [b'event: delete\ndata: {"id":7}\n\n'] * 2
+    assert frames[0] is frames[1], "encoded once for all recipients"
+    assert not streams[2].frames
+    assert dict(await worker.client.pubsub_numsub(CONTACT_EVENTS_CHANNEL))[CONTACT_EVENTS_CHANNEL.encode()] == 1
+
+    await publisher.publish_many([([2], "create", {"id": 8}), ([], "update", {"id": 9}), ([2], "delete", {"id": 8})])
+    frames = [await asyncio.wait_for(streams[2].next_frame(), 1) for _ in range(2)]
+    assert frames == [b'event: create\ndata: {"id":8}\n\n', b'event: delete\ndata: {"id":8}\n\n']
+
+    listener.cancel()
+    await publisher.client.aclose()
+    await worker.client.aclose()
+
+async def test_contact_event_stream_heartbeat_and_slow_consumer():
+    hub = ContactEventHub(FakeAsyncRedis(), buffer_size=2)
+    body = hub.stream(1)
+    assert await anext(body) == b"retry: 5000\n\n"
+    [subscriber] = hub.subscribers[1]
+
+    hub.heartbeat()
+    hub.heartbeat()
+    assert list(subscriber.frames) == [HEARTBEAT_FRAME], "no heartbeats pile up behind pending frames"
+    assert await anext(body) == HEARTBEAT_FRAME
+
+    for contact_id in range(3):
+        hub.dispatch({"users": [1], "event": "update", "data": {"id": contact_id}})
+    assert (hub.delivered, hub.dropped, hub.connections) == (2, 1, 0)
+    assert await anext(body) == RESYNC_FRAME
+    with pytest.raises(StopAsyncIteration):
+        await anext(body)
+
+def test_subscriber_buffer_is_bounded():
+    subscriber = Subscriber(1, max_frames=1)
+    assert subscriber.push(b"a") is True
+    assert subscriber.push(b"b") is False
+    assert subscriber.overflowed and not subscriber.frames